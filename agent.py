@@ -1,549 +1,1365 @@
-
-import json
-import random
-from datetime import datetime, timedelta
-from typing import TypedDict, Literal, Optional, List
-from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_ollama import ChatOllama
-from langchain_core.messages import HumanMessage, SystemMessage
-from datetime import datetime, timedelta
-from pydantic import BaseModel
-from typing import Literal
-import re
-
-
-llm = ChatOllama(model="llama3.1")
-
-class AgentState(TypedDict):
-    # Input
-    raw_email: str
-    patient_name: str
-    patient_age: Optional[int]
-    patient_email: str
-    requested_date: Optional[str]
-    requested_time: str
-    # Availability
-    available_slots: List[str]
-    selected_slot: Optional[str]
-    # Human-in-loop
-    human_approved: bool
-    human_feedback: Optional[str]
-    # Draft email
-    draft_email: Optional[str]
-    confirmation_email: Optional[str]
-    proposed_slots: List[str]
-    # Patient response
-    patient_response: Optional[str]
-    # Status tracking
-    status: str
-    iteration: int
-    logs: List[str]
-
-
-
-# ---- Structured output for the email ----
-class AppointmentEmail(BaseModel):
-    to: str
-    subject: str
-    body: str
-
-class SlotResponse(BaseModel):
-    accepted: bool
-    body: str
-
-class ParseEmail(BaseModel):
-    patient_name: str
-    patient_age:int
-    patient_email:str
-    requested_date:str
-    requested_time:str
-
-
-# ---- Structured output ----
-class AvailabilityResult(BaseModel):
-    slot_found: bool
-    matched_slot: Optional[str]   # if slot_found = True
-    proposed_slots: List[str]     # if slot_found = False, suggest alternatives
-
-
-class ConfirmationEmail(BaseModel):
-    subject: str
-    body: str
-
-class DraftEmail(BaseModel):
-    subject: str
-    body: str
-
-# ---- Patient X Agent ----
-def PatientXAgent(
-    action: Literal["write_email", "respond_to_slots"],
-    patient_info: dict|None = None,
-    context: str|None = None,
-):
-    today = datetime.now().strftime("%Y-%m-%d")
-    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
-
-    if action == "write_email":
-        prompt = f"""
-        You are Patient X. Write a professional appointment request email to a doctor.
-        
-        Patient details:
-        - Name: select patientX or patientY or patientZ
-        - fromEmail: patient@gmail.com
-        - toEmail: doctor@gmail.com
-        - Age: select age between 20 to 60
-        
-        Request a date of either today ({today}) or tomorrow ({tomorrow}) give a particular date.
-        Preferred time: select any time between 9:00 AM and 11:00 PM give a particular time .
-        
-        Return structured output with all fields filled.
-        """
-        structured_llm = llm.with_structured_output(AppointmentEmail)
-        response = structured_llm.invoke(prompt)
-        print("Generated Email:", response)
-        return response
-
-    elif action == "respond_to_slots":
-       
-        
-        prompt = f"""
-        You are Patient X. A doctor's office has proposed new appointment slots 
-        because your original request didn't match availability.
-        
-        Patient details:
-        - Name: {patient_info['name']}
-        - Age: {patient_info['age']}
-        - Context: {context}
-        
-        Review the slots. If any work for the patient , 
-        accept the best one and write a confirmation reply with requested slot in the format example: "I confirm the appointment for 2025-01-21 at 2:00 PM. Thank you!".
-        strictly choose from the proposed slots in context and do not make up new slots.
-        Return structured output.
-        """
-        structured_llm = llm.with_structured_output(SlotResponse)
-        response = structured_llm.invoke(prompt)
-        print("Generated Slot Response:", response)
-        return response
-
-def scan_and_parse_email(state: AgentState) -> dict:   # ← state, not AgentState
-    raw_email_body = state["raw_email"]
-    status = state["status"]
-    if status!="patient_accepted":
-         
-            prompt = f"""
-            You are an email parser for a medical scheduling system.
-            Extract the following fields from the patient's email below.
-            
-            Email:
-            ---
-            {raw_email_body}
-            ---
-            
-            Rules:
-            - requested_date: format as YYYY-MM-DD. If not mentioned, use today's date.
-            - requested_time: format as HH:MM AM/PM. If not mentioned, use "09:00 AM".
-            - patient_age: extract as positive integer if not present take 25 as default.
-            - patient_email: extract from email body or headers if not present take it as <name_of_patient>@gmail.com.
-            """
-
-            structured_llm = llm.with_structured_output(ParseEmail)
-            response: ParseEmail = structured_llm.invoke(prompt)
-
-            log_entry = f"[scan_and_parse_email] Parsed email for {response.patient_name}"
-
-            # ← Return dict to update AgentState
-            return {
-                "patient_name": response.patient_name,
-                "patient_age": response.patient_age,
-                "patient_email": response.patient_email,
-                "requested_date": response.requested_date,
-                "requested_time": response.requested_time,
-                "status": "email_parsed",
-                "logs": state.get("logs", []) + [log_entry]
-            }
-    else:
-        # If we are here, it means we are processing a patient response email with proposed slots
-        log_entry = f"[scan_and_parse_email] Processing patient response email with context: {state['patient_response']}"
-        prompt = f"""
-            You are an email parser for a medical scheduling system.
-            Extract the following fields from the patient's email below.
-            
-            Email:
-            ---
-            {state['patient_response']}
-            ---
-            
-            Rules:
-            - requested_date: format as YYYY-MM-DD. If not mentioned, use today's date.
-            - requested_time: format as HH:MM AM/PM. If not mentioned, use "09:00 AM".
-          
-            """
-
-        structured_llm = llm.with_structured_output(ParseEmail)
-        response: ParseEmail = structured_llm.invoke(prompt)
-
-        log_entry = f"[scan_and_parse_email] Parsed response email for {response.patient_name}"
-
-        # ← Return dict to update AgentState
-        return {
-            "requested_date": response.requested_date,
-            "requested_time": response.requested_time,
-            "status": "response_email_parsed",
-            "logs": state.get("logs", []) + [log_entry]
-        }
-      
-
-def parse_slot(slot_str: str):
-    """Parse slot string into (date, start_time, end_time) as datetime objects"""
-    # Handle formats like "2026-02-21 from 10:00AM to 11.00 AM"
-    pattern = r"(\d{4}-\d{2}-\d{2}) from (\d{1,2}[:.]\d{2}\s*(?:AM|PM)?) to (\d{1,2}[:.]\d{2}\s*(?:AM|PM)?)"
-    match = re.search(pattern, slot_str, re.IGNORECASE)
-    
-    if not match:
-        return None
-    
-    date_str, start_str, end_str = match.groups()
-
-    def normalize_time(t: str) -> str:
-        """Normalize time formats: 11.00 AM → 11:00 AM, 12:00 → 12:00 PM"""
-        t = t.strip().replace(".", ":")           # 11.00 AM → 11:00 AM
-        if not re.search(r"(AM|PM)", t, re.IGNORECASE):
-            t += " PM"                            # "12:00" → "12:00 PM"
-        return t
-
-    try:
-        start_dt = datetime.strptime(f"{date_str} {normalize_time(start_str)}", "%Y-%m-%d %I:%M%p")
-        end_dt   = datetime.strptime(f"{date_str} {normalize_time(end_str)}",   "%Y-%m-%d %I:%M%p")
-        return start_dt, end_dt, slot_str
-    except ValueError:
-        return None
-
-
-
-
-def check_availability(state: AgentState) -> dict:
-    requested_date = state["requested_date"]   # "2026-02-21"
-    requested_time = state["requested_time"]   # "10:00 AM"
-    available_slots = list(state["available_slots"])  # copy so we can pop
-
-    # ---- Parse requested datetime ----
-    try:
-        requested_dt = datetime.strptime(f"{requested_date} {requested_time}", "%Y-%m-%d %I:%M %p")
-    except ValueError:
-        return {
-            "status": "slot_not_found",
-            "logs": state["logs"] + ["[check_availability] Could not parse requested date/time"]
-        }
-
-    matched_slot = None
-
-    # ---- Search for matching slot ----
-    for slot_str in available_slots:
-        parsed = parse_slot(slot_str)
-        if parsed is None:
-            continue
-        start_dt, end_dt, original = parsed
-
-        # Check if requested time falls within the slot window
-        if start_dt.date() == requested_dt.date() and start_dt <= requested_dt < end_dt:
-            matched_slot = original
-            available_slots.remove(original)   # ← pop matched slot
-            break
-
-    log_entry = f"[check_availability] matched={matched_slot}"
-
-    if matched_slot:
-        return {
-            "selected_slot": matched_slot,
-            "available_slots": available_slots,     # ← updated list without matched slot
-            "proposed_slots": [],
-            "status": "slot_found",
-            "logs": state["logs"] + [log_entry]
-        }
-    else:
-        # Propose 3 slots from same date if possible, else any
-        same_date = [s for s in available_slots if requested_date in s]
-        proposed = same_date[:] if same_date else available_slots[:]
-        print( {
-            "selected_slot": None,
-            "available_slots": available_slots,
-            "proposed_slots": proposed,
-            "status": "slot_not_found",
-            "logs": state["logs"] + [log_entry]
-        })
-        return {
-            "selected_slot": None,
-            "available_slots": available_slots,
-            "proposed_slots": proposed,
-            "status": "slot_not_found",
-            "logs": state["logs"] + [log_entry]
-        }
-
-
-def route_after_availability(state: AgentState) -> Literal["book_appointment", "draft_new_slots_email"]:
-    """Conditional edge: route based on slot availability."""
-    if state["status"] == "slot_found":
-        return "book_appointment"
-    return "draft_new_slots_email"
-
-class DraftEmail(BaseModel):
-    subject: str
-    body: str
-
-def draft_new_slots_email(state: AgentState) -> dict:
-    proposed_slots = state["proposed_slots"]
-    patient_name   = state["patient_name"]
-    patient_email  = state["patient_email"]
-    requested_date = state["requested_date"]
-    requested_time = state["requested_time"]
-
-    prompt = f"""
-    You are a medical scheduling assistant.
-    The patient's requested slot was not available. 
-    Write a polite email to the patient proposing alternative appointment slots.
-    
-    Patient Details:
-    - Name          : {patient_name}
-    - Email         : {patient_email}
-    - Requested Date: {requested_date}
-    - Requested Time: {requested_time}
-    
-    Alternative Slots Available:
-    {chr(10).join(f"  - {slot}" for slot in proposed_slots)}
-    
-    The email should:
-    - Apologize that the requested slot is unavailable
-    - Clearly list the proposed alternative slots
-    - Ask the patient to reply with their preferred slot
-    - Keep a professional and friendly tone
-    """
-
-    structured_llm = llm.with_structured_output(DraftEmail)
-    response: DraftEmail = structured_llm.invoke(prompt)
-
-    log_entry = f"[draft_new_slots_email] Draft created for {patient_name} with {len(proposed_slots)} proposed slots"
-
-    return {
-        "draft_email"   : response.body,
-        "status"        : "draft_ready",
-        "logs"          : state["logs"] + [log_entry]
-    }
-
-def human_review(state: AgentState) -> AgentState:
-    """Skip blocking input() when running from Streamlit."""
-    logs = state.get("logs", [])
-    
-    # ← Streamlit handles approval via UI buttons, so auto-pass here
-    logs.append("👤 Human Review: Passed to Streamlit UI for approval")
-    return {
-        **state,
-        "human_approved": False,   # UI will handle this
-        "status": "draft_ready",   # Stop here, UI takes over
-        "logs": logs,
-    }
-
-def send_proposed_slots_email(state: AgentState) -> AgentState:
-    """Send the approved email to Patient X."""
-    logs = state.get("logs", [])
-    logs.append("📤 Sending proposed slots email to Patient X...")
-    # send email
-    logs.append("   Email sent. Waiting for patient response...")
-
-    return {**state, "status": "waiting_patient_response", "logs": logs}
-
-def receive_patient_response(state: AgentState) -> AgentState:
-    patient_info = {
-    "name": state["patient_name"],
-    "email": state["patient_email"],
-    "age": state["patient_age"]}
-    PatientXAgent_response = PatientXAgent(
-        action="respond_to_slots",
-        context=state["draft_email"],
-        patient_info=patient_info
-    )
-    logs = state.get("logs", [])
-    
-    logs.append(f"📥 Received patient response: {PatientXAgent_response.body}")
-    if PatientXAgent_response.accepted:
-        status = "patient_accepted"
-        logs.append("   Patient accepted a proposed slot.")
-    else:
-        status = "patient_declined"
-        logs.append("   Patient declined the proposed slots.")
-    return {
-        **state,
-        "patient_response": PatientXAgent_response.body,
-        "status": status,
-        "logs": logs
-    }
-
-def route_after_patient_response(state: AgentState):
-    """Conditional edge: route based on patient's response to proposed slots."""
-    if state["status"] == "patient_accepted":
-        return "scan_and_parse_email"  # Loop back to re-parse patient's response email for the accepted slot
-    return "end"
-
-def book_appointment(state: AgentState) -> dict:
-    confirmed_slot = state["selected_slot"]
-    patient_email  = state["patient_email"]
-    patient_name   = state["patient_name"]
-    patient_age    = state["patient_age"]
-
-    prompt = f"""
-    You are a medical scheduling assistant.
-    Generate a professional appointment confirmation email from doctorX for the patient.
-    
-    Patient Details:
-    - Name  : {patient_name}
-    - Age   : {patient_age}
-    - Email : {patient_email}
-    
-    Confirmed Appointment Slot: {confirmed_slot}
-    
-    The email should:
-    - Confirm the appointment date and time clearly
-    - Ask the patient to arrive 10 minutes early
-    - Mention to bring any previous medical records
-    - Provide a cancellation/rescheduling note
-    """
-
-    structured_llm = llm.with_structured_output(ConfirmationEmail)
-    response: ConfirmationEmail = structured_llm.invoke(prompt)
-
-    log_entry = f"[appointment_confirmation] Confirmation email generated for {patient_name} at {confirmed_slot}"
-
-    return {
-        "confirmation_email": response.body,
-        "status": "confirmation_sent",
-        "logs": state["logs"] + [log_entry]
-    }
-
-
-
-# ---- Build the graph ----
-graph_builder = StateGraph(AgentState)
-graph_builder.add_node("scan_and_parse_email", scan_and_parse_email)
-graph_builder.add_node("check_availability", check_availability)
-graph_builder.add_node("draft_new_slots_email", draft_new_slots_email)
-graph_builder.add_node("human_review", human_review)
-graph_builder.add_node("send_proposed_slots_email", send_proposed_slots_email)
-graph_builder.add_node("receive_patient_response", receive_patient_response)
-graph_builder.add_node("book_appointment",book_appointment)
-# graph_builder.add_node("",)
-
-graph_builder.set_entry_point("scan_and_parse_email")
-graph_builder.add_edge("scan_and_parse_email", "check_availability")
-graph_builder.add_conditional_edges(
-        "check_availability",
-        route_after_availability,
-        {
-            "book_appointment": "book_appointment",
-            "draft_new_slots_email": "draft_new_slots_email",
-        },
-    )
-graph_builder.add_edge("draft_new_slots_email","human_review")
-graph_builder.add_edge("human_review","send_proposed_slots_email")
-graph_builder.add_edge("send_proposed_slots_email","receive_patient_response")
-# graph_builder.add_edge("receive_patient_response","scan_and_parse_email")  # Loop back to re-parse patient's response email
-graph_builder.add_conditional_edges(
-        "receive_patient_response",
-        route_after_patient_response,
-        {
-            "scan_and_parse_email": "scan_and_parse_email",
-            "end": END
-        },
-    )
-graph_builder.add_edge("book_appointment",END)
-
-graph = graph_builder.compile()
-
-# available_slots: 
-
-initial_state = {
-    "raw_email": "",
-    "patient_name": "",
-    "patient_age": None,
-    "patient_email": "",
-    "requested_date": None,
-    "requested_time": None,
-    "available_slots": [
-    "2026-02-21 from 9:00AM to 10:00AM",
-    "2026-02-21 from 10:00AM to 11:00AM",
-    "2026-02-21 from 11:00AM to 12:00PM",
-    "2026-02-21 from 1:00PM to 2:00PM",
-    "2026-02-21 from 2:00PM to 3:00PM",   # ← was 2:00AM
-    "2026-02-21 from 3:00PM to 4:00PM",   # ← was 3:00AM
-    "2026-02-22 from 10:00AM to 11:00AM",
-    "2026-02-22 from 1:00PM to 2:00PM",
-    "2026-02-22 from 2:00PM to 3:00PM",   # ← was 2:00AM
-    "2026-02-22 from 3:00PM to 4:00PM",   # ← was 3:00AM
-    ],
-    "selected_slot": None,
-    "human_approved": False,
-    "human_feedback": None,
-    "patient_response": None,
-    "draft_email": None,
-    "proposed_slots": [],
-    "status": "started",
-    "iteration": 0,
-    "logs": []
-}
-# while True:
-#     i = input("Enter 0 to stop, any other number to continue: ")
-#     if i == "0":
-#         break
-
-#     # ---- Generate a fresh patient email each iteration ----
-#     patient_response = PatientXAgent(action="write_email")
-#     print(f"\n📧 Patient Email:\n{patient_response.body}\n")
-
-#     initial_state["raw_email"] = patient_response.body  # ← update each time
-
-#     result = graph.invoke(initial_state)
-
-#     # ---- Update available slots for next iteration ----
-#     initial_state["available_slots"] = result.get("available_slots", initial_state["available_slots"])
-
-#     print("✅ Result:")
-#     print(f"  Name            : {result['patient_name']}")
-#     print(f"  Age             : {result['patient_age']}")
-#     print(f"  Email           : {result['patient_email']}")
-#     print(f"  Date            : {result['requested_date']}")
-#     print(f"  Time            : {result['requested_time']}")
-#     print(f"  Status          : {result['status']}")
-#     print(f"  Selected Slot   : {result['selected_slot']}")
-#     print(f"  Proposed Slots  : {result['proposed_slots']}")
-#     print(f"  Draft Email     : {result['draft_email']}")
-#     print(f"  Available Slots : {result['available_slots']}")
-#     print(f"  Logs            : {result['logs']}")
-#     print("-" * 60)
-
-
-
-# agent.py (add at the bottom)
-
-def run_agent(raw_email: str, available_slots: list) -> dict:
-    """Single entry point for the Streamlit UI to call."""
-    initial_state = {
-        "raw_email": raw_email,
-        "patient_name": "",
-        "patient_age": None,
-        "patient_email": "",
-        "requested_date": None,
-        "requested_time": None,
-        "available_slots": available_slots,
-        "selected_slot": None,
-        "human_approved": False,
-        "human_feedback": None,
-        "patient_response": None,
-        "draft_email": None,
-        "confirmation_email": None,
-        "proposed_slots": [],
-        "status": "started",
-        "iteration": 0,
-        "logs": []
-    }
-    result = graph.invoke(initial_state)
-    return result
-
+
+import json
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Annotated, TypedDict, Literal, Optional, List
+from langgraph.graph import StateGraph, END
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.types import Command, interrupt
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from datetime import datetime, timedelta
+from pydantic import BaseModel, ValidationError, create_model
+from langchain_core.exceptions import OutputParserException
+from typing import Literal
+import os
+import re
+import time
+import asyncio
+import functools
+import uuid
+import weakref
+from slot_calendar import SlotCalendar, normalize_doctor
+from fast_parser import (fast_parse_email, fast_path_stats, extract_doctor, extract_specialty, normalize_date,
+                         normalize_time, PARSE_FIELDS, REPLY_FIELDS)
+from llm_cache import StructuredLLMCache
+from email_templates import render_email, DEFAULT_CLINIC, DEFAULT_LANGUAGE
+from checkpointing import LocalSqliteSaver, CHECKPOINT_DB
+from review_queue import ReviewQueue, ReviewNotPending
+from reservations import ReservationStore
+from tracing import tracer
+from llm_clients import LLMRouter
+from event_log import Event, append_events, event_log, new_event
+from mail_ingest import INBOUND, InboundMail, MailStore, SmtpSender
+from thread_index import ThreadIndex
+from speculation import Speculator, aresult
+
+
+logger = logging.getLogger(__name__)
+
+# Pooled, kept-alive Ollama clients over OLLAMA_HOSTS, one set per model; NODE_MODELS picks a node's model
+llm_router = LLMRouter.from_env()
+LLM_MAX_CONCURRENCY = 4   # parallel requests we allow against each Ollama endpoint
+
+# ---- Structured output cache ----
+# Extraction calls (email / reply parsing) are always cached. Generative calls
+# (drafts, confirmations, the patient simulator) only when CACHE_GENERATIVE is on,
+# since there we usually want a fresh wording each time.
+llm_cache = StructuredLLMCache(max_entries=1024, db_path=os.environ.get("LLM_CACHE_DB"))
+CACHE_GENERATIVE = False
+
+# Bookings and holds shared by every session / worker process (RESERVATIONS_DB)
+reservations = ReservationStore()
+
+# Message ids of every conversation (MAIL_DB); emails go out over SMTP only when SMTP_URL is set
+mail_store = MailStore()
+outbox = SmtpSender.from_env(mail_store)
+# Message-ID / patient address → conversation, so a reply resumes the thread waiting for it (THREAD_INDEX_DB)
+thread_index = ThreadIndex()
+
+# Alternatives offered when the requested slot is gone: the nearest few, not the whole calendar
+PROPOSED_SLOTS_MAX = int(os.environ.get("PROPOSED_SLOTS_MAX", 5))
+
+# ---- Model escalation ----
+# Extraction nodes run on the small model (see NODE_MODELS in llm_clients.py).
+# An answer that does not validate against the schema, or whose checked fields
+# still look wrong after repair (below), is asked again on the large model. Answers are cached under the
+# node's model, so a prompt that needed escalating is not escalated twice.
+ESCALATION_ERRORS = (ValidationError, OutputParserException)
+
+def _is_date(value) -> bool:
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def _is_time(value) -> bool:
+    try:
+        datetime.strptime(value, "%I:%M %p")
+        return True
+    except (TypeError, ValueError):
+        return False
+
+FIELD_CHECKS = {
+    "patient_name": lambda v: bool(v and v.strip()),
+    "patient_age": lambda v: isinstance(v, int) and 0 < v < 120,
+    "patient_email": lambda v: bool(v) and "@" in v,
+    "requested_date": _is_date,
+    "requested_time": _is_time,
+    "body": lambda v: bool(v and v.strip()),
+}
+
+def invalid_fields(response, fields) -> List[str]:
+    """The `fields` of a structured answer that fail FIELD_CHECKS."""
+    return [f for f in fields if not FIELD_CHECKS[f](getattr(response, f, None))]
+
+# ---- Repair ----
+# Before escalating, a bad answer is repaired in place. Loose dates and times
+# ("10:00AM", "March 2nd, 2026") are normalized locally. Fields still invalid
+# after that are asked for again on the same model. The repair prompt is the
+# original prompt (so Ollama reuses its cached prefix) plus a note on what was
+# wrong, and the answer holds only those fields. After REPAIR_MAX_RETRIES
+# attempts the answer goes on to escalation as it is.
+REPAIR_MAX_RETRIES = int(os.environ.get("REPAIR_MAX_RETRIES", 2))
+
+FIELD_NORMALIZERS = {"requested_date": normalize_date, "requested_time": normalize_time}
+FIELD_RULES = {
+    "patient_name": "the patient's name",
+    "patient_age": "a positive integer",
+    "patient_email": "an email address",
+    "requested_date": "YYYY-MM-DD",
+    "requested_time": "HH:MM AM/PM, e.g. 09:30 AM",
+    "body": "non-empty text",
+}
+
+def normalize_fields(response, fields):
+    """Copy of `response` with the invalid `fields` that FIELD_NORMALIZERS can fix, fixed."""
+    updates = {}
+    for field in fields:
+        value = getattr(response, field, None)
+        if field in FIELD_NORMALIZERS and not FIELD_CHECKS[field](value):
+            fixed = FIELD_NORMALIZERS[field](value)
+            if fixed is not None:
+                updates[field] = fixed
+    return response.model_copy(update=updates) if updates else response
+
+@functools.lru_cache(maxsize=None)
+def repair_schema(schema, fields: tuple):
+    """`schema` cut down to `fields`; cached so LLMClients builds its runnable once."""
+    return create_model(f"{schema.__name__}Repair", **{f: (schema.model_fields[f].annotation, ...) for f in fields})
+
+def repair_prompt(prompt: str, response, invalid) -> str:
+    wrong = "\n".join(f"- {f}: {getattr(response, f, None)!r}, expected {FIELD_RULES[f]}" for f in invalid)
+    return f"""{prompt}
+    Your previous answer had these fields wrong:
+    {wrong}
+    Return only these fields, corrected.
+    """
+
+def repair_fields(clients, schema, prompt: str, response, fields=()):
+    """Normalize `fields`, then re-prompt for the ones still invalid, at most REPAIR_MAX_RETRIES times."""
+    if response is None or isinstance(response, Exception):
+        return response
+    response = normalize_fields(response, fields)
+    for _ in range(REPAIR_MAX_RETRIES):
+        invalid = tuple(invalid_fields(response, fields))
+        if not invalid:
+            break
+        tracer.repair()
+        with tracer.llm_call():
+            try:
+                fix = clients.structured(repair_schema(schema, invalid)).invoke(repair_prompt(prompt, response, invalid))
+            except ESCALATION_ERRORS:
+                continue
+        response = normalize_fields(response.model_copy(update=fix.model_dump()), fields)
+    return response
+
+async def arepair_fields(clients, schema, prompt: str, response, fields=()):
+    if response is None or isinstance(response, Exception):
+        return response
+    response = normalize_fields(response, fields)
+    for _ in range(REPAIR_MAX_RETRIES):
+        invalid = tuple(invalid_fields(response, fields))
+        if not invalid:
+            break
+        tracer.repair()
+        with tracer.llm_call():
+            try:
+                fix = await clients.structured(repair_schema(schema, invalid)).ainvoke(repair_prompt(prompt, response, invalid))
+            except ESCALATION_ERRORS:
+                continue
+        response = normalize_fields(response.model_copy(update=fix.model_dump()), fields)
+    return response
+
+def escalation_reason(node: Optional[str], response, fields=()) -> Optional[str]:
+    """Why `node`'s answer should be redone on the large model, or None to keep it."""
+    if llm_router.escalation(node) is None:
+        return None
+    if isinstance(response, ESCALATION_ERRORS):
+        return type(response).__name__
+    if isinstance(response, Exception):
+        return None   # connection errors and the like are not the model's fault
+    if response is None:
+        return "no structured output"
+    invalid = invalid_fields(response, fields)
+    return f"invalid {', '.join(invalid)}" if invalid else None
+
+def escalated(node: Optional[str], reason: str):
+    tracer.escalation()
+    logger.info("escalating %s to %s: %s", node, llm_router.default_model, reason)
+
+def invoke_structured(schema, prompt: str, cache: bool = True, node: Optional[str] = None, fields=()):
+    """
+    Structured LLM call on `node`'s model, served from llm_cache when possible.
+    Invalid `fields` are repaired (repair_fields), then escalated (escalation_reason).
+    """
+    clients = llm_router.for_node(node)
+    if cache:
+        cached = llm_cache.get(clients.model, schema, prompt)
+        if cached is not None:
+            tracer.cache_hit()
+            return cached
+    with tracer.llm_call():
+        try:
+            response = clients.structured(schema).invoke(prompt)
+        except ESCALATION_ERRORS as e:
+            response = e
+    response = repair_fields(clients, schema, prompt, response, fields)
+    reason = escalation_reason(node, response, fields)
+    if reason:
+        escalated(node, reason)
+        with tracer.llm_call():
+            response = llm_router.escalation(node).structured(schema).invoke(prompt)
+        response = normalize_fields(response, fields)
+    if isinstance(response, Exception):
+        raise response
+    if cache:
+        llm_cache.put(clients.model, schema, prompt, response)
+    return response
+
+class AgentState(TypedDict):
+    # Input
+    raw_email: str
+    patient_name: str
+    patient_age: Optional[int]
+    patient_email: str
+    requested_date: Optional[str]
+    requested_time: str
+    requested_doctor: Optional[str]    # provider the patient names ("Dr. Smith")
+    requested_specialty: Optional[str] # "cardiology", ...; narrows a ResourceCalendar to those doctors
+    parse_confidence: Optional[dict]   # per-field scores when the fast path parsed the email
+    clinic: Optional[str]              # picks the email templates, see email_templates.py
+    language: Optional[str]
+    # Conversation (checkpoint thread id)
+    thread_id: str
+    # Availability (the shared SlotCalendar itself travels in config["configurable"]["calendar"])
+    selected_slot: Optional[str]
+    # Human-in-loop
+    human_approved: bool
+    human_feedback: Optional[str]
+    # Draft email
+    draft_email: Optional[str]
+    confirmation_email: Optional[str]
+    proposed_slots: List[str]
+    # Patient response
+    patient_response: Optional[str]
+    # Status tracking
+    status: str
+    iteration: int
+    logs: Annotated[List[Event], append_events]   # nodes return only new events, see event_log.py
+
+def emit(state: dict, kind: str, node: str, message: str, **data) -> List[Event]:
+    """Record an event for this conversation and return it as a `logs` delta."""
+    return [event_log.record(new_event(kind, node, message, state.get("thread_id"), state.get("patient_email"), **data))]
+
+
+
+# ---- Structured output for the email ----
+class AppointmentEmail(BaseModel):
+    to: str
+    subject: str
+    body: str
+
+class SlotResponse(BaseModel):
+    accepted: bool
+    body: str
+
+class ParseEmail(BaseModel):
+    patient_name: str
+    patient_age:int
+    patient_email:str
+    requested_date:str
+    requested_time:str
+    provider: Optional[str] = None
+    specialty: Optional[str] = None
+
+
+# ---- Structured output ----
+class AvailabilityResult(BaseModel):
+    slot_found: bool
+    matched_slot: Optional[str]   # if slot_found = True
+    proposed_slots: List[str]     # if slot_found = False, suggest alternatives
+
+
+class ConfirmationEmail(BaseModel):
+    subject: str
+    body: str
+
+class DraftEmail(BaseModel):
+    subject: str
+    body: str
+
+# ---- Patient X Agent ----
+def PatientXAgent(
+    action: Literal["write_email", "respond_to_slots"],
+    patient_info: dict|None = None,
+    context: str|None = None,
+):
+    today = datetime.now().strftime("%Y-%m-%d")
+    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+
+    if action == "write_email":
+        prompt = f"""
+        You are Patient X. Write a professional appointment request email to a doctor.
+        
+        Patient details:
+        - Name: select patientX or patientY or patientZ
+        - fromEmail: patient@gmail.com
+        - toEmail: doctor@gmail.com
+        - Age: select age between 20 to 60
+        
+        Request a date of either today ({today}) or tomorrow ({tomorrow}) give a particular date.
+        Preferred time: select any time between 9:00 AM and 11:00 PM give a particular time .
+        
+        Return structured output with all fields filled.
+        """
+        response = invoke_structured(AppointmentEmail, prompt, cache=CACHE_GENERATIVE)
+        logger.debug("Generated Email: %s", response)
+        return response
+
+    elif action == "respond_to_slots":
+        response = invoke_structured(SlotResponse, patient_slots_prompt(patient_info, context), cache=CACHE_GENERATIVE)
+        logger.debug("Generated Slot Response: %s", response)
+        return response
+
+def patient_slots_prompt(patient_info: dict, context: str|None) -> str:
+    return f"""
+        You are Patient X. A doctor's office has proposed new appointment slots 
+        because your original request didn't match availability.
+        
+        Patient details:
+        - Name: {patient_info['name']}
+        - Age: {patient_info['age']}
+        - Context: {context}
+        
+        Review the slots. If any work for the patient , 
+        accept the best one and write a confirmation reply with requested slot in the format example: "I confirm the appointment for 2025-01-21 at 2:00 PM. Thank you!".
+        strictly choose from the proposed slots in context and do not make up new slots.
+        Return structured output.
+        """
+
+def parse_email_prompt(raw_email_body: str) -> str:
+    return f"""
+            You are an email parser for a medical scheduling system.
+            Extract the following fields from the patient's email below.
+            
+            Email:
+            ---
+            {raw_email_body}
+            ---
+            
+            Rules:
+            - requested_date: format as YYYY-MM-DD. If not mentioned, use today's date.
+            - requested_time: format as HH:MM AM/PM. If not mentioned, use "09:00 AM".
+            - patient_age: extract as positive integer if not present take 25 as default.
+            - patient_email: extract from email body or headers if not present take it as <name_of_patient>@gmail.com.
+            - provider: the doctor the patient asks for, as "Dr. <Surname>". Leave empty if none is named.
+            - specialty: the medical specialty needed (e.g. cardiology, dermatology), lowercase. Leave empty if unclear.
+            """
+
+def parsed_fields(state: AgentState, response: ParseEmail) -> dict:
+    """Request fields of a parsed patient email, with the doctor / specialty normalized."""
+    return {
+        "patient_name": response.patient_name,
+        "patient_age": response.patient_age,
+        "patient_email": response.patient_email,
+        "requested_date": response.requested_date,
+        "requested_time": response.requested_time,
+        "requested_doctor": normalize_doctor(response.provider) or extract_doctor(state["raw_email"]),
+        "requested_specialty": (response.specialty or extract_specialty(state["raw_email"]) or "").lower() or None,
+    }
+
+def parsed_email_update(state: AgentState, response: ParseEmail, fast=None) -> dict:
+    """State update for a freshly parsed patient email (LLM or fast path)."""
+    suffix = " (fast path)" if fast is not None and fast.confident else ""
+    events = emit({**state, "patient_email": response.patient_email}, "parsed", "scan_and_parse_email",
+                  f"Parsed email for {response.patient_name}{suffix}",
+                  requested_date=response.requested_date, requested_time=response.requested_time, fast_path=bool(suffix))
+
+    # ← Return dict to update AgentState
+    return {
+        **parsed_fields(state, response),
+        "parse_confidence": fast.confidence if suffix else None,
+        "status": "email_parsed",
+        "logs": events
+    }
+
+def reply_email_prompt(patient_response: str) -> str:
+    return f"""
+            You are an email parser for a medical scheduling system.
+            Extract the following fields from the patient's email below.
+            
+            Email:
+            ---
+            {patient_response}
+            ---
+            
+            Rules:
+            - requested_date: format as YYYY-MM-DD. If not mentioned, use today's date.
+            - requested_time: format as HH:MM AM/PM. If not mentioned, use "09:00 AM".
+          
+            """
+
+def parsed_reply_update(state: AgentState, response: Optional[ParseEmail], fast) -> dict:
+    """State update for a parsed patient reply; `response` is None when the fast path handled it."""
+    if response is None:
+        requested_date = fast.fields["requested_date"]
+        requested_time = fast.fields["requested_time"]
+        message = f"Parsed response email for {state['patient_name']} (fast path)"
+    else:
+        requested_date = response.requested_date
+        requested_time = response.requested_time
+        message = f"Parsed response email for {response.patient_name}"
+
+    # ← Return dict to update AgentState
+    return {
+        "requested_date": requested_date,
+        "requested_time": requested_time,
+        "status": "response_email_parsed",
+        "logs": emit(state, "parsed", "scan_and_parse_email", message,
+                     requested_date=requested_date, requested_time=requested_time, fast_path=response is None)
+    }
+
+def scan_and_parse_email(state: AgentState, config: RunnableConfig = None) -> dict:   # ← state, not AgentState
+    raw_email_body = state["raw_email"]
+    status = state["status"]
+    if status!="patient_accepted":
+            # ---- Fast path: skip the LLM for mail we can parse with rules ----
+            fast = fast_parse_email(raw_email_body)
+            fast_path_stats.record(fast.confident)
+            if fast.confident:
+                response = ParseEmail(**fast.fields)
+            else:
+                speculate_email(guessed_state(state, fast), config)   # from the rules' guess, while the LLM parses
+                response: ParseEmail = invoke_structured(ParseEmail, parse_email_prompt(raw_email_body),
+                                                         node="scan_and_parse_email", fields=PARSE_FIELDS)
+
+            update = parsed_email_update(state, response, fast)
+    else:
+        # If we are here, it means we are processing a patient response email with proposed slots
+        fast = fast_parse_email(state['patient_response'], REPLY_FIELDS)
+        fast_path_stats.record(fast.confident)
+        response = None
+        if not fast.confident:
+            prompt = reply_email_prompt(state['patient_response'])
+            prefetched = speculator.claim(("reply", state.get("thread_id")), prompt)
+            response = prefetched.result() if prefetched is not None else invoke_structured(
+                ParseEmail, prompt, node="scan_and_parse_email", fields=REPLY_FIELDS)
+        update = parsed_reply_update(state, response, fast)
+    speculate_email({**state, **update}, config)   # while availability is checked and the slot committed
+    return update
+      
+
+def calendar_from(config: RunnableConfig) -> SlotCalendar:
+    """The shared calendar of this run. It lives in config, not in state, so it is
+    shared across conversations and never copied into checkpoints."""
+    return config["configurable"]["calendar"]
+
+def nearest_free_slots(calendar: SlotCalendar, requested_dt: datetime, holder: str, doctor: Optional[str] = None,
+                       specialty: Optional[str] = None, limit: int = PROPOSED_SLOTS_MAX) -> List[str]:
+    """Up to `limit` slot labels closest to the request that `holder` can still claim, best first."""
+    k = limit * 2
+    while True:
+        candidates = calendar.nearest(requested_dt, k, doctor, specialty)
+        free = reservations.free([slot.label for slot in candidates], holder)
+        if len(free) >= limit or len(candidates) < k:
+            return free[:limit]
+        k *= 2   # most of the nearest ones are held or booked elsewhere, look further out
+
+def check_availability(state: AgentState, config: RunnableConfig) -> dict:
+    requested_date = state["requested_date"]   # "2026-02-21"
+    requested_time = state["requested_time"]   # "10:00 AM"
+    calendar = calendar_from(config)
+
+    # ---- Parse requested datetime ----
+    try:
+        requested_dt = datetime.strptime(f"{requested_date} {requested_time}", "%Y-%m-%d %I:%M %p")
+    except ValueError:
+        return {
+            "status": "slot_not_found",
+            "logs": emit(state, "error", "check_availability", "Could not parse requested date/time")
+        }
+
+    # ---- Search for matching slot ----
+    # The reservation store decides who gets it, per doctor and room. A calendar
+    # only knows the bookings of its own process (a worker's knows none), so the
+    # doctors and rooms the store has as busy during the candidate slot are left
+    # out of the search; one that gets claimed in between is added and the search
+    # goes on.
+    holder = state.get("thread_id") or ""
+    doctor, specialty = state.get("requested_doctor"), state.get("requested_specialty")
+    matched_slot = None
+    busy = set()
+    slot = calendar.find(requested_dt, doctor, specialty)
+    if slot:
+        busy = reservations.busy_during(slot.start, slot.end, holder)
+        if busy.intersection(slot.claim_keys):
+            slot = calendar.find(requested_dt, doctor, specialty, busy)
+    while slot:
+        if reservations.reserve(slot.label, holder):
+            calendar.remove(slot)   # ← pop matched slot
+            matched_slot = slot.label
+            break
+        taken = reservations.busy_during(slot.start, slot.end, holder)
+        busy |= taken if taken.intersection(slot.claim_keys) else set(slot.claim_keys)
+        slot = calendar.find(requested_dt, doctor, specialty, busy)
+    if matched_slot:
+        reservations.release(holder)   # other slots we proposed earlier are no longer needed
+
+    if matched_slot:
+        return {
+            "selected_slot": matched_slot,
+            "proposed_slots": [],
+            "status": "slot_found",
+            "logs": emit(state, "availability", "check_availability", f"matched={matched_slot}", matched=matched_slot)
+        }
+    else:
+        # Propose the nearest free slots and hold them for this thread
+        proposed = reservations.hold(nearest_free_slots(calendar, requested_dt, holder, doctor, specialty), holder)
+        logger.debug("check_availability: no slot for %s %s, proposing %s", requested_date, requested_time, proposed)
+        return {
+            "selected_slot": None,
+            "proposed_slots": proposed,
+            "status": "slot_not_found",
+            "logs": emit(state, "availability", "check_availability", f"matched=None, proposing {len(proposed)} slots", proposed=proposed)
+        }
+
+
+def route_after_availability(state: AgentState) -> Literal["book_appointment", "draft_new_slots_email"]:
+    """Conditional edge: route based on slot availability."""
+    if state["status"] == "slot_found":
+        return "book_appointment"
+    return "draft_new_slots_email"
+
+class DraftEmail(BaseModel):
+    subject: str
+    body: str
+
+def draft_email_prompt(state: AgentState) -> str:
+    proposed_slots = state["proposed_slots"]
+    patient_name   = state["patient_name"]
+    patient_email  = state["patient_email"]
+    requested_date = state["requested_date"]
+    requested_time = state["requested_time"]
+
+    return f"""
+    You are a medical scheduling assistant.
+    The patient's requested slot was not available. 
+    Write a polite email to the patient proposing alternative appointment slots.
+    
+    Patient Details:
+    - Name          : {patient_name}
+    - Email         : {patient_email}
+    - Requested Date: {requested_date}
+    - Requested Time: {requested_time}
+    
+    Alternative Slots Available:
+    {chr(10).join(f"  - {slot}" for slot in proposed_slots)}
+    
+    The email should:
+    - Apologize that the requested slot is unavailable
+    - Clearly list the proposed alternative slots
+    - Ask the patient to reply with their preferred slot
+    - Keep a professional and friendly tone
+    """
+
+def drafted_email_update(state: AgentState, response: DraftEmail) -> dict:
+    return {
+        "draft_email"   : response.body,
+        "status"        : "draft_ready",
+        "logs"          : emit(state, "draft", "draft_new_slots_email",
+                               f"Draft created for {state['patient_name']} with {len(state['proposed_slots'])} proposed slots")
+    }
+
+def draft_new_slots_email(state: AgentState) -> dict:
+    response: DraftEmail = compose_email("proposal", DraftEmail, state)
+    return drafted_email_update(state, response)
+
+def human_review(state: AgentState) -> AgentState:
+    """Pause this thread until a reviewer approves, edits or rejects the draft."""
+    # interrupt() checkpoints and stops here; the node re-runs from the top when
+    # the thread is resumed with Command(resume={"approved": ..., "draft_email": ..., "feedback": ...})
+    decision = interrupt({
+        "thread_id": state.get("thread_id"),
+        "patient_name": state["patient_name"],
+        "draft_email": state["draft_email"],
+        "proposed_slots": state["proposed_slots"],
+    })
+    approved = bool(decision.get("approved"))
+    draft = decision.get("draft_email") or state["draft_email"]
+    if approved:
+        message = "👤 Human Review: draft approved" + (" (edited)" if draft != state["draft_email"] else "")
+    else:
+        message = f"👤 Human Review: draft rejected{': ' + decision['feedback'] if decision.get('feedback') else ''}"
+        reservations.release(state.get("thread_id") or "")
+    return {
+        **state,
+        "draft_email": draft,
+        "human_approved": approved,
+        "human_feedback": decision.get("feedback"),
+        "status": "human_approved" if approved else "draft_rejected",
+        "logs": emit(state, "review", "human_review", message, approved=approved, edited=draft != state["draft_email"]),
+    }
+
+def route_after_review(state: AgentState) -> Literal["send_proposed_slots_email", "end"]:
+    """Conditional edge: only approved drafts are sent."""
+    if state["human_approved"]:
+        return "send_proposed_slots_email"
+    return "end"
+
+def send_email(state: AgentState, body: str, subject: Optional[str] = None):
+    """Mail `body` to the patient through the outbox, threaded onto the conversation; a no-op without SMTP_URL."""
+    if outbox is not None and state.get("patient_email"):
+        message_id = outbox.send(state["patient_email"], body, state.get("thread_id"), subject)
+        if state.get("thread_id"):
+            thread_index.add_messages(state["thread_id"], [message_id])
+
+def send_proposed_slots_email(state: AgentState) -> AgentState:
+    """Send the approved email to Patient X."""
+    send_email(state, state["draft_email"])
+    if state.get("thread_id"):
+        thread_index.set_waiting(state["thread_id"], True, state.get("patient_email"))
+    events = emit(state, "sent", "send_proposed_slots_email", "📤 Proposed slots email sent. Waiting for patient response...")
+
+    return {**state, "patient_response": None, "status": "waiting_patient_response", "logs": events}
+
+def patient_reply_prompt(reply: str, draft_email: str|None) -> str:
+    return f"""
+    You are a medical scheduling assistant.
+    We proposed alternative appointment slots to a patient and they replied.
+    
+    Our email:
+    ---
+    {draft_email}
+    ---
+    
+    Patient reply:
+    ---
+    {reply}
+    ---
+    
+    Set accepted to true only if the patient picked one of the proposed slots.
+    Put the patient's reply, unchanged, in body.
+    """
+
+def patient_info_from(state: AgentState) -> dict:
+    return {
+    "name": state["patient_name"],
+    "email": state["patient_email"],
+    "age": state["patient_age"]}
+
+def patient_response_update(state: AgentState, PatientXAgent_response: SlotResponse) -> AgentState:
+    if PatientXAgent_response.accepted:
+        status = "patient_accepted"
+        message = "📥 Patient accepted a proposed slot"
+    else:
+        status = "patient_declined"
+        message = "📥 Patient declined the proposed slots"
+        reservations.release(state.get("thread_id") or "")   # free the held proposals
+    return {
+        **state,
+        "patient_response": PatientXAgent_response.body,
+        "status": status,
+        "logs": emit(state, "patient_response", "receive_patient_response", message,
+                     accepted=PatientXAgent_response.accepted, body=PatientXAgent_response.body)
+    }
+
+def receive_patient_response(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    if state.get("thread_id"):
+        thread_index.set_waiting(state["thread_id"], False)
+    if state.get("patient_response"):
+        # A real reply was handed in when the thread was resumed
+        speculate_reply(state, config)
+        PatientXAgent_response = invoke_structured(SlotResponse, patient_reply_prompt(state["patient_response"], state["draft_email"]),
+                                                   node="receive_patient_response", fields=("body",))
+    else:
+        PatientXAgent_response = PatientXAgent(
+            action="respond_to_slots",
+            context=state["draft_email"],
+            patient_info=patient_info_from(state)
+        )
+    return settled_reply(patient_response_update(state, PatientXAgent_response))
+
+def route_after_patient_response(state: AgentState):
+    """Conditional edge: route based on patient's response to proposed slots."""
+    if state["status"] == "patient_accepted":
+        return "scan_and_parse_email"  # Loop back to re-parse patient's response email for the accepted slot
+    return "end"
+
+def confirmation_email_prompt(state: AgentState) -> str:
+    confirmed_slot = state["selected_slot"]
+    patient_email  = state["patient_email"]
+    patient_name   = state["patient_name"]
+    patient_age    = state["patient_age"]
+
+    return f"""
+    You are a medical scheduling assistant.
+    Generate a professional appointment confirmation email from doctorX for the patient.
+    
+    Patient Details:
+    - Name  : {patient_name}
+    - Age   : {patient_age}
+    - Email : {patient_email}
+    
+    Confirmed Appointment Slot: {confirmed_slot}
+    
+    The email should:
+    - Confirm the appointment date and time clearly
+    - Ask the patient to arrive 10 minutes early
+    - Mention to bring any previous medical records
+    - Provide a cancellation/rescheduling note
+    """
+
+def confirmation_email_update(state: AgentState, response: ConfirmationEmail) -> dict:
+    send_email(state, response.body, response.subject)
+    return {
+        "confirmation_email": response.body,
+        "status": "confirmation_sent",
+        "logs": emit(state, "booked", "book_appointment",
+                     f"Confirmation email generated for {state['patient_name']} at {state['selected_slot']}", slot=state["selected_slot"])
+    }
+
+# ---- Email rendering ----
+# "template": render from email_templates, no LLM (default)
+# "llm_polish": render the template, then let the LLM rewrite the wording
+# "llm": original behaviour, the LLM writes the whole email from the prompt
+EMAIL_RENDER_MODE = os.environ.get("EMAIL_RENDER_MODE", "template")
+EMAIL_NODES = {"confirmation": "book_appointment", "proposal": "draft_new_slots_email"}   # for model routing
+
+def template_email(kind: Literal["confirmation", "proposal"], state: AgentState) -> dict:
+    """Subject/body for `kind` rendered from the clinic's template."""
+    clinic = state.get("clinic") or DEFAULT_CLINIC
+    language = state.get("language") or DEFAULT_LANGUAGE
+    if kind == "confirmation":
+        return render_email(kind, clinic, language, patient_name=state["patient_name"], slot=state["selected_slot"])
+    return render_email(
+        kind, clinic, language,
+        patient_name=state["patient_name"],
+        requested_date=state["requested_date"],
+        requested_time=state["requested_time"],
+        proposed_slots=state["proposed_slots"],
+    )
+
+def polish_email_prompt(email: dict) -> str:
+    return f"""
+    You are a medical scheduling assistant.
+    Rewrite the email below so it reads warm and natural.
+    Keep every date, time, slot, name and instruction exactly as written; do not add or remove slots.
+    
+    Subject: {email["subject"]}
+    
+    {email["body"]}
+    """
+
+def email_prompt(kind: Literal["confirmation", "proposal"], state: AgentState) -> Optional[str]:
+    """LLM prompt for the current render mode, or None when the template is used as is."""
+    if EMAIL_RENDER_MODE == "llm":
+        return confirmation_email_prompt(state) if kind == "confirmation" else draft_email_prompt(state)
+    if EMAIL_RENDER_MODE == "llm_polish":
+        return polish_email_prompt(template_email(kind, state))
+    return None
+
+def compose_email(kind: Literal["confirmation", "proposal"], schema, state: AgentState):
+    prompt = email_prompt(kind, state)
+    if prompt is None:
+        return schema(**template_email(kind, state))
+    prefetched = speculator.claim(("email", state.get("thread_id")), (kind, prompt))
+    if prefetched is not None:
+        return prefetched.result()
+    return invoke_structured(schema, prompt, cache=CACHE_GENERATIVE, node=EMAIL_NODES[kind])
+
+async def acompose_email(kind: Literal["confirmation", "proposal"], schema, state: AgentState):
+    prompt = email_prompt(kind, state)
+    if prompt is None:
+        return schema(**template_email(kind, state))
+    prefetched = speculator.claim(("email", state.get("thread_id")), (kind, prompt))
+    if prefetched is not None:
+        return await aresult(prefetched)
+    return await ainvoke_structured(schema, prompt, cache=CACHE_GENERATIVE, node=EMAIL_NODES[kind])
+
+# ---- Speculative prefetch ----
+# With SPECULATIVE_PREFETCH=1 and an LLM render mode, the email a conversation
+# will most likely need is started before the graph reaches it: from the rules'
+# guess while the LLM parses the email, from the parsed fields while the slot is
+# committed, and from a reply while it is being classified (together with the
+# reply's own parse). The availability outcome is predicted read-only. A branch
+# is used only if its prompt equals the one the node builds; see speculation.py.
+speculator = Speculator()
+
+def predict_availability(state: AgentState, calendar: SlotCalendar) -> Optional[tuple]:
+    """(kind, state) check_availability will most likely produce, without reserving or holding anything."""
+    try:
+        requested_dt = datetime.strptime(f"{state['requested_date']} {state['requested_time']}", "%Y-%m-%d %I:%M %p")
+    except (KeyError, TypeError, ValueError):
+        return None
+    holder = state.get("thread_id") or ""
+    doctor, specialty = state.get("requested_doctor"), state.get("requested_specialty")
+    slot = calendar.find(requested_dt, doctor, specialty)
+    if slot is not None and reservations.free([slot.label], holder):
+        return "confirmation", {**state, "selected_slot": slot.label, "proposed_slots": []}
+    proposed = nearest_free_slots(calendar, requested_dt, holder, doctor, specialty)
+    return "proposal", {**state, "selected_slot": None, "proposed_slots": proposed}
+
+def guessed_state(state: AgentState, fast) -> Optional[dict]:
+    """State as if the rule-based parse were right, when it found every field."""
+    try:
+        return {**state, **parsed_fields(state, ParseEmail(**fast.fields))}
+    except ValidationError:
+        return None
+
+def _prefetch(asynchronous: bool, key: tuple, guess, schema, prompt: str, **kwargs):
+    if asynchronous:
+        speculator.astart(key, guess, ainvoke_structured, schema, prompt, **kwargs)
+    else:
+        speculator.start(key, guess, invoke_structured, schema, prompt, **kwargs)
+
+def speculate_email(state: Optional[dict], config: Optional[RunnableConfig], asynchronous: bool = False):
+    """Start the email check_availability will most likely lead to."""
+    if not (speculator.enabled and state and state.get("thread_id") and config):
+        return
+    predicted = predict_availability(state, calendar_from(config))
+    if predicted is None:
+        return
+    kind, predicted_state = predicted
+    prompt = email_prompt(kind, predicted_state)
+    if prompt is None:
+        return   # template mode: nothing slow to prefetch
+    schema = ConfirmationEmail if kind == "confirmation" else DraftEmail
+    _prefetch(asynchronous, ("email", state["thread_id"]), (kind, prompt), schema, prompt,
+              cache=CACHE_GENERATIVE, node=EMAIL_NODES[kind])
+
+def speculate_reply(state: AgentState, config: Optional[RunnableConfig], asynchronous: bool = False):
+    """While a reply is classified: its parse, and the confirmation for the slot it seems to pick."""
+    if not (speculator.enabled and state.get("thread_id")):
+        return
+    fast = fast_parse_email(state["patient_response"], REPLY_FIELDS)
+    if not fast.confident:
+        prompt = reply_email_prompt(state["patient_response"])
+        _prefetch(asynchronous, ("reply", state["thread_id"]), prompt, ParseEmail, prompt,
+                  node="scan_and_parse_email", fields=REPLY_FIELDS)
+    if "requested_date" in fast.fields and "requested_time" in fast.fields:
+        speculate_email({**state, "requested_date": fast.fields["requested_date"],
+                         "requested_time": fast.fields["requested_time"]}, config, asynchronous)
+
+def settled_reply(update: dict) -> dict:
+    """A declined reply needs neither the reply parse nor the confirmation started for it."""
+    if update["status"] != "patient_accepted":
+        speculator.cancel(("reply", update.get("thread_id")))
+        speculator.cancel(("email", update.get("thread_id")))
+    return update
+
+def book_appointment(state: AgentState) -> dict:
+    response: ConfirmationEmail = compose_email("confirmation", ConfirmationEmail, state)
+    return confirmation_email_update(state, response)
+
+
+
+# ---- Async nodes ----
+# Same logic as the sync nodes, with the LLM calls awaited through ainvoke. All of
+# them share one semaphore per event loop so each Ollama endpoint never sees more
+# than LLM_MAX_CONCURRENCY requests, however many conversations are in flight.
+_llm_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def llm_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _llm_semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENCY * len(llm_router))
+    return semaphore
+
+async def ainvoke_structured(schema, prompt: str, cache: bool = True, node: Optional[str] = None, fields=()):
+    clients = llm_router.for_node(node)
+    if cache:
+        cached = llm_cache.get(clients.model, schema, prompt)
+        if cached is not None:
+            tracer.cache_hit()
+            return cached
+    async with llm_semaphore():
+        with tracer.llm_call():
+            try:
+                response = await clients.structured(schema).ainvoke(prompt)
+            except ESCALATION_ERRORS as e:
+                response = e
+        response = await arepair_fields(clients, schema, prompt, response, fields)
+        reason = escalation_reason(node, response, fields)
+        if reason:
+            escalated(node, reason)
+            with tracer.llm_call():
+                response = await llm_router.escalation(node).structured(schema).ainvoke(prompt)
+            response = normalize_fields(response, fields)
+    if isinstance(response, Exception):
+        raise response
+    if cache:
+        llm_cache.put(clients.model, schema, prompt, response)
+    return response
+
+async def ascan_and_parse_email(state: AgentState, config: RunnableConfig = None) -> dict:
+    if state["status"] != "patient_accepted":
+        fast = fast_parse_email(state["raw_email"])
+        fast_path_stats.record(fast.confident)
+        if fast.confident:
+            response = ParseEmail(**fast.fields)
+        else:
+            speculate_email(guessed_state(state, fast), config, asynchronous=True)
+            response = await ainvoke_structured(ParseEmail, parse_email_prompt(state["raw_email"]),
+                                                node="scan_and_parse_email", fields=PARSE_FIELDS)
+        update = parsed_email_update(state, response, fast)
+    else:
+        fast = fast_parse_email(state["patient_response"], REPLY_FIELDS)
+        fast_path_stats.record(fast.confident)
+        response = None
+        if not fast.confident:
+            prompt = reply_email_prompt(state["patient_response"])
+            prefetched = speculator.claim(("reply", state.get("thread_id")), prompt)
+            response = await aresult(prefetched) if prefetched is not None else await ainvoke_structured(
+                ParseEmail, prompt, node="scan_and_parse_email", fields=REPLY_FIELDS)
+        update = parsed_reply_update(state, response, fast)
+    speculate_email({**state, **update}, config, asynchronous=True)
+    return update
+
+async def adraft_new_slots_email(state: AgentState) -> dict:
+    response = await acompose_email("proposal", DraftEmail, state)
+    return drafted_email_update(state, response)
+
+async def abook_appointment(state: AgentState) -> dict:
+    response = await acompose_email("confirmation", ConfirmationEmail, state)
+    return confirmation_email_update(state, response)
+
+async def areceive_patient_response(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    if state.get("thread_id"):
+        thread_index.set_waiting(state["thread_id"], False)
+    if state.get("patient_response"):
+        speculate_reply(state, config, asynchronous=True)
+        response = await ainvoke_structured(SlotResponse, patient_reply_prompt(state["patient_response"], state["draft_email"]),
+                                            node="receive_patient_response", fields=("body",))
+    else:
+        response = await ainvoke_structured(SlotResponse, patient_slots_prompt(patient_info_from(state), state["draft_email"]), cache=CACHE_GENERATIVE)
+        logger.debug("Generated Slot Response: %s", response)
+    return settled_reply(patient_response_update(state, response))
+
+
+
+# ---- Build the graph ----
+# LLM nodes carry both implementations: graph.invoke runs the sync one, graph.ainvoke the async one.
+# Every node runs inside a tracing span named after it (see tracing.py).
+def node(name: str, func, afunc=None):
+    if afunc is None:
+        return tracer.traced(name)(func)
+    return RunnableLambda(tracer.traced(name)(func), afunc=tracer.traced(name)(afunc), name=name)
+
+graph_builder = StateGraph(AgentState)
+graph_builder.add_node("scan_and_parse_email", node("scan_and_parse_email", scan_and_parse_email, ascan_and_parse_email))
+graph_builder.add_node("check_availability", node("check_availability", check_availability))
+graph_builder.add_node("draft_new_slots_email", node("draft_new_slots_email", draft_new_slots_email, adraft_new_slots_email))
+graph_builder.add_node("human_review", node("human_review", human_review))
+graph_builder.add_node("send_proposed_slots_email", node("send_proposed_slots_email", send_proposed_slots_email))
+graph_builder.add_node("receive_patient_response", node("receive_patient_response", receive_patient_response, areceive_patient_response))
+graph_builder.add_node("book_appointment", node("book_appointment", book_appointment, abook_appointment))
+# graph_builder.add_node("",)
+
+graph_builder.set_entry_point("scan_and_parse_email")
+graph_builder.add_edge("scan_and_parse_email", "check_availability")
+graph_builder.add_conditional_edges(
+        "check_availability",
+        route_after_availability,
+        {
+            "book_appointment": "book_appointment",
+            "draft_new_slots_email": "draft_new_slots_email",
+        },
+    )
+graph_builder.add_edge("draft_new_slots_email","human_review")
+graph_builder.add_conditional_edges(
+        "human_review",
+        route_after_review,
+        {
+            "send_proposed_slots_email": "send_proposed_slots_email",
+            "end": END
+        },
+    )
+graph_builder.add_edge("send_proposed_slots_email","receive_patient_response")
+# graph_builder.add_edge("receive_patient_response","scan_and_parse_email")  # Loop back to re-parse patient's response email
+graph_builder.add_conditional_edges(
+        "receive_patient_response",
+        route_after_patient_response,
+        {
+            "scan_and_parse_email": "scan_and_parse_email",
+            "end": END
+        },
+    )
+graph_builder.add_edge("book_appointment",END)
+
+# human_review pauses itself via interrupt(); we also pause before waiting on the
+# patient. Both resume later from the checkpoint instead of re-running parse and availability.
+checkpointer = LocalSqliteSaver.open(CHECKPOINT_DB)
+graph = graph_builder.compile(checkpointer=checkpointer, interrupt_before=["receive_patient_response"])
+
+# Drafts paused at human_review, listed for the reviewer
+review_queue = ReviewQueue()
+
+def new_conversation_state(raw_email: str, thread_id: str|None = None) -> dict:
+    """Fresh AgentState for one incoming email."""
+    return {
+        "raw_email": raw_email,
+        "thread_id": thread_id or uuid.uuid4().hex,
+        "patient_name": "",
+        "patient_age": None,
+        "patient_email": "",
+        "requested_date": None,
+        "requested_time": None,
+        "requested_doctor": None,
+        "requested_specialty": None,
+        "parse_confidence": None,
+        "clinic": DEFAULT_CLINIC,
+        "language": DEFAULT_LANGUAGE,
+        "selected_slot": None,
+        "human_approved": False,
+        "human_feedback": None,
+        "patient_response": None,
+        "draft_email": None,
+        "confirmation_email": None,
+        "proposed_slots": [],
+        "status": "started",
+        "iteration": 0,
+        "logs": []
+    }
+
+def thread_config(thread_id: str, calendar: SlotCalendar) -> RunnableConfig:
+    return {"configurable": {"thread_id": thread_id, "calendar": calendar}}
+
+def run_agent(raw_email: str, available_slots: SlotCalendar | list, thread_id: str|None = None) -> dict:
+    """Single entry point for the Streamlit UI to call.
+
+    `available_slots` may be a SlotCalendar (booked in place) or a plain list of slot strings.
+    The run is checkpointed under `thread_id` (a new one if omitted). Drafts stop at
+    human review (continue with review_draft); sent proposals stop while waiting
+    for the patient (continue with resume_agent).
+    """
+    state = new_conversation_state(raw_email, thread_id)
+    result = graph.invoke(state, thread_config(state["thread_id"], SlotCalendar.coerce(available_slots)))
+    return queue_for_review(result)
+
+def queue_for_review(result: dict) -> dict:
+    """Put a run that stopped at human_review on the review queue."""
+    if result.get("__interrupt__"):
+        review_queue.add(result)
+    return result
+
+# Node whose output a resume update is applied as, keyed by the node the thread is paused before
+PAUSE_POINTS = {
+    "receive_patient_response": "send_proposed_slots_email",
+}
+
+def paused_after(snapshot) -> str|None:
+    for node in snapshot.next:
+        if node in PAUSE_POINTS:
+            return PAUSE_POINTS[node]
+    return None
+
+def resume_agent(thread_id: str, available_slots: SlotCalendar | list, updates: dict|None = None) -> dict:
+    """
+    Continue a paused conversation from its last checkpoint.
+
+    `updates` is merged into the saved state first, e.g.
+    {"patient_response": "<reply text>"} when the patient answers.
+    """
+    config = thread_config(thread_id, SlotCalendar.coerce(available_slots))
+    if updates:
+        graph.update_state(config, updates, as_node=paused_after(graph.get_state(config)))
+    return queue_for_review(graph.invoke(None, config))
+
+def review_decision(approved: bool, draft_email: str|None, feedback: str|None) -> Command:
+    return Command(resume={"approved": approved, "draft_email": draft_email, "feedback": feedback})
+
+def review_draft(thread_id: str, available_slots: SlotCalendar | list, approved: bool,
+                 draft_email: str|None = None, feedback: str|None = None) -> dict:
+    """
+    Resume a thread paused at human_review. Approved drafts (optionally edited via
+    `draft_email`) are sent and the thread waits on the patient; rejected ones end.
+    Raises ReviewNotPending if the draft is not waiting for review any more.
+    """
+    config = thread_config(thread_id, SlotCalendar.coerce(available_slots))
+    if not review_queue.decide(thread_id, approved, draft_email, feedback):
+        raise ReviewNotPending(thread_id)
+    try:
+        result = graph.invoke(review_decision(approved, draft_email, feedback), config)
+    except BaseException:
+        review_queue.reopen(thread_id)
+        raise
+    return queue_for_review(result)
+
+def review_drafts(thread_ids: List[str], available_slots: SlotCalendar | list, approved: bool,
+                  feedback: str|None = None) -> List[dict]:
+    """Bulk approve / reject. Each thread resumes independently; no LLM call is involved.
+    Threads decided elsewhere in the meantime are skipped, so match results by thread_id."""
+    calendar = SlotCalendar.coerce(available_slots)
+    results = []
+    for thread_id in thread_ids:
+        try:
+            results.append(review_draft(thread_id, calendar, approved, feedback=feedback))
+        except ReviewNotPending:
+            logger.info("review_drafts: %s is no longer pending, skipped", thread_id)
+    return results
+
+def conversation_state(thread_id: str) -> dict:
+    """Latest checkpointed state of a conversation and the nodes it is paused before."""
+    snapshot = graph.get_state({"configurable": {"thread_id": thread_id}})
+    return {**snapshot.values, "next": list(snapshot.next)}
+
+def ingest_email(mail: InboundMail, available_slots: SlotCalendar | list) -> str:
+    """
+    Handle one email read by mail_ingest. A reply to a conversation that waits on
+    the patient (found by its headers, else by its sender) resumes it from its
+    checkpoint; anything else starts a new conversation. Returns the thread_id.
+    """
+    thread_id = thread_index.resolve(mail.parents, mail.sender)
+    waiting = thread_id is not None and "receive_patient_response" in conversation_state(thread_id)["next"]
+    if not waiting:
+        thread_id = uuid.uuid4().hex
+        thread_index.set_patient(thread_id, mail.sender)
+    thread_index.add_messages(thread_id, [mail.message_id, *mail.parents])
+    # recorded (not yet handled) first, so our answer is threaded onto it
+    mail_store.record(mail.message_id, thread_id, INBOUND, mail.sender, mail.subject, handled=False)
+    if waiting:
+        resume_agent(thread_id, available_slots, {"patient_response": mail.body})
+    else:
+        run_agent(mail.as_text(), available_slots, thread_id)
+    return thread_id
+
+
+# ---- Batch mode ----
+def merge_update(state: dict, update: dict):
+    """Apply a node's update to a plain state dict the way the graph would, reducers included."""
+    logs = append_events(state.get("logs"), update.get("logs"))
+    state.update(update)
+    state["logs"] = logs
+
+def _batch_structured(schema, prompts: list, cache: bool = True, node: Optional[str] = None, fields=()) -> list:
+    """
+    One batched structured call for the cache misses on `node`'s model, repairs
+    of the invalid answers one by one, then one batch on the large model for the
+    answers that still need escalating; failed items come back as exceptions.
+    """
+    clients = llm_router.for_node(node)
+    results = [llm_cache.get(clients.model, schema, p) if cache else None for p in prompts]
+    missing = [i for i, r in enumerate(results) if r is None]
+    for _ in range(len(prompts) - len(missing)):
+        tracer.cache_hit()
+    if missing:
+        with tracer.llm_call(calls=len(missing)):
+            responses = clients.batch(schema, [prompts[i] for i in missing],
+                                      max_concurrency=LLM_MAX_CONCURRENCY, return_exceptions=True)
+        redo = []
+        for j, response in enumerate(responses):
+            response = responses[j] = repair_fields(clients, schema, prompts[missing[j]], response, fields)
+            reason = escalation_reason(node, response, fields)
+            if reason:
+                escalated(node, reason)
+                redo.append(j)
+        if redo:
+            with tracer.llm_call(calls=len(redo)):
+                again = llm_router.escalation(node).batch(schema, [prompts[missing[j]] for j in redo],
+                                                          max_concurrency=LLM_MAX_CONCURRENCY, return_exceptions=True)
+            for j, response in zip(redo, again):
+                responses[j] = response if isinstance(response, Exception) else normalize_fields(response, fields)
+        for i, response in zip(missing, responses):
+            results[i] = response
+            if cache:
+                llm_cache.put(clients.model, schema, prompts[i], response)
+    return results
+
+def _compose_many(kind, schema, states: list) -> list:
+    """compose_email for many states: templates inline, LLM prompts in one batch."""
+    prompts = [email_prompt(kind, s) for s in states]
+    results = [None if p else schema(**template_email(kind, s)) for p, s in zip(prompts, states)]
+    pending = [i for i, p in enumerate(prompts) if p]
+    for i, response in zip(pending, _batch_structured(schema, [prompts[i] for i in pending], cache=CACHE_GENERATIVE,
+                                                      node=EMAIL_NODES[kind])):
+        results[i] = response
+    return results
+
+def run_agent_many(emails: List[str], calendar: SlotCalendar | list, thread_ids: Optional[List[str]] = None) -> dict:
+    """
+    Process a whole inbox in three phases: parse every email (fast path, then one
+    batched LLM call for the rest), settle availability in a single serialized pass
+    over the shared calendar so no slot is handed out twice, then generate all
+    confirmations and drafts in batched calls. Drafts stop at human review.
+    With `thread_ids` (one per email), running the batch again reuses its
+    conversations, bookings and holds instead of claiming new ones.
+    """
+    started = time.perf_counter()
+    calendar = SlotCalendar.coerce(calendar)
+    states = [new_conversation_state(raw_email, thread_id)
+              for raw_email, thread_id in zip(emails, thread_ids or [None] * len(emails))]
+    batch_id = f"batch-{uuid.uuid4().hex}"   # trace id of the phase spans below
+
+    # ---- 1. Parse ----
+    with tracer.span("scan_and_parse_email[batch]", batch_id):
+        fasts = [fast_parse_email(raw_email) for raw_email in emails]
+        for fast in fasts:
+            fast_path_stats.record(fast.confident)
+        llm_indices = [i for i, fast in enumerate(fasts) if not fast.confident]
+        parsed = {i: ParseEmail(**fast.fields) for i, fast in enumerate(fasts) if fast.confident}
+        parsed.update(zip(llm_indices, _batch_structured(ParseEmail, [parse_email_prompt(emails[i]) for i in llm_indices],
+                                                         node="scan_and_parse_email", fields=PARSE_FIELDS)))
+
+    for i, state in enumerate(states):
+        response = parsed[i]
+        if isinstance(response, Exception):
+            state["status"] = "parse_failed"
+            merge_update(state, {"logs": emit(state, "error", "scan_and_parse_email", f"Could not parse email: {response}")})
+        else:
+            merge_update(state, parsed_email_update(state, response, fasts[i]))
+
+    # ---- 2. Settle availability, one email at a time ----
+    with tracer.span("check_availability[batch]", batch_id):
+        for state in states:
+            if state["status"] == "email_parsed":
+                merge_update(state, check_availability(state, thread_config(state["thread_id"], calendar)))
+
+    # ---- 3. Generate confirmations and drafts ----
+    booked = [s for s in states if s["status"] == "slot_found"]
+    with tracer.span("book_appointment[batch]", batch_id):
+        confirmations = _compose_many("confirmation", ConfirmationEmail, booked)
+    for state, response in zip(booked, confirmations):
+        if isinstance(response, Exception):
+            calendar.add(state["selected_slot"])   # give the slot back, nobody was told about it
+            reservations.cancel(state["selected_slot"], state["thread_id"])
+            state["status"] = "generation_failed"
+            merge_update(state, {"logs": emit(state, "error", "book_appointment", f"Could not generate confirmation: {response}")})
+        else:
+            merge_update(state, confirmation_email_update(state, response))
+
+    unmatched = [s for s in states if s["status"] == "slot_not_found"]
+    with tracer.span("draft_new_slots_email[batch]", batch_id):
+        drafts = _compose_many("proposal", DraftEmail, unmatched)
+    for state, response in zip(unmatched, drafts):
+        if isinstance(response, Exception):
+            state["status"] = "generation_failed"
+            merge_update(state, {"logs": emit(state, "error", "draft_new_slots_email", f"Could not generate draft: {response}")})
+        else:
+            merge_update(state, drafted_email_update(state, response))
+            # Checkpoint the draft as if the graph had produced it, so approving it
+            # resumes the thread at human_review like any other conversation.
+            config = thread_config(state["thread_id"], calendar)
+            graph.update_state(config, state, as_node="draft_new_slots_email")
+            queue_for_review(graph.invoke(None, config))   # runs human_review up to its interrupt()
+
+    elapsed = time.perf_counter() - started
+    statuses = [s["status"] for s in states]
+    return {
+        "results": states,
+        "stats": {
+            "emails": len(states),
+            "elapsed_s": round(elapsed, 4),
+            "emails_per_s": round(len(states) / elapsed, 2) if elapsed > 0 else None,
+            "fast_path_parses": len(states) - len(llm_indices),
+            "llm_parses": len(llm_indices),
+            "confirmed": statuses.count("confirmation_sent"),
+            "drafts": statuses.count("draft_ready"),
+            "failed": statuses.count("parse_failed") + statuses.count("generation_failed"),
+        },
+    }
+
+
+async def arun_agent(raw_email: str, available_slots: SlotCalendar | list, thread_id: str|None = None) -> dict:
+    """Async twin of run_agent; LLM steps wait on the shared semaphore instead of blocking."""
+    state = new_conversation_state(raw_email, thread_id)
+    return queue_for_review(await graph.ainvoke(state, thread_config(state["thread_id"], SlotCalendar.coerce(available_slots))))
+
+async def aresume_agent(thread_id: str, available_slots: SlotCalendar | list, updates: dict|None = None) -> dict:
+    """Async twin of resume_agent."""
+    config = thread_config(thread_id, SlotCalendar.coerce(available_slots))
+    if updates:
+        await graph.aupdate_state(config, updates, as_node=paused_after(await graph.aget_state(config)))
+    return queue_for_review(await graph.ainvoke(None, config))
+
+async def areview_draft(thread_id: str, available_slots: SlotCalendar | list, approved: bool,
+                        draft_email: str|None = None, feedback: str|None = None) -> dict:
+    """Async twin of review_draft."""
+    config = thread_config(thread_id, SlotCalendar.coerce(available_slots))
+    if not review_queue.decide(thread_id, approved, draft_email, feedback):
+        raise ReviewNotPending(thread_id)
+    try:
+        result = await graph.ainvoke(review_decision(approved, draft_email, feedback), config)
+    except BaseException:
+        review_queue.reopen(thread_id)
+        raise
+    return queue_for_review(result)
+
+
+# ---- Streaming ----
+# stream_agent / astream_agent run the same graph as run_agent but yield progress
+# as it happens:
+#   {"type": "start", "thread_id": ...}
+#   {"type": "node", "node": <name>, "update": <what the node returned>}
+#   {"type": "token", "node": <name>, "text": <LLM chunk>}      (only for LLM-written parts)
+#   {"type": "done", "result": <final state, as run_agent returns it>}
+# Workers run RUN jobs through stream_agent and keep the progress on the job row
+# (worker_pool._run).
+_JSON_STRING_FIELD = {}
+
+def partial_json_field(text: str, field: str) -> str:
+    """Best-effort value of a string field from a structured-output JSON stream still being generated."""
+    pattern = _JSON_STRING_FIELD.get(field)
+    if pattern is None:
+        pattern = _JSON_STRING_FIELD[field] = re.compile(rf'"{re.escape(field)}"\s*:\s*"((?:[^"\\]|\\.)*)')
+    m = pattern.search(text)
+    if not m:
+        return ""
+    raw = m.group(1)
+    if raw.endswith("\\") and not raw.endswith("\\\\"):
+        raw = raw[:-1]   # cut in the middle of an escape
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return raw
+
+def _stream_event(mode: str, chunk) -> dict|None:
+    if mode == "messages":
+        message, metadata = chunk
+        text = message.content if isinstance(message.content, str) else ""
+        if text:
+            return {"type": "token", "node": metadata.get("langgraph_node"), "text": text}
+        return None
+    for node, update in chunk.items():
+        if node != "__interrupt__":
+            return {"type": "node", "node": node, "update": update}
+    return None
+
+def _snapshot_result(snapshot) -> dict:
+    """The final state of a streamed run, as run_agent returns it."""
+    result = dict(snapshot.values)
+    interrupts = [i for task in snapshot.tasks for i in task.interrupts]
+    if interrupts:
+        result["__interrupt__"] = interrupts
+    return queue_for_review(result)
+
+def _stream_result(config: RunnableConfig) -> dict:
+    return _snapshot_result(graph.get_state(config))
+
+async def _astream_result(config: RunnableConfig) -> dict:
+    return _snapshot_result(await graph.aget_state(config))
+
+def stream_agent(raw_email: str, available_slots: SlotCalendar | list, thread_id: str|None = None):
+    """Generator twin of run_agent yielding node updates and LLM tokens as they happen."""
+    state = new_conversation_state(raw_email, thread_id)
+    config = thread_config(state["thread_id"], SlotCalendar.coerce(available_slots))
+    yield {"type": "start", "thread_id": state["thread_id"]}
+    for mode, chunk in graph.stream(state, config, stream_mode=["updates", "messages"]):
+        event = _stream_event(mode, chunk)
+        if event:
+            yield event
+    yield {"type": "done", "result": _stream_result(config)}
+
+async def astream_agent(raw_email: str, available_slots: SlotCalendar | list, thread_id: str|None = None):
+    """Async twin of stream_agent."""
+    state = new_conversation_state(raw_email, thread_id)
+    config = thread_config(state["thread_id"], SlotCalendar.coerce(available_slots))
+    yield {"type": "start", "thread_id": state["thread_id"]}
+    async for mode, chunk in graph.astream(state, config, stream_mode=["updates", "messages"]):
+        event = _stream_event(mode, chunk)
+        if event:
+            yield event
+    yield {"type": "done", "result": await _astream_result(config)}
@@ -1,793 +1,983 @@
-import streamlit as st
-import time
-from datetime import datetime
-from typing import Optional, List
-from agent import run_agent
-# ─────────────────────────────────────────────
-# PAGE CONFIG
-# ─────────────────────────────────────────────
-st.set_page_config(
-    page_title="MedSchedule · AI Appointment Agent",
-    page_icon="🏥",
-    layout="wide",
-    initial_sidebar_state="expanded",
-)
-
-# ─────────────────────────────────────────────
-# CUSTOM CSS
-# ─────────────────────────────────────────────
-st.markdown("""
-<style>
-@import url('https://fonts.googleapis.com/css2?family=DM+Serif+Display:ital@0;1&family=DM+Mono:wght@400;500&family=DM+Sans:wght@300;400;500;600&display=swap');
-
-:root {
-    --bg: #0d1117;
-    --surface: #161b22;
-    --surface2: #1c2333;
-    --border: #30363d;
-    --accent: #2dd4bf;
-    --accent2: #f59e0b;
-    --danger: #f87171;
-    --success: #4ade80;
-    --text: #e6edf3;
-    --muted: #7d8590;
-}
-
-html, body, [class*="css"] {
-    font-family: 'DM Sans', sans-serif;
-    background-color: var(--bg);
-    color: var(--text);
-}
-
-/* Hide default streamlit chrome */
-#MainMenu, footer { visibility: hidden; }
-header { visibility: hidden; }
-.stDeployButton { display: none; }
-
-/* Force sidebar visible and styled */
-section[data-testid="stSidebar"] {
-    display: block !important;
-    visibility: visible !important;
-    min-width: 280px !important;
-    width: 280px !important;
-}
-section[data-testid="stSidebar"] > div {
-    padding-top: 1rem;
-}
-
-/* App header */
-.app-header {
-    background: linear-gradient(135deg, #0d1117 0%, #1a2744 100%);
-    border-bottom: 1px solid var(--border);
-    padding: 1.5rem 2rem;
-    margin: -1rem -1rem 2rem -1rem;
-    display: flex;
-    align-items: center;
-    gap: 1rem;
-}
-.app-title {
-    font-family: 'DM Serif Display', serif;
-    font-size: 1.8rem;
-    color: var(--accent);
-    margin: 0;
-    letter-spacing: -0.5px;
-}
-.app-subtitle {
-    font-size: 0.8rem;
-    color: var(--muted);
-    margin: 0;
-    font-family: 'DM Mono', monospace;
-    letter-spacing: 1px;
-    text-transform: uppercase;
-}
-
-/* Status badge */
-.status-badge {
-    display: inline-flex;
-    align-items: center;
-    gap: 6px;
-    padding: 4px 12px;
-    border-radius: 20px;
-    font-size: 0.75rem;
-    font-family: 'DM Mono', monospace;
-    font-weight: 500;
-    letter-spacing: 0.5px;
-}
-.status-started    { background: #1c2333; color: #7d8590; border: 1px solid #30363d; }
-.status-parsed     { background: #0d2137; color: #60a5fa; border: 1px solid #1d4ed8; }
-.status-found      { background: #0d2e1f; color: #4ade80; border: 1px solid #16a34a; }
-.status-not-found  { background: #2d1b0e; color: #fb923c; border: 1px solid #c2410c; }
-.status-draft      { background: #2d2008; color: #fbbf24; border: 1px solid #d97706; }
-.status-approved   { background: #0d2e1f; color: #4ade80; border: 1px solid #16a34a; }
-.status-sent       { background: #0d2137; color: #60a5fa; border: 1px solid #1d4ed8; }
-.status-confirmed  { background: #0d2e1f; color: #4ade80; border: 1px solid #16a34a; }
-
-/* Mail card */
-.mail-card {
-    background: var(--surface);
-    border: 1px solid var(--border);
-    border-radius: 10px;
-    padding: 1rem 1.2rem;
-    margin-bottom: 0.6rem;
-    cursor: pointer;
-    transition: all 0.15s ease;
-    position: relative;
-}
-.mail-card:hover {
-    border-color: var(--accent);
-    background: var(--surface2);
-}
-.mail-card.active {
-    border-color: var(--accent);
-    border-left: 3px solid var(--accent);
-    background: var(--surface2);
-}
-.mail-card.unread::before {
-    content: '';
-    position: absolute;
-    left: -1px;
-    top: 50%;
-    transform: translateY(-50%);
-    width: 4px;
-    height: 60%;
-    background: var(--accent);
-    border-radius: 0 2px 2px 0;
-}
-.mail-sender {
-    font-weight: 600;
-    font-size: 0.85rem;
-    color: var(--text);
-}
-.mail-subject {
-    font-size: 0.8rem;
-    color: var(--muted);
-    margin-top: 2px;
-    white-space: nowrap;
-    overflow: hidden;
-    text-overflow: ellipsis;
-}
-.mail-time {
-    font-family: 'DM Mono', monospace;
-    font-size: 0.7rem;
-    color: var(--muted);
-}
-
-/* Email viewer */
-.email-viewer {
-    background: var(--surface);
-    border: 1px solid var(--border);
-    border-radius: 12px;
-    padding: 1.5rem;
-}
-.email-viewer-header {
-    border-bottom: 1px solid var(--border);
-    padding-bottom: 1rem;
-    margin-bottom: 1rem;
-}
-.email-viewer-subject {
-    font-family: 'DM Serif Display', serif;
-    font-size: 1.3rem;
-    color: var(--text);
-}
-.email-viewer-meta {
-    font-size: 0.8rem;
-    color: var(--muted);
-    margin-top: 0.4rem;
-    font-family: 'DM Mono', monospace;
-}
-.email-body {
-    font-size: 0.9rem;
-    line-height: 1.7;
-    color: #c9d1d9;
-    white-space: pre-wrap;
-}
-
-/* Pipeline step */
-.pipeline-step {
-    display: flex;
-    align-items: center;
-    gap: 10px;
-    padding: 0.6rem 0.8rem;
-    border-radius: 8px;
-    margin-bottom: 0.4rem;
-    font-size: 0.82rem;
-}
-.pipeline-step.done     { background: #0d2e1f; color: #4ade80; }
-.pipeline-step.active   { background: #1a2744; color: #60a5fa; border: 1px solid #1d4ed8; }
-.pipeline-step.pending  { background: var(--surface); color: var(--muted); }
-.pipeline-step.error    { background: #2d1010; color: #f87171; }
-
-/* Slot pill */
-.slot-pill {
-    display: inline-block;
-    background: #0d2137;
-    border: 1px solid #1d4ed8;
-    color: #93c5fd;
-    border-radius: 6px;
-    padding: 4px 10px;
-    font-family: 'DM Mono', monospace;
-    font-size: 0.75rem;
-    margin: 3px;
-}
-
-/* Action button */
-.stButton > button {
-    font-family: 'DM Sans', sans-serif;
-    font-weight: 600;
-    border-radius: 8px;
-    border: none;
-    transition: all 0.15s ease;
-}
-
-/* Approve button */
-div[data-testid="column"]:nth-child(1) .stButton > button {
-    background: linear-gradient(135deg, #059669, #10b981);
-    color: white;
-}
-div[data-testid="column"]:nth-child(1) .stButton > button:hover {
-    background: linear-gradient(135deg, #047857, #059669);
-    transform: translateY(-1px);
-    box-shadow: 0 4px 12px rgba(16, 185, 129, 0.3);
-}
-
-/* Reject button */
-div[data-testid="column"]:nth-child(2) .stButton > button {
-    background: linear-gradient(135deg, #dc2626, #ef4444);
-    color: white;
-}
-
-/* Info box */
-.info-box {
-    background: #0d2137;
-    border: 1px solid #1d4ed8;
-    border-radius: 10px;
-    padding: 1rem;
-    margin: 0.8rem 0;
-}
-.info-box-title {
-    font-family: 'DM Mono', monospace;
-    font-size: 0.7rem;
-    text-transform: uppercase;
-    letter-spacing: 1px;
-    color: #60a5fa;
-    margin-bottom: 0.5rem;
-}
-
-/* Log entry */
-.log-entry {
-    font-family: 'DM Mono', monospace;
-    font-size: 0.75rem;
-    color: var(--muted);
-    padding: 3px 0;
-    border-bottom: 1px solid #161b22;
-}
-.log-entry:last-child { border-bottom: none; }
-
-/* Divider */
-hr { border-color: var(--border); margin: 1.5rem 0; }
-
-/* Sidebar — force visible */
-section[data-testid="stSidebar"] {
-    background: var(--surface) !important;
-    border-right: 1px solid var(--border) !important;
-    display: block !important;
-    visibility: visible !important;
-}
-section[data-testid="stSidebar"] > div:first-child {
-    padding-top: 1.5rem;
-    background: var(--surface) !important;
-}
-/* Sidebar toggle button — keep visible */
-button[data-testid="collapsedControl"] {
-    display: block !important;
-    visibility: visible !important;
-    color: var(--accent) !important;
-}
-
-/* Metric cards */
-.metric-card {
-    background: var(--surface);
-    border: 1px solid var(--border);
-    border-radius: 10px;
-    padding: 1rem;
-    text-align: center;
-}
-.metric-value {
-    font-family: 'DM Serif Display', serif;
-    font-size: 2rem;
-    color: var(--accent);
-}
-.metric-label {
-    font-size: 0.75rem;
-    color: var(--muted);
-    text-transform: uppercase;
-    letter-spacing: 1px;
-    font-family: 'DM Mono', monospace;
-}
-
-/* Scrollable containers */
-.inbox-scroll {
-    max-height: 500px;
-    overflow-y: auto;
-    padding-right: 4px;
-}
-</style>
-""", unsafe_allow_html=True)
-
-
-# ─────────────────────────────────────────────
-# SESSION STATE INIT
-# ─────────────────────────────────────────────
-def init_state():
-    if "inbox" not in st.session_state:
-        st.session_state.inbox = []          # list of mail dicts
-    if "selected_mail" not in st.session_state:
-        st.session_state.selected_mail = None
-    if "agent_state" not in st.session_state:
-        st.session_state.agent_state = None
-    if "pipeline_status" not in st.session_state:
-        st.session_state.pipeline_status = {}
-    if "available_slots" not in st.session_state:
-        st.session_state.available_slots = [
-            "2026-02-21 from 9:00AM to 10:00AM",
-            "2026-02-21 from 10:00AM to 11:00AM",
-            "2026-02-21 from 11:00AM to 12:00PM",
-            "2026-02-21 from 1:00PM to 2:00PM",
-            "2026-02-21 from 2:00PM to 3:00PM",
-            "2026-02-21 from 3:00PM to 4:00PM",
-            "2026-02-22 from 10:00AM to 11:00AM",
-            "2026-02-22 from 1:00PM to 2:00PM",
-            # "2026-02-22 from 2:00PM to 3:00PM",
-            # "2026-02-22 from 3:00PM to 4:00PM",
-        ]
-    if "waiting_human" not in st.session_state:
-        st.session_state.waiting_human = False
-    if "draft_for_review" not in st.session_state:
-        st.session_state.draft_for_review = None
-    if "run_count" not in st.session_state:
-        st.session_state.run_count = 0
-    if "confirmed_count" not in st.session_state:
-        st.session_state.confirmed_count = 0
-    if "logs" not in st.session_state:
-        st.session_state.logs = []
-
-init_state()
-
-
-# ─────────────────────────────────────────────
-# MOCK AGENT (replace with real graph.invoke)
-# ─────────────────────────────────────────────
-def mock_run_agent(raw_email: str, available_slots: list):
-    """
-    Replace this with your actual: result = graph.invoke(initial_state)
-    This mock simulates the pipeline for UI demonstration.
-    """
-    import random, re
-    from datetime import datetime, timedelta
-
-    logs = []
-    logs.append("[scan_and_parse_email] Parsing incoming email...")
-
-    # Fake parse
-    name = "PatientX"
-    for n in ["PatientX", "PatientY", "PatientZ"]:
-        if n.lower() in raw_email.lower():
-            name = n
-            break
-
-    age = random.randint(25, 60)
-    email = f"{name.lower()}@gmail.com"
-    today = datetime.now()
-    tomorrow = today + timedelta(days=1)
-    req_date = tomorrow.strftime("%Y-%m-%d") if random.random() > 0.5 else today.strftime("%Y-%m-%d")
-    hours = [9, 10, 11, 13, 14, 15]
-    req_hour = random.choice(hours)
-    req_time = f"{req_hour:02d}:00 {'AM' if req_hour < 12 else 'PM'}"
-
-    logs.append(f"[scan_and_parse_email] Parsed: {name}, age={age}, date={req_date}, time={req_time}")
-
-    # Check availability (use real parse_slot if available)
-    matched_slot = None
-    remaining = list(available_slots)
-    for slot in available_slots:
-        if req_date in slot:
-            slot_hour_match = re.search(r"(\d{1,2}):00(AM|PM)", slot, re.IGNORECASE)
-            if slot_hour_match:
-                sh = int(slot_hour_match.group(1))
-                meridiem = slot_hour_match.group(2).upper()
-                if meridiem == "PM" and sh != 12:
-                    sh += 12
-                if sh == req_hour:
-                    matched_slot = slot
-                    remaining.remove(slot)
-                    break
-
-    logs.append(f"[check_availability] matched={matched_slot}")
-
-    same_date = [s for s in remaining if req_date in s]
-    proposed = same_date[:3] if same_date else remaining[:3]
-
-    result = {
-        "patient_name": name,
-        "patient_age": age,
-        "patient_email": email,
-        "requested_date": req_date,
-        "requested_time": req_time,
-        "selected_slot": matched_slot,
-        "available_slots": remaining,
-        "proposed_slots": proposed if not matched_slot else [],
-        "status": "slot_found" if matched_slot else "slot_not_found",
-        "logs": logs,
-        "draft_email": None,
-        "confirmation_email": None,
-    }
-
-    if matched_slot:
-        result["confirmation_email"] = (
-            f"Dear {name},\n\n"
-            f"We are pleased to confirm your appointment:\n\n"
-            f"📅  {matched_slot}\n\n"
-            f"Please arrive 10 minutes early and bring any previous medical records.\n"
-            f"To reschedule, contact us at least 24 hours in advance.\n\n"
-            f"Warm regards,\nDr. Smith's Office"
-        )
-        logs.append(f"[book_appointment] Confirmation email generated for {name} at {matched_slot}")
-    else:
-        slot_list = "\n".join(f"  • {s}" for s in proposed)
-        result["draft_email"] = (
-            f"Dear {name},\n\n"
-            f"We're sorry, but your requested slot ({req_date} at {req_time}) is unavailable.\n\n"
-            f"We have the following alternative slots:\n{slot_list}\n\n"
-            f"Please reply with your preferred option.\n\n"
-            f"Regards,\nDr. Smith's Scheduling Team"
-        )
-        logs.append(f"[draft_new_slots_email] Draft created for {name} with {len(proposed)} proposed slots")
-
-    return result
-
-
-# ─────────────────────────────────────────────
-# HELPER: add mail to inbox
-# ─────────────────────────────────────────────
-def add_to_inbox(sender, subject, body, mail_type="incoming", result=None):
-    st.session_state.inbox.insert(0, {
-        "id": len(st.session_state.inbox),
-        "sender": sender,
-        "subject": subject,
-        "body": body,
-        "time": datetime.now().strftime("%H:%M"),
-        "type": mail_type,   # incoming | outgoing | confirmation | draft
-        "read": False,
-        "result": result,
-    })
-
-
-def status_badge(status: str) -> str:
-    mapping = {
-        "started":            ("status-started",   "⬜", "STARTED"),
-        "email_parsed":       ("status-parsed",    "🔵", "PARSED"),
-        "slot_found":         ("status-found",     "🟢", "SLOT FOUND"),
-        "slot_not_found":     ("status-not-found", "🟠", "NO SLOT"),
-        "draft_ready":        ("status-draft",     "🟡", "DRAFT READY"),
-        "human_approved":     ("status-approved",  "🟢", "APPROVED"),
-        "waiting_patient_response": ("status-sent","🔵", "WAITING"),
-        "confirmation_sent":  ("status-confirmed", "🟢", "CONFIRMED"),
-    }
-    css, icon, label = mapping.get(status, ("status-started", "⬜", status.upper()))
-    return f'<span class="status-badge {css}">{icon} {label}</span>'
-
-
-
-
-
-# ─────────────────────────────────────────────
-# MAIN LAYOUT
-# ─────────────────────────────────────────────
-st.markdown("""
-<div class="app-header">
-    <div>
-        <p class="app-title">MedSchedule</p>
-        <p class="app-subtitle">AI-Powered Medical Appointment Agent · LangGraph Workflow</p>
-    </div>
-</div>
-""", unsafe_allow_html=True)
-
-# Sidebar visibility hint
-if not st.session_state.inbox:
-    st.info("👈 Use the **sidebar on the left** to simulate patient emails and view available slots. If collapsed, click the **arrow `>`** at the top-left to expand it.")
-
-# Human approval banner (shown when waiting)
-if st.session_state.waiting_human and st.session_state.draft_for_review:
-    draft = st.session_state.draft_for_review
-    st.markdown(f"""
-    <div style="background:linear-gradient(135deg,#1a1500,#2d2008);border:1px solid #d97706;
-                border-radius:12px;padding:1.2rem 1.5rem;margin-bottom:1.5rem;">
-        <p style="font-family:'DM Mono',monospace;font-size:0.7rem;color:#fbbf24;
-                  letter-spacing:1px;text-transform:uppercase;margin:0 0 0.5rem 0;">
-            🔔 Human Review Required — John, please review this draft
-        </p>
-        <p style="font-size:0.85rem;color:#e6edf3;margin:0;">
-            A draft email has been generated for <strong>{draft.get('patient_name','Patient')}</strong>.
-            Approve to send, or reject to revise.
-        </p>
-    </div>
-    """, unsafe_allow_html=True)
-
-    col_approve, col_reject, col_spacer = st.columns([1, 1, 4])
-    with col_approve:
-        if st.button("✅ Approve & Send", use_container_width=True):
-            # Mark approved, add to inbox as outgoing, finalize
-            add_to_inbox(
-                sender="Dr. Smith's Office <doctor@gmail.com>",
-                subject=f"Re: Appointment Request — Alternative Slots",
-                body=draft.get("draft_email", ""),
-                mail_type="outgoing",
-                result=draft
-            )
-            st.session_state.logs.append("👤 John approved the draft ✓")
-            st.session_state.logs.append("📤 Email sent to patient.")
-            st.session_state.waiting_human = False
-            st.session_state.draft_for_review = None
-            st.session_state.run_count += 1
-            st.rerun()
-    with col_reject:
-        if st.button("❌ Reject Draft", use_container_width=True):
-            st.session_state.logs.append("👤 John rejected the draft ✗")
-            st.session_state.waiting_human = False
-            st.session_state.draft_for_review = None
-            st.rerun()
-
-# ── Four-column layout: Sidebar Controls | Inbox | Email View | Pipeline ──
-sidebar_col, inbox_col, viewer_col, pipeline_col = st.columns([1, 1, 2, 1.2])
-
-# ─── LEFT PANEL (replaces sidebar) ──────────
-with sidebar_col:
-    st.markdown("""
-    <div style="padding: 0.5rem 0 1rem 0;">
-        <p style="font-family:'DM Serif Display',serif; font-size:1.2rem; color:#2dd4bf; margin:0;">🏥 Controls</p>
-    </div>
-    """, unsafe_allow_html=True)
-
-    col1, col2 = st.columns(2)
-    with col1:
-        st.markdown(f"""
-        <div class="metric-card">
-            <div class="metric-value">{st.session_state.run_count}</div>
-            <div class="metric-label">Done</div>
-        </div>""", unsafe_allow_html=True)
-    with col2:
-        st.markdown(f"""
-        <div class="metric-card">
-            <div class="metric-value" style="color:#4ade80;">{st.session_state.confirmed_count}</div>
-            <div class="metric-label">Confirmed</div>
-        </div>""", unsafe_allow_html=True)
-
-    st.markdown("<br>", unsafe_allow_html=True)
-
-    if st.button("📨 Simulate Patient Email", use_container_width=True):
-        import random
-        names = ["PatientX", "PatientY", "PatientZ"]
-        ages  = [28, 35, 42, 55, 61]
-        name  = random.choice(names)
-        age   = random.choice(ages)
-        from datetime import timedelta
-        tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
-        hours = [ "4:00 PM"]
-        req_time = random.choice(hours)
-        body = (
-            f"From: {name.lower()}@gmail.com\n"
-            f"To: doctor@gmail.com\n"
-            f"Subject: Appointment Request\n\n"
-            f"Dear Doctor,\n\n"
-            f"My name is {name}, I am {age} years old.\n"
-            f"I would like to book an appointment on {tomorrow} at {req_time}.\n\n"
-            f"Best regards,\n{name}"
-        )
-        add_to_inbox(
-            sender=f"{name} <{name.lower()}@gmail.com>",
-            subject="Appointment Request",
-            body=body,
-            mail_type="incoming"
-        )
-        st.session_state.selected_mail = 0
-        st.rerun()
-
-    if st.button("🗑️ Clear Inbox", use_container_width=True):
-        st.session_state.inbox = []
-        st.session_state.selected_mail = None
-        st.session_state.waiting_human = False
-        st.rerun()
-
-    st.markdown("<hr>", unsafe_allow_html=True)
-    st.markdown('<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;letter-spacing:1px;text-transform:uppercase;">📅 Available Slots</p>', unsafe_allow_html=True)
-    slots = st.session_state.available_slots
-    if slots:
-        for s in slots:
-            st.markdown(f'<div class="slot-pill" style="display:block;margin:4px 0;">{s}</div>', unsafe_allow_html=True)
-    else:
-        st.markdown('<p style="color:#f87171;font-size:0.8rem;">No slots remaining</p>', unsafe_allow_html=True)
-
-# ─── INBOX ───────────────────────────────────
-with inbox_col:
-    st.markdown('<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;letter-spacing:1px;text-transform:uppercase;margin-bottom:0.8rem;">📬 Inbox</p>', unsafe_allow_html=True)
-
-    if not st.session_state.inbox:
-        st.markdown("""
-        <div style="text-align:center;padding:3rem 1rem;color:#7d8590;">
-            <p style="font-size:2rem;">📭</p>
-            <p style="font-size:0.85rem;">No emails yet.<br>Click <em>Simulate Patient Email</em> in the sidebar.</p>
-        </div>
-        """, unsafe_allow_html=True)
-    else:
-        for idx, mail in enumerate(st.session_state.inbox):
-            type_icon = {"incoming": "📩", "outgoing": "📤", "confirmation": "✅", "draft": "📝"}.get(mail["type"], "📧")
-            is_active = st.session_state.selected_mail == idx
-            card_class = "mail-card active" if is_active else "mail-card"
-
-            st.markdown(f"""
-            <div class="{card_class}">
-                <div style="display:flex;justify-content:space-between;align-items:center;">
-                    <span class="mail-sender">{type_icon} {mail['sender'][:22]}...</span>
-                    <span class="mail-time">{mail['time']}</span>
-                </div>
-                <div class="mail-subject">{mail['subject']}</div>
-            </div>
-            """, unsafe_allow_html=True)
-
-            if st.button(f"Open", key=f"open_mail_{idx}", use_container_width=True):
-                st.session_state.selected_mail = idx
-                st.rerun()
-
-
-# ─── EMAIL VIEWER ────────────────────────────
-with viewer_col:
-    if st.session_state.selected_mail is not None and st.session_state.inbox:
-        mail = st.session_state.inbox[st.session_state.selected_mail]
-        result = mail.get("result")
-
-        st.markdown(f"""
-        <div class="email-viewer">
-            <div class="email-viewer-header">
-                <div class="email-viewer-subject">{mail['subject']}</div>
-                <div class="email-viewer-meta">
-                    From: {mail['sender']} &nbsp;·&nbsp; {mail['time']}
-                    &nbsp;·&nbsp; {{"incoming":"📩 Received","outgoing":"📤 Sent","confirmation":"✅ Confirmed","draft":"📝 Draft"}}.get("{mail['type']}", "📧")
-                </div>
-            </div>
-            <div class="email-body">{mail['body']}</div>
-        </div>
-        """, unsafe_allow_html=True)
-
-        # Process button for incoming emails
-        if mail["type"] == "incoming" and result is None:
-            st.markdown("<br>", unsafe_allow_html=True)
-            if st.button("🤖 Run Agent on this Email", use_container_width=True, type="primary"):
-                with st.spinner("Running LangGraph pipeline..."):
-                    time.sleep(0.5)  # visual feedback
-
-                    # ── Replace mock_run_agent with graph.invoke() ──
-                    res = run_agent(
-                        raw_email=mail["body"],
-                        available_slots=st.session_state.available_slots
-                    )
-
-                    # Update slots
-                    st.session_state.available_slots = res["available_slots"]
-                    st.session_state.logs.extend(res["logs"])
-
-                    # Tag mail with result
-                    st.session_state.inbox[st.session_state.selected_mail]["result"] = res
-                    st.session_state.inbox[st.session_state.selected_mail]["read"] = True
-
-                    if res["status"] == "slot_found":
-                        # Add confirmation email to inbox
-                        add_to_inbox(
-                            sender="Dr. Smith's Office <doctor@gmail.com>",
-                            subject=f"Appointment Confirmed — {res['selected_slot']}",
-                            body=res["confirmation_email"],
-                            mail_type="confirmation",
-                            result=res
-                        )
-                        st.session_state.confirmed_count += 1
-                        st.session_state.run_count += 1
-
-                    elif res["status"] == "slot_not_found":
-                        # Hold for human review
-                        st.session_state.waiting_human = True
-                        st.session_state.draft_for_review = res
-
-                    st.rerun()
-
-        # Show parsed result if available
-        if result:
-            st.markdown("<hr>", unsafe_allow_html=True)
-            st.markdown(f"""
-            <div class="info-box">
-                <div class="info-box-title">📋 Agent Result</div>
-                <div style="display:flex; gap:1rem; flex-wrap:wrap; margin-bottom:0.8rem;">
-                    <span style="font-size:0.82rem;"><b>Patient:</b> {result.get('patient_name','—')}</span>
-                    <span style="font-size:0.82rem;"><b>Age:</b> {result.get('patient_age','—')}</span>
-                    <span style="font-size:0.82rem;"><b>Email:</b> {result.get('patient_email','—')}</span>
-                </div>
-                <div style="display:flex; gap:1rem; flex-wrap:wrap; margin-bottom:0.8rem;">
-                    <span style="font-size:0.82rem;"><b>Requested:</b> {result.get('requested_date','—')} at {result.get('requested_time','—')}</span>
-                </div>
-                {f'<div style="margin-top:0.5rem;"><b style="font-size:0.82rem;">✅ Confirmed Slot:</b><br><span class="slot-pill">{result.get("selected_slot","")}</span></div>' if result.get("selected_slot") else ""}
-                {f'<div style="margin-top:0.5rem;"><b style="font-size:0.82rem;">🔄 Proposed Alternatives:</b><br>{"".join(f"<span class=\"slot-pill\">{s}</span>" for s in result.get("proposed_slots",[]))}</div>' if result.get("proposed_slots") else ""}
-            </div>
-            """, unsafe_allow_html=True)
-            st.markdown(status_badge(result.get("status", "started")), unsafe_allow_html=True)
-
-    else:
-        st.markdown("""
-        <div style="display:flex;flex-direction:column;align-items:center;justify-content:center;
-                    height:400px;color:#7d8590;text-align:center;">
-            <p style="font-size:3rem;">✉️</p>
-            <p style="font-family:'DM Serif Display',serif;font-size:1.2rem;color:#c9d1d9;">Select an email to view</p>
-            <p style="font-size:0.85rem;">Click an email from the inbox to open it here.</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-
-# ─── PIPELINE + LOGS ─────────────────────────
-with pipeline_col:
-    st.markdown('<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;letter-spacing:1px;text-transform:uppercase;margin-bottom:0.8rem;">⚙️ Pipeline Status</p>', unsafe_allow_html=True)
-
-    # Determine current step from selected mail result
-    current_status = "started"
-    if st.session_state.selected_mail is not None and st.session_state.inbox:
-        mail = st.session_state.inbox[st.session_state.selected_mail]
-        if mail.get("result"):
-            current_status = mail["result"].get("status", "started")
-    if st.session_state.waiting_human:
-        current_status = "draft_ready"
-
-    steps = [
-        ("scan_and_parse_email",    "1. Scan & Parse Email",         ["email_parsed","slot_found","slot_not_found","draft_ready","human_approved","waiting_patient_response","confirmation_sent"]),
-        ("check_availability",      "2. Check Availability",         ["slot_found","slot_not_found","draft_ready","human_approved","waiting_patient_response","confirmation_sent"]),
-        ("book_appointment",        "3a. Book Appointment ✅",       ["confirmation_sent"]),
-        ("draft_new_slots_email",   "3b. Draft Alt. Slots Email",    ["draft_ready","human_approved","waiting_patient_response"]),
-        ("human_review",            "4. John Reviews Draft 👤",      ["human_approved","waiting_patient_response"]),
-        ("send_proposed_slots_email","5. Send to Patient",           ["waiting_patient_response"]),
-    ]
-
-    for step_key, label, done_statuses in steps:
-        if current_status in done_statuses:
-            css = "done"
-            icon = "✓"
-        elif (step_key == "draft_new_slots_email" and current_status == "draft_ready") or \
-             (step_key == "human_review" and st.session_state.waiting_human):
-            css = "active"
-            icon = "▶"
-        elif step_key == "check_availability" and current_status == "email_parsed":
-            css = "active"
-            icon = "▶"
-        elif step_key == "scan_and_parse_email" and current_status == "started":
-            css = "active"
-            icon = "▶"
-        else:
-            css = "pending"
-            icon = "○"
-
-        st.markdown(f"""
-        <div class="pipeline-step {css}">
-            <span style="font-family:'DM Mono',monospace;font-size:0.9rem;">{icon}</span>
-            <span>{label}</span>
-        </div>
-        """, unsafe_allow_html=True)
-
-    # Logs
-    st.markdown("<hr>", unsafe_allow_html=True)
-    st.markdown('<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;letter-spacing:1px;text-transform:uppercase;margin-bottom:0.5rem;">📋 Activity Log</p>', unsafe_allow_html=True)
-
-    all_logs = list(st.session_state.logs)
-    if st.session_state.selected_mail is not None and st.session_state.inbox:
-        mail = st.session_state.inbox[st.session_state.selected_mail]
-        if mail.get("result") and mail["result"].get("logs"):
-            all_logs = mail["result"]["logs"] + all_logs
-
-    if all_logs:
-        log_html = "".join(f'<div class="log-entry">{l}</div>' for l in reversed(all_logs[-20:]))
-        st.markdown(f'<div style="background:#0d1117;border:1px solid #21262d;border-radius:8px;padding:0.8rem;max-height:300px;overflow-y:auto;">{log_html}</div>', unsafe_allow_html=True)
-    else:
+import streamlit as st
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Optional, List
+from agent import ReviewNotPending, conversation_state, review_draft, review_drafts, review_queue, reservations, llm_cache, llm_router
+from fast_parser import fast_path_stats
+from tracing import span_collector
+from slot_calendar import SlotCalendar
+from resource_calendar import ResourceCalendar
+from availability_rules import RuleCalendar, load_rules
+from email_templates import render_email
+from event_log import event_log, new_event
+from worker_pool import BATCH, DONE, RESUME, RUN, WORKERS, WorkerPool, job_queue
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+# ─────────────────────────────────────────────
+# PAGE CONFIG
+# ─────────────────────────────────────────────
+st.set_page_config(
+    page_title="MedSchedule · AI Appointment Agent",
+    page_icon="🏥",
+    layout="wide",
+    initial_sidebar_state="expanded",
+)
+
+# Load every routed model on every Ollama endpoint at startup instead of on the first email
+@st.cache_resource
+def warm_up_llm():
+    """Once per server process, in the background."""
+    return llm_router.warm_up()
+
+
+warm_up_llm()
+
+# Agent runs go to worker processes (worker_pool.py); the script only queues jobs and polls them
+@st.cache_resource
+def start_workers():
+    """Once per server process; with WORKERS=0 the pool is started separately (python worker_pool.py)."""
+    return WorkerPool(WORKERS).start() if WORKERS else None
+
+
+worker_pool = start_workers()
+JOB_POLL_S = 1.0   # how often a page with queued jobs checks on them
+if worker_pool is not None:
+    worker_pool.maintain()   # replace a worker that crashed
+
+# ─────────────────────────────────────────────
+# CUSTOM CSS
+# ─────────────────────────────────────────────
+st.markdown("""
+<style>
+@import url('https://fonts.googleapis.com/css2?family=DM+Serif+Display:ital@0;1&family=DM+Mono:wght@400;500&family=DM+Sans:wght@300;400;500;600&display=swap');
+
+:root {
+    --bg: #0d1117;
+    --surface: #161b22;
+    --surface2: #1c2333;
+    --border: #30363d;
+    --accent: #2dd4bf;
+    --accent2: #f59e0b;
+    --danger: #f87171;
+    --success: #4ade80;
+    --text: #e6edf3;
+    --muted: #7d8590;
+}
+
+html, body, [class*="css"] {
+    font-family: 'DM Sans', sans-serif;
+    background-color: var(--bg);
+    color: var(--text);
+}
+
+/* Hide default streamlit chrome */
+#MainMenu, footer { visibility: hidden; }
+header { visibility: hidden; }
+.stDeployButton { display: none; }
+
+/* Force sidebar visible and styled */
+section[data-testid="stSidebar"] {
+    display: block !important;
+    visibility: visible !important;
+    min-width: 280px !important;
+    width: 280px !important;
+}
+section[data-testid="stSidebar"] > div {
+    padding-top: 1rem;
+}
+
+/* App header */
+.app-header {
+    background: linear-gradient(135deg, #0d1117 0%, #1a2744 100%);
+    border-bottom: 1px solid var(--border);
+    padding: 1.5rem 2rem;
+    margin: -1rem -1rem 2rem -1rem;
+    display: flex;
+    align-items: center;
+    gap: 1rem;
+}
+.app-title {
+    font-family: 'DM Serif Display', serif;
+    font-size: 1.8rem;
+    color: var(--accent);
+    margin: 0;
+    letter-spacing: -0.5px;
+}
+.app-subtitle {
+    font-size: 0.8rem;
+    color: var(--muted);
+    margin: 0;
+    font-family: 'DM Mono', monospace;
+    letter-spacing: 1px;
+    text-transform: uppercase;
+}
+
+/* Status badge */
+.status-badge {
+    display: inline-flex;
+    align-items: center;
+    gap: 6px;
+    padding: 4px 12px;
+    border-radius: 20px;
+    font-size: 0.75rem;
+    font-family: 'DM Mono', monospace;
+    font-weight: 500;
+    letter-spacing: 0.5px;
+}
+.status-started    { background: #1c2333; color: #7d8590; border: 1px solid #30363d; }
+.status-parsed     { background: #0d2137; color: #60a5fa; border: 1px solid #1d4ed8; }
+.status-found      { background: #0d2e1f; color: #4ade80; border: 1px solid #16a34a; }
+.status-not-found  { background: #2d1b0e; color: #fb923c; border: 1px solid #c2410c; }
+.status-draft      { background: #2d2008; color: #fbbf24; border: 1px solid #d97706; }
+.status-approved   { background: #0d2e1f; color: #4ade80; border: 1px solid #16a34a; }
+.status-sent       { background: #0d2137; color: #60a5fa; border: 1px solid #1d4ed8; }
+.status-confirmed  { background: #0d2e1f; color: #4ade80; border: 1px solid #16a34a; }
+
+/* Mail card */
+.mail-card {
+    background: var(--surface);
+    border: 1px solid var(--border);
+    border-radius: 10px;
+    padding: 1rem 1.2rem;
+    margin-bottom: 0.6rem;
+    cursor: pointer;
+    transition: all 0.15s ease;
+    position: relative;
+}
+.mail-card:hover {
+    border-color: var(--accent);
+    background: var(--surface2);
+}
+.mail-card.active {
+    border-color: var(--accent);
+    border-left: 3px solid var(--accent);
+    background: var(--surface2);
+}
+.mail-card.unread::before {
+    content: '';
+    position: absolute;
+    left: -1px;
+    top: 50%;
+    transform: translateY(-50%);
+    width: 4px;
+    height: 60%;
+    background: var(--accent);
+    border-radius: 0 2px 2px 0;
+}
+.mail-sender {
+    font-weight: 600;
+    font-size: 0.85rem;
+    color: var(--text);
+}
+.mail-subject {
+    font-size: 0.8rem;
+    color: var(--muted);
+    margin-top: 2px;
+    white-space: nowrap;
+    overflow: hidden;
+    text-overflow: ellipsis;
+}
+.mail-time {
+    font-family: 'DM Mono', monospace;
+    font-size: 0.7rem;
+    color: var(--muted);
+}
+
+/* Email viewer */
+.email-viewer {
+    background: var(--surface);
+    border: 1px solid var(--border);
+    border-radius: 12px;
+    padding: 1.5rem;
+}
+.email-viewer-header {
+    border-bottom: 1px solid var(--border);
+    padding-bottom: 1rem;
+    margin-bottom: 1rem;
+}
+.email-viewer-subject {
+    font-family: 'DM Serif Display', serif;
+    font-size: 1.3rem;
+    color: var(--text);
+}
+.email-viewer-meta {
+    font-size: 0.8rem;
+    color: var(--muted);
+    margin-top: 0.4rem;
+    font-family: 'DM Mono', monospace;
+}
+.email-body {
+    font-size: 0.9rem;
+    line-height: 1.7;
+    color: #c9d1d9;
+    white-space: pre-wrap;
+}
+
+/* Pipeline step */
+.pipeline-step {
+    display: flex;
+    align-items: center;
+    gap: 10px;
+    padding: 0.6rem 0.8rem;
+    border-radius: 8px;
+    margin-bottom: 0.4rem;
+    font-size: 0.82rem;
+}
+.pipeline-step.done     { background: #0d2e1f; color: #4ade80; }
+.pipeline-step.active   { background: #1a2744; color: #60a5fa; border: 1px solid #1d4ed8; }
+.pipeline-step.pending  { background: var(--surface); color: var(--muted); }
+.pipeline-step.error    { background: #2d1010; color: #f87171; }
+
+/* Slot pill */
+.slot-pill {
+    display: inline-block;
+    background: #0d2137;
+    border: 1px solid #1d4ed8;
+    color: #93c5fd;
+    border-radius: 6px;
+    padding: 4px 10px;
+    font-family: 'DM Mono', monospace;
+    font-size: 0.75rem;
+    margin: 3px;
+}
+
+/* Action button */
+.stButton > button {
+    font-family: 'DM Sans', sans-serif;
+    font-weight: 600;
+    border-radius: 8px;
+    border: none;
+    transition: all 0.15s ease;
+}
+
+/* Approve button */
+div[data-testid="column"]:nth-child(1) .stButton > button {
+    background: linear-gradient(135deg, #059669, #10b981);
+    color: white;
+}
+div[data-testid="column"]:nth-child(1) .stButton > button:hover {
+    background: linear-gradient(135deg, #047857, #059669);
+    transform: translateY(-1px);
+    box-shadow: 0 4px 12px rgba(16, 185, 129, 0.3);
+}
+
+/* Reject button */
+div[data-testid="column"]:nth-child(2) .stButton > button {
+    background: linear-gradient(135deg, #dc2626, #ef4444);
+    color: white;
+}
+
+/* Info box */
+.info-box {
+    background: #0d2137;
+    border: 1px solid #1d4ed8;
+    border-radius: 10px;
+    padding: 1rem;
+    margin: 0.8rem 0;
+}
+.info-box-title {
+    font-family: 'DM Mono', monospace;
+    font-size: 0.7rem;
+    text-transform: uppercase;
+    letter-spacing: 1px;
+    color: #60a5fa;
+    margin-bottom: 0.5rem;
+}
+
+/* Log entry */
+.log-entry {
+    font-family: 'DM Mono', monospace;
+    font-size: 0.75rem;
+    color: var(--muted);
+    padding: 3px 0;
+    border-bottom: 1px solid #161b22;
+}
+.log-entry:last-child { border-bottom: none; }
+
+/* Divider */
+hr { border-color: var(--border); margin: 1.5rem 0; }
+
+/* Sidebar — force visible */
+section[data-testid="stSidebar"] {
+    background: var(--surface) !important;
+    border-right: 1px solid var(--border) !important;
+    display: block !important;
+    visibility: visible !important;
+}
+section[data-testid="stSidebar"] > div:first-child {
+    padding-top: 1.5rem;
+    background: var(--surface) !important;
+}
+/* Sidebar toggle button — keep visible */
+button[data-testid="collapsedControl"] {
+    display: block !important;
+    visibility: visible !important;
+    color: var(--accent) !important;
+}
+
+/* Metric cards */
+.metric-card {
+    background: var(--surface);
+    border: 1px solid var(--border);
+    border-radius: 10px;
+    padding: 1rem;
+    text-align: center;
+}
+.metric-value {
+    font-family: 'DM Serif Display', serif;
+    font-size: 2rem;
+    color: var(--accent);
+}
+.metric-label {
+    font-size: 0.75rem;
+    color: var(--muted);
+    text-transform: uppercase;
+    letter-spacing: 1px;
+    font-family: 'DM Mono', monospace;
+}
+
+/* Scrollable containers */
+.inbox-scroll {
+    max-height: 500px;
+    overflow-y: auto;
+    padding-right: 4px;
+}
+</style>
+""", unsafe_allow_html=True)
+
+
+# ─────────────────────────────────────────────
+# SESSION STATE INIT
+# ─────────────────────────────────────────────
+def init_state():
+    if "inbox" not in st.session_state:
+        st.session_state.inbox = []          # list of mail dicts
+    if "selected_mail" not in st.session_state:
+        st.session_state.selected_mail = None
+    if "agent_state" not in st.session_state:
+        st.session_state.agent_state = None
+    if "pipeline_status" not in st.session_state:
+        st.session_state.pipeline_status = {}
+    if "available_slots" not in st.session_state:
+        # Opening hours come from availability_rules (AVAILABILITY_RULES); the sidebar lists the next week
+        st.session_state.available_slots = RuleCalendar(load_rules(), listing_days=7)
+    if "run_count" not in st.session_state:
+        st.session_state.run_count = 0
+    if "confirmed_count" not in st.session_state:
+        st.session_state.confirmed_count = 0
+
+init_state()
+
+
+# ─────────────────────────────────────────────
+# MOCK AGENT (replace with real graph.invoke)
+# ─────────────────────────────────────────────
+def mock_run_agent(raw_email: str, available_slots: list):
+    """
+    Replace this with your actual: result = graph.invoke(initial_state)
+    This mock simulates the pipeline for UI demonstration.
+    """
+    import random, re
+    from datetime import datetime, timedelta
+
+    available_slots = SlotCalendar.coerce(available_slots).labels()
+    logs = []
+    logs.append("[scan_and_parse_email] Parsing incoming email...")
+
+    # Fake parse
+    name = "PatientX"
+    for n in ["PatientX", "PatientY", "PatientZ"]:
+        if n.lower() in raw_email.lower():
+            name = n
+            break
+
+    age = random.randint(25, 60)
+    email = f"{name.lower()}@gmail.com"
+    today = datetime.now()
+    tomorrow = today + timedelta(days=1)
+    req_date = tomorrow.strftime("%Y-%m-%d") if random.random() > 0.5 else today.strftime("%Y-%m-%d")
+    hours = [9, 10, 11, 13, 14, 15]
+    req_hour = random.choice(hours)
+    req_time = f"{req_hour:02d}:00 {'AM' if req_hour < 12 else 'PM'}"
+
+    logs.append(f"[scan_and_parse_email] Parsed: {name}, age={age}, date={req_date}, time={req_time}")
+
+    # Check availability (use real parse_slot if available)
+    matched_slot = None
+    remaining = list(available_slots)
+    for slot in available_slots:
+        if req_date in slot:
+            slot_hour_match = re.search(r"(\d{1,2}):00(AM|PM)", slot, re.IGNORECASE)
+            if slot_hour_match:
+                sh = int(slot_hour_match.group(1))
+                meridiem = slot_hour_match.group(2).upper()
+                if meridiem == "PM" and sh != 12:
+                    sh += 12
+                if sh == req_hour:
+                    matched_slot = slot
+                    remaining.remove(slot)
+                    break
+
+    logs.append(f"[check_availability] matched={matched_slot}")
+
+    same_date = [s for s in remaining if req_date in s]
+    proposed = same_date[:3] if same_date else remaining[:3]
+
+    result = {
+        "patient_name": name,
+        "patient_age": age,
+        "patient_email": email,
+        "requested_date": req_date,
+        "requested_time": req_time,
+        "selected_slot": matched_slot,
+        "available_slots": remaining,
+        "proposed_slots": proposed if not matched_slot else [],
+        "status": "slot_found" if matched_slot else "slot_not_found",
+        "logs": logs,
+        "draft_email": None,
+        "confirmation_email": None,
+    }
+
+    if matched_slot:
+        result["confirmation_email"] = render_email("confirmation", patient_name=name, slot=matched_slot)["body"]
+        logs.append(f"[book_appointment] Confirmation email generated for {name} at {matched_slot}")
+    else:
+        result["draft_email"] = render_email(
+            "proposal", patient_name=name, requested_date=req_date, requested_time=req_time, proposed_slots=proposed
+        )["body"]
+        logs.append(f"[draft_new_slots_email] Draft created for {name} with {len(proposed)} proposed slots")
+
+    return result
+
+
+# ─────────────────────────────────────────────
+# HELPER: add mail to inbox
+# ─────────────────────────────────────────────
+def add_to_inbox(sender, subject, body, mail_type="incoming", result=None):
+    st.session_state.inbox.insert(0, {
+        "id": len(st.session_state.inbox),
+        "sender": sender,
+        "subject": subject,
+        "body": body,
+        "time": datetime.now().strftime("%H:%M"),
+        "type": mail_type,   # incoming | outgoing | confirmation | draft
+        "read": False,
+        "result": result,
+    })
+
+
+def log_ui(message: str, result: Optional[dict] = None):
+    """Record a UI action in the shared event log (agent nodes record their own events)."""
+    result = result or {}
+    event_log.record(new_event("ui", "app", message, result.get("thread_id"), result.get("patient_email")))
+
+
+def apply_agent_result(mail: dict, res: dict):
+    """Tag an incoming mail with its agent result and route confirmations / drafts."""
+    # Tag mail with result
+    mail["result"] = res
+    mail["read"] = True
+
+    if res.get("confirmation_email"):
+        # Add confirmation email to inbox
+        add_to_inbox(
+            sender="Dr. Smith's Office <doctor@gmail.com>",
+            subject=f"Appointment Confirmed — {res['selected_slot']}",
+            body=res["confirmation_email"],
+            mail_type="confirmation",
+            result=res
+        )
+        st.session_state.confirmed_count += 1
+        st.session_state.run_count += 1
+
+    elif res.get("status") == "draft_ready":
+        # The graph is paused at human_review and the draft is on the review queue
+        log_ui(f"📝 Draft for {res.get('patient_name', 'patient')} queued for review", res)
+
+
+def submit_job(mail: dict, kind: str, payload: dict):
+    """Queue an agent run for `mail` on the worker pool; poll_jobs() applies its result."""
+    mail["job"] = {"id": job_queue.submit(kind, payload), "kind": kind, "thread_id": payload.get("thread_id")}
+
+
+def submit_batch(mails: List[dict]):
+    """Queue `mails` as one run_agent_many job: one availability pass, batched LLM calls."""
+    thread_ids = [uuid.uuid4().hex for _ in mails]
+    job_id = job_queue.submit(BATCH, {"emails": [m["body"] for m in mails], "thread_ids": thread_ids})
+    for i, (mail, thread_id) in enumerate(zip(mails, thread_ids)):
+        mail["job"] = {"id": job_id, "kind": BATCH, "index": i, "thread_id": thread_id}
+
+
+def apply_job(mail: dict, job: dict):
+    """A finished job's result, applied to the mail it was queued for."""
+    queued = mail.pop("job")
+    if job["status"] != DONE:
+        if queued.get("index", 0) == 0:   # a batch fails once for all of its mails
+            log_ui(f"❌ Agent run failed: {job['error']}", mail.get("result"))   # the button is back to retry
+        return
+    res = job["result"]
+    if job["kind"] == BATCH:
+        apply_agent_result(mail, res["results"][queued["index"]])
+        if queued["index"] == 0:
+            stats = res["stats"]
+            log_ui(
+                f"📥 Batch: {stats['emails']} emails in {stats['elapsed_s']}s "
+                f"({stats['emails_per_s']}/s) · {stats['confirmed']} confirmed · {stats['drafts']} drafts · {stats['failed']} failed"
+            )
+    elif job["kind"] == RESUME:
+        mail["result"] = res
+        if res.get("confirmation_email") or res.get("status") == "draft_ready":
+            apply_agent_result({}, res)   # booked, or a fresh draft for review
+    else:
+        apply_agent_result(mail, res)
+
+
+def pending_jobs() -> List[dict]:
+    return [m for m in st.session_state.inbox if m.get("job")]
+
+
+@st.fragment(run_every=JOB_POLL_S)
+def poll_jobs():
+    """Re-runs on its own every JOB_POLL_S while jobs are out; the whole page reruns once one finished."""
+    waiting = pending_jobs()
+    finished = job_queue.finished({m["job"]["id"] for m in waiting})
+    for mail in waiting:
+        if mail["job"]["id"] in finished:
+            apply_job(mail, finished[mail["job"]["id"]])
+    if finished:
+        st.rerun()
+    st.markdown(f'<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#f59e0b;margin:0;">⏳ {len(waiting)} email{"s" if len(waiting) != 1 else ""} with the agent…</p>', unsafe_allow_html=True)
+
+
+# Pipeline steps: (node, label, statuses after which the step counts as done)
+PIPELINE_STEPS = [
+    ("scan_and_parse_email",    "1. Scan & Parse Email",         ["email_parsed","slot_found","slot_not_found","draft_ready","human_approved","waiting_patient_response","confirmation_sent"]),
+    ("check_availability",      "2. Check Availability",         ["slot_found","slot_not_found","draft_ready","human_approved","waiting_patient_response","confirmation_sent"]),
+    ("book_appointment",        "3a. Book Appointment ✅",       ["confirmation_sent"]),
+    ("draft_new_slots_email",   "3b. Draft Alt. Slots Email",    ["draft_ready","human_approved","waiting_patient_response"]),
+    ("human_review",            "4. John Reviews Draft 👤",      ["human_approved","waiting_patient_response"]),
+    ("send_proposed_slots_email","5. Send to Patient",           ["waiting_patient_response"]),
+]
+
+
+def pipeline_step_html(label: str, css: str, icon: str, ms: Optional[float] = None) -> str:
+    timing = ""
+    if ms is not None:
+        timing = f'<span style="margin-left:auto;font-family:DM Mono,monospace;font-size:0.7rem;color:#7d8590;">{ms:.1f} ms</span>'
+    return f"""
+        <div class="pipeline-step {css}">
+            <span style="font-family:'DM Mono',monospace;font-size:0.9rem;">{icon}</span>
+            <span>{label}</span>
+            {timing}
+        </div>
+        """
+
+
+def live_pipeline_html(done: List[str], active: Optional[str], step_ms: dict) -> str:
+    """Pipeline panel while a run is in progress: finished nodes ✓, the node running now ▶."""
+    parts = []
+    for step_key, label, _ in PIPELINE_STEPS:
+        if step_key in done:
+            parts.append(pipeline_step_html(label, "done", "✓", step_ms.get(step_key)))
+        elif step_key == active:
+            parts.append(pipeline_step_html(label, "active", "▶"))
+        else:
+            parts.append(pipeline_step_html(label, "pending", "○"))
+    return "".join(parts)
+
+
+@st.fragment(run_every=JOB_POLL_S)
+def live_pipeline(job_id: str, thread_id: Optional[str]):
+    """
+    Progress of a job a worker is running, every JOB_POLL_S. A streamed run keeps
+    the nodes it finished and the email an LLM is still writing on its job row;
+    other jobs are followed from the conversation's checkpoint (shared with the
+    workers). poll_jobs() reruns the page when it is done.
+    """
+    job = job_queue.get(job_id)
+    progress = job["progress"] if job else None
+    state = conversation_state(thread_id) if thread_id else {}
+    if progress:
+        done, active = progress["done"], progress["node"]
+    else:
+        status = state.get("status", "started")
+        done = [step_key for step_key, _, statuses in PIPELINE_STEPS if status in statuses]
+        active = state["next"][0] if state.get("next") else None
+    st.markdown(live_pipeline_html(done, active, {}), unsafe_allow_html=True)
+    if progress and progress["node"] and progress["draft"]:
+        st.markdown(f'<div class="email-body">{progress["draft"]}▌</div>', unsafe_allow_html=True)
+    for event in state.get("logs", [])[-3:]:
+        st.markdown(f'<div class="log-entry">[{event["node"]}] {event["message"]}</div>', unsafe_allow_html=True)
+
+
+def status_badge(status: str) -> str:
+    mapping = {
+        "started":            ("status-started",   "⬜", "STARTED"),
+        "email_parsed":       ("status-parsed",    "🔵", "PARSED"),
+        "slot_found":         ("status-found",     "🟢", "SLOT FOUND"),
+        "slot_not_found":     ("status-not-found", "🟠", "NO SLOT"),
+        "draft_ready":        ("status-draft",     "🟡", "DRAFT READY"),
+        "human_approved":     ("status-approved",  "🟢", "APPROVED"),
+        "draft_rejected":     ("status-not-found", "🔴", "REJECTED"),
+        "waiting_patient_response": ("status-sent","🔵", "WAITING"),
+        "confirmation_sent":  ("status-confirmed", "🟢", "CONFIRMED"),
+    }
+    css, icon, label = mapping.get(status, ("status-started", "⬜", status.upper()))
+    return f'<span class="status-badge {css}">{icon} {label}</span>'
+
+
+
+
+
+# ─────────────────────────────────────────────
+# MAIN LAYOUT
+# ─────────────────────────────────────────────
+st.markdown("""
+<div class="app-header">
+    <div>
+        <p class="app-title">MedSchedule</p>
+        <p class="app-subtitle">AI-Powered Medical Appointment Agent · LangGraph Workflow</p>
+    </div>
+</div>
+""", unsafe_allow_html=True)
+
+# Sidebar visibility hint
+if not st.session_state.inbox:
+    st.info("👈 Use the **sidebar on the left** to simulate patient emails and view available slots. If collapsed, click the **arrow `>`** at the top-left to expand it.")
+
+# Human review queue (drafts paused at human_review, persisted across restarts)
+pending_reviews = review_queue.pending()
+if pending_reviews:
+    st.markdown(f"""
+    <div style="background:linear-gradient(135deg,#1a1500,#2d2008);border:1px solid #d97706;
+                border-radius:12px;padding:1.2rem 1.5rem;margin-bottom:1.5rem;">
+        <p style="font-family:'DM Mono',monospace;font-size:0.7rem;color:#fbbf24;
+                  letter-spacing:1px;text-transform:uppercase;margin:0 0 0.5rem 0;">
+            🔔 Human Review Required — John, {len(pending_reviews)} draft{'s' if len(pending_reviews) != 1 else ''} waiting
+        </p>
+        <p style="font-size:0.85rem;color:#e6edf3;margin:0;">
+            Edit a draft if needed, then approve to send or reject to drop it. Tick several to decide them in bulk.
+        </p>
+    </div>
+    """, unsafe_allow_html=True)
+
+    def send_reviewed(item: dict, res: dict):
+        add_to_inbox(
+            sender="Dr. Smith's Office <doctor@gmail.com>",
+            subject=f"Re: Appointment Request — Alternative Slots",
+            body=res.get("draft_email", item["draft_email"]),
+            mail_type="outgoing",
+            result=res
+        )
+        log_ui(f"👤 John approved the draft for {item['patient_name']} ✓", res)
+        st.session_state.run_count += 1
+
+    selected = []
+    for item in pending_reviews:
+        tid = item["thread_id"]
+        with st.expander(f"📝 {item['patient_name'] or 'Patient'} — requested {item['requested']}"):
+            if st.checkbox("Select for bulk action", key=f"sel_{tid}"):
+                selected.append(item)
+            edited = st.text_area("Draft", item["draft_email"], height=220, key=f"draft_{tid}")
+            col_approve, col_reject, col_spacer = st.columns([1, 1, 4])
+            with col_approve:
+                if st.button("✅ Approve & Send", key=f"approve_{tid}", use_container_width=True):
+                    # Resume the paused thread from its checkpoint; it stops again waiting on the patient
+                    try:
+                        res = review_draft(tid, st.session_state.available_slots, True,
+                                           draft_email=edited if edited != item["draft_email"] else None)
+                    except ReviewNotPending:
+                        st.warning("This draft was already reviewed elsewhere.")
+                    else:
+                        send_reviewed(item, res)
+                        st.rerun()
+            with col_reject:
+                if st.button("❌ Reject Draft", key=f"reject_{tid}", use_container_width=True):
+                    try:
+                        review_draft(tid, st.session_state.available_slots, False)
+                    except ReviewNotPending:
+                        st.warning("This draft was already reviewed elsewhere.")
+                    else:
+                        log_ui(f"👤 John rejected the draft for {item['patient_name']} ✗", {"thread_id": tid})
+                        st.rerun()
+
+    col_all_approve, col_all_reject, col_spacer = st.columns([1, 1, 4])
+    with col_all_approve:
+        if st.button(f"✅ Approve selected ({len(selected)})", use_container_width=True, disabled=not selected):
+            results = review_drafts([item["thread_id"] for item in selected], st.session_state.available_slots, True)
+            by_thread = {res["thread_id"]: res for res in results}
+            for item in selected:
+                if item["thread_id"] in by_thread:
+                    send_reviewed(item, by_thread[item["thread_id"]])
+            st.rerun()
+    with col_all_reject:
+        if st.button(f"❌ Reject selected ({len(selected)})", use_container_width=True, disabled=not selected):
+            rejected = review_drafts([item["thread_id"] for item in selected], st.session_state.available_slots, False)
+            log_ui(f"👤 John rejected {len(rejected)} drafts ✗")
+            st.rerun()
+
+# ── Four-column layout: Sidebar Controls | Inbox | Email View | Pipeline ──
+sidebar_col, inbox_col, viewer_col, pipeline_col = st.columns([1, 1, 2, 1.2])
+
+# ─── LEFT PANEL (replaces sidebar) ──────────
+with sidebar_col:
+    st.markdown("""
+    <div style="padding: 0.5rem 0 1rem 0;">
+        <p style="font-family:'DM Serif Display',serif; font-size:1.2rem; color:#2dd4bf; margin:0;">🏥 Controls</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown(f"""
+        <div class="metric-card">
+            <div class="metric-value">{st.session_state.run_count}</div>
+            <div class="metric-label">Done</div>
+        </div>""", unsafe_allow_html=True)
+    with col2:
+        st.markdown(f"""
+        <div class="metric-card">
+            <div class="metric-value" style="color:#4ade80;">{st.session_state.confirmed_count}</div>
+            <div class="metric-label">Confirmed</div>
+        </div>""", unsafe_allow_html=True)
+
+    fast = fast_path_stats.snapshot()
+    cache = llm_cache.stats()
+    st.markdown(f'<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;margin:0.5rem 0 0 0;">⚡ Fast-path parses: {fast["hits"]}/{fast["hits"] + fast["misses"]} ({fast["hit_rate"]:.0%})</p>', unsafe_allow_html=True)
+    st.markdown(f'<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;margin:0;">🗄️ LLM cache: {cache["memory_hits"] + cache["disk_hits"]} hits / {cache["misses"]} misses ({cache["hit_rate"]:.0%})</p>', unsafe_allow_html=True)
+    jobs = job_queue.counts()
+    workers = f"{worker_pool.alive} workers" if worker_pool is not None else "external workers"
+    st.markdown(f'<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;margin:0;">🧵 {workers}: {jobs["queued"]} queued · {jobs["running"]} running</p>', unsafe_allow_html=True)
+    if pending_jobs():
+        poll_jobs()
+
+    st.markdown("<br>", unsafe_allow_html=True)
+
+    if st.button("📨 Simulate Patient Email", use_container_width=True):
+        import random
+        names = ["PatientX", "PatientY", "PatientZ"]
+        ages  = [28, 35, 42, 55, 61]
+        name  = random.choice(names)
+        age   = random.choice(ages)
+        from datetime import timedelta
+        tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+        hours = [ "4:00 PM"]
+        req_time = random.choice(hours)
+        body = (
+            f"From: {name.lower()}@gmail.com\n"
+            f"To: doctor@gmail.com\n"
+            f"Subject: Appointment Request\n\n"
+            f"Dear Doctor,\n\n"
+            f"My name is {name}, I am {age} years old.\n"
+            f"I would like to book an appointment on {tomorrow} at {req_time}.\n\n"
+            f"Best regards,\n{name}"
+        )
+        add_to_inbox(
+            sender=f"{name} <{name.lower()}@gmail.com>",
+            subject="Appointment Request",
+            body=body,
+            mail_type="incoming"
+        )
+        st.session_state.selected_mail = 0
+        st.rerun()
+
+    unread = [m for m in st.session_state.inbox if m["type"] == "incoming" and m["result"] is None and not m.get("job")]
+    if st.button(f"📥 Process all unread ({len(unread)})", use_container_width=True, disabled=not unread):
+        # One run_agent_many job: availability is settled in one pass and the LLM calls are batched
+        submit_batch(unread)
+        log_ui(f"📥 Queued {len(unread)} emails for the agent as one batch")
+        st.rerun()
+
+    if st.button("🗑️ Clear Inbox", use_container_width=True):
+        st.session_state.inbox = []
+        st.session_state.selected_mail = None
+        st.rerun()
+
+    st.markdown("<hr>", unsafe_allow_html=True)
+    st.markdown('<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;letter-spacing:1px;text-transform:uppercase;">📅 Available Slots</p>', unsafe_allow_html=True)
+    slots = st.session_state.available_slots
+    if slots:
+        shown = list(slots)
+        if isinstance(slots, ResourceCalendar):
+            # Filter the list by doctor, specialty or room
+            options = ["All"] + slots.doctors + sorted(set(slots.specialties)) + slots.rooms
+            resource = st.selectbox("Resource", options, label_visibility="collapsed")
+            if resource in slots.doctors:
+                shown = slots.select(doctor=resource)
+            elif resource in slots.specialties:
+                shown = slots.select(specialty=resource)
+            elif resource in slots.rooms:
+                shown = slots.select(room=resource)
+        taken = reservations.taken([s.label for s in shown])   # held / booked by any session or worker
+        for s in shown:
+            mark = {"held": " 🔒 held", "booked": " ✖ booked"}.get(taken.get(s.label, ("",))[0], "")
+            st.markdown(f'<div class="slot-pill" style="display:block;margin:4px 0;">{s.label}{mark}</div>', unsafe_allow_html=True)
+    else:
+        st.markdown('<p style="color:#f87171;font-size:0.8rem;">No slots remaining</p>', unsafe_allow_html=True)
+
+# ─── INBOX ───────────────────────────────────
+with inbox_col:
+    st.markdown('<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;letter-spacing:1px;text-transform:uppercase;margin-bottom:0.8rem;">📬 Inbox</p>', unsafe_allow_html=True)
+
+    if not st.session_state.inbox:
+        st.markdown("""
+        <div style="text-align:center;padding:3rem 1rem;color:#7d8590;">
+            <p style="font-size:2rem;">📭</p>
+            <p style="font-size:0.85rem;">No emails yet.<br>Click <em>Simulate Patient Email</em> in the sidebar.</p>
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        for idx, mail in enumerate(st.session_state.inbox):
+            type_icon = {"incoming": "📩", "outgoing": "📤", "confirmation": "✅", "draft": "📝"}.get(mail["type"], "📧")
+            is_active = st.session_state.selected_mail == idx
+            card_class = "mail-card active" if is_active else "mail-card"
+
+            st.markdown(f"""
+            <div class="{card_class}">
+                <div style="display:flex;justify-content:space-between;align-items:center;">
+                    <span class="mail-sender">{type_icon} {mail['sender'][:22]}...</span>
+                    <span class="mail-time">{mail['time']}</span>
+                </div>
+                <div class="mail-subject">{mail['subject']}</div>
+            </div>
+            """, unsafe_allow_html=True)
+
+            if st.button(f"Open", key=f"open_mail_{idx}", use_container_width=True):
+                st.session_state.selected_mail = idx
+                st.rerun()
+
+
+# ─── EMAIL VIEWER ────────────────────────────
+with viewer_col:
+    if st.session_state.selected_mail is not None and st.session_state.inbox:
+        mail = st.session_state.inbox[st.session_state.selected_mail]
+        result = mail.get("result")
+
+        st.markdown(f"""
+        <div class="email-viewer">
+            <div class="email-viewer-header">
+                <div class="email-viewer-subject">{mail['subject']}</div>
+                <div class="email-viewer-meta">
+                    From: {mail['sender']} &nbsp;·&nbsp; {mail['time']}
+                    &nbsp;·&nbsp; {{"incoming":"📩 Received","outgoing":"📤 Sent","confirmation":"✅ Confirmed","draft":"📝 Draft"}}.get("{mail['type']}", "📧")
+                </div>
+            </div>
+            <div class="email-body">{mail['body']}</div>
+        </div>
+        """, unsafe_allow_html=True)
+
+        # Process button for incoming emails
+        if mail.get("job"):
+            job = job_queue.get(mail["job"]["id"])
+            st.info(f"⏳ {'Running on ' + job['worker'].split(':')[0] if job and job['status'] == 'running' else 'Queued for a worker'}…")
+        elif mail["type"] == "incoming" and result is None:
+            st.markdown("<br>", unsafe_allow_html=True)
+            if st.button("🤖 Run Agent on this Email", use_container_width=True, type="primary"):
+                # A worker runs the graph; the result shows up here once it is done
+                submit_job(mail, RUN, {"raw_email": mail["body"], "thread_id": uuid.uuid4().hex})
+                st.rerun()
+
+        # Resume a thread that is waiting on the patient
+        elif mail["type"] == "outgoing" and result and result.get("thread_id") and result.get("status") == "waiting_patient_response":
+            st.markdown("<br>", unsafe_allow_html=True)
+            if st.button("📨 Simulate Patient Reply", use_container_width=True):
+                submit_job(mail, RESUME, {"thread_id": result["thread_id"]})
+                st.rerun()
+
+        # Show parsed result if available
+        if result:
+            st.markdown("<hr>", unsafe_allow_html=True)
+            st.markdown(f"""
+            <div class="info-box">
+                <div class="info-box-title">📋 Agent Result</div>
+                <div style="display:flex; gap:1rem; flex-wrap:wrap; margin-bottom:0.8rem;">
+                    <span style="font-size:0.82rem;"><b>Patient:</b> {result.get('patient_name','—')}</span>
+                    <span style="font-size:0.82rem;"><b>Age:</b> {result.get('patient_age','—')}</span>
+                    <span style="font-size:0.82rem;"><b>Email:</b> {result.get('patient_email','—')}</span>
+                </div>
+                <div style="display:flex; gap:1rem; flex-wrap:wrap; margin-bottom:0.8rem;">
+                    <span style="font-size:0.82rem;"><b>Requested:</b> {result.get('requested_date','—')} at {result.get('requested_time','—')}</span>
+                </div>
+                {f'<div style="margin-top:0.5rem;"><b style="font-size:0.82rem;">✅ Confirmed Slot:</b><br><span class="slot-pill">{result.get("selected_slot","")}</span></div>' if result.get("selected_slot") else ""}
+                {f'<div style="margin-top:0.5rem;"><b style="font-size:0.82rem;">🔄 Proposed Alternatives:</b><br>{"".join(f"<span class=\"slot-pill\">{s}</span>" for s in result.get("proposed_slots",[]))}</div>' if result.get("proposed_slots") else ""}
+            </div>
+            """, unsafe_allow_html=True)
+            st.markdown(status_badge(result.get("status", "started")), unsafe_allow_html=True)
+
+    else:
+        st.markdown("""
+        <div style="display:flex;flex-direction:column;align-items:center;justify-content:center;
+                    height:400px;color:#7d8590;text-align:center;">
+            <p style="font-size:3rem;">✉️</p>
+            <p style="font-family:'DM Serif Display',serif;font-size:1.2rem;color:#c9d1d9;">Select an email to view</p>
+            <p style="font-size:0.85rem;">Click an email from the inbox to open it here.</p>
+        </div>
+        """, unsafe_allow_html=True)
+
+
+# ─── PIPELINE + LOGS ─────────────────────────
+with pipeline_col:
+    st.markdown('<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;letter-spacing:1px;text-transform:uppercase;margin-bottom:0.8rem;">⚙️ Pipeline Status</p>', unsafe_allow_html=True)
+
+    # Determine current step from selected mail result
+    current_status = "started"
+    step_ms = {}
+    live_job = None
+    if st.session_state.selected_mail is not None and st.session_state.inbox:
+        mail = st.session_state.inbox[st.session_state.selected_mail]
+        if mail.get("job"):
+            live_job = mail["job"]   # a worker is on it: follow its progress
+        if mail.get("result"):
+            current_status = mail["result"].get("status", "started")
+            if mail["result"].get("thread_id"):
+                # wall ms per node of this conversation; runs on a worker bring theirs along
+                step_ms = span_collector.timings(mail["result"]["thread_id"]) or mail["result"].get("step_ms", {})
+    if pending_reviews:
+        current_status = "draft_ready"
+
+    if live_job:
+        live_pipeline(live_job["id"], live_job.get("thread_id"))
+    else:
+        for step_key, label, done_statuses in PIPELINE_STEPS:
+            if current_status in done_statuses:
+                css = "done"
+                icon = "✓"
+            elif (step_key == "draft_new_slots_email" and current_status == "draft_ready") or \
+                 (step_key == "human_review" and pending_reviews):
+                css = "active"
+                icon = "▶"
+            elif step_key == "check_availability" and current_status == "email_parsed":
+                css = "active"
+                icon = "▶"
+            elif step_key == "scan_and_parse_email" and current_status == "started":
+                css = "active"
+                icon = "▶"
+            else:
+                css = "pending"
+                icon = "○"
+
+            st.markdown(pipeline_step_html(label, css, icon, step_ms.get(step_key)), unsafe_allow_html=True)
+
+    # Logs
+    st.markdown("<hr>", unsafe_allow_html=True)
+    st.markdown('<p style="font-family:\'DM Mono\',monospace;font-size:0.7rem;color:#7d8590;letter-spacing:1px;text-transform:uppercase;margin-bottom:0.5rem;">📋 Activity Log</p>', unsafe_allow_html=True)
+
+    # The selected conversation's events, else the most recent activity overall
+    events = []
+    if st.session_state.selected_mail is not None and st.session_state.inbox:
+        mail = st.session_state.inbox[st.session_state.selected_mail]
+        if mail.get("result") and mail["result"].get("thread_id"):
+            # events of a worker's run are in its process, the result carries the latest ones
+            events = event_log.for_thread(mail["result"]["thread_id"], limit=20) or mail["result"].get("logs", [])[-20:]
+    if not events:
+        events = event_log.recent(20)
+
+    if events:
+        log_html = "".join(f'<div class="log-entry">[{e["node"]}] {e["message"]}</div>' for e in reversed(events))
+        st.markdown(f'<div style="background:#0d1117;border:1px solid #21262d;border-radius:8px;padding:0.8rem;max-height:300px;overflow-y:auto;">{log_html}</div>', unsafe_allow_html=True)
+    else:
         st.markdown('<p style="font-size:0.8rem;color:#7d8590;">No activity yet.</p>', unsafe_allow_html=True)
\ No newline at end of file
@@ -0,0 +1,255 @@
+import json
+import os
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, FrozenSet, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from resource_calendar import TICK_MINUTES, TICKS_PER_DAY, ResourceCalendar
+from slot_calendar import Slot, normalize_doctor, parse_slot
+
+# ---- Recurring availability rules ----
+# Opening hours are described once as weekly templates plus dated exceptions and
+# holidays, instead of as literal slot strings. A RuleCalendar compiles a day
+# into its doctor / room bitmaps the first time a query touches it: each
+# weekday's template is built once and copied, then that date's exceptions are
+# applied. Compiled days that nobody booked are kept in a small LRU and
+# recompiled on demand, so memory follows the dates being looked at, not the
+# booking horizon. Days the window moved past are dropped, changed ones included. AVAILABILITY_RULES may point at a JSON file shaped like
+# DEFAULT_RULES.
+
+AVAILABILITY_RULES = os.environ.get("AVAILABILITY_RULES")
+RULES_HORIZON_DAYS = int(os.environ.get("RULES_HORIZON_DAYS", 90))   # how far ahead slots can be booked
+RULES_LISTING_DAYS = 14       # days shown when the calendar is listed (UI, iteration)
+RULES_CACHE_DAYS = 62         # compiled, unbooked days kept in memory
+
+DEFAULT_RULES = {
+    "slot_minutes": 60,
+    "doctors": {"Dr. Smith": "general practice", "Dr. Patel": "cardiology", "Dr. Lee": "dermatology"},
+    "rooms": ["Room 1", "Room 2"],
+    "weekly": [
+        {"days": "mon-fri", "start": "09:00", "end": "12:00"},
+        {"days": "mon-fri", "start": "13:00", "end": "16:00"},
+        {"days": "sat", "start": "10:00", "end": "11:00"},
+        {"days": "sat", "start": "13:00", "end": "14:00"},
+    ],
+    "exceptions": [
+        # {"date": "2026-12-24", "start": "12:00", "end": "16:00", "closed": true},
+        # {"date": "2026-11-02", "start": "09:00", "end": "16:00", "closed": true, "doctors": ["Dr. Lee"]},
+    ],
+    "holidays": ["2026-12-25", "2026-12-26", "2027-01-01"],
+}
+
+_WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+class WeeklyHours(NamedTuple):
+    """Open from `start` to `end` on `weekdays` (0 = Monday), for some or all doctors / rooms."""
+    weekdays: FrozenSet[int]
+    start: time
+    end: time
+    doctors: Optional[Tuple[str, ...]] = None
+    rooms: Optional[Tuple[str, ...]] = None
+
+
+class DateException(NamedTuple):
+    """One-off change on `day`: extra opening hours, or a closure when `closed`."""
+    day: date
+    start: time
+    end: time
+    closed: bool = True
+    doctors: Optional[Tuple[str, ...]] = None
+    rooms: Optional[Tuple[str, ...]] = None
+
+
+def parse_weekdays(spec: str) -> FrozenSet[int]:
+    """"mon-fri", "sat", "tue,thu" → weekday numbers."""
+    days = set()
+    for part in spec.lower().replace(" ", "").split(","):
+        first, _, last = part.partition("-")
+        lo, hi = _WEEKDAYS.index(first[:3]), _WEEKDAYS.index((last or first)[:3])
+        days.update(range(lo, hi + 1) if lo <= hi else [*range(lo, 7), *range(0, hi + 1)])
+    return frozenset(days)
+
+
+def _clock(value: str) -> time:
+    return datetime.strptime(value, "%H:%M").time()
+
+
+def _names(value) -> Optional[Tuple[str, ...]]:
+    return tuple(value) if value else None
+
+
+class AvailabilityRules:
+    """Weekly templates, exceptions, holidays and slot length for one clinic."""
+
+    def __init__(self, doctors: Dict[str, str], rooms: List[str], weekly: List[WeeklyHours],
+                 exceptions: List[DateException] = (), holidays=(), slot_minutes: int = 30):
+        self.doctors = dict(doctors)
+        self.rooms = list(rooms)
+        self.weekly = list(weekly)
+        self.holidays = frozenset(holidays)
+        self.slot_minutes = slot_minutes
+        self.exceptions: Dict[date, List[DateException]] = {}
+        for exception in exceptions:
+            self.exceptions.setdefault(exception.day, []).append(exception)
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> "AvailabilityRules":
+        return cls(
+            doctors=spec["doctors"],
+            rooms=spec["rooms"],
+            weekly=[WeeklyHours(parse_weekdays(r["days"]), _clock(r["start"]), _clock(r["end"]),
+                                _names(r.get("doctors")), _names(r.get("rooms"))) for r in spec.get("weekly", [])],
+            exceptions=[DateException(date.fromisoformat(e["date"]), _clock(e.get("start", "00:00")),
+                                      _clock(e.get("end", "23:59")), e.get("closed", True),
+                                      _names(e.get("doctors")), _names(e.get("rooms"))) for e in spec.get("exceptions", [])],
+            holidays=[date.fromisoformat(d) for d in spec.get("holidays", [])],
+            slot_minutes=spec.get("slot_minutes", 30),
+        )
+
+
+def load_rules(path: Optional[str] = AVAILABILITY_RULES) -> AvailabilityRules:
+    """Rules from a JSON file, or DEFAULT_RULES."""
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return AvailabilityRules.from_dict(json.load(f))
+    return AvailabilityRules.from_dict(DEFAULT_RULES)
+
+
+def _ticks(start: time, end: time) -> slice:
+    # the end is rounded up, like claim_ticks does, so an "until 23:59" window covers the day's last tick
+    end_tick = -(-(end.hour * 60 + end.minute) // TICK_MINUTES)
+    return slice((start.hour * 60 + start.minute) // TICK_MINUTES, end_tick if end_tick else TICKS_PER_DAY)
+
+
+class RuleCalendar(ResourceCalendar):
+    """
+    ResourceCalendar whose days come from AvailabilityRules, compiled when first
+    touched. Slots exist from `start` for `horizon_days` days; iterating lists the
+    first `listing_days` of them. Without a fixed `start` the window begins today,
+    worked out on every query, so a long-running service or worker moves forward
+    with the date.
+    """
+
+    def __init__(self, rules: AvailabilityRules, start: Optional[date] = None, horizon_days: int = RULES_HORIZON_DAYS,
+                 listing_days: int = RULES_LISTING_DAYS, cache_days: int = RULES_CACHE_DAYS):
+        super().__init__(rules.doctors, rules.rooms, rules.slot_minutes)
+        self.rules = rules
+        self.fixed_start = start
+        self.horizon_days = horizon_days
+        self.listing_days = listing_days
+        self.cache_days = cache_days
+        self._templates: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._unbooked: "OrderedDict[date, None]" = OrderedDict()   # compiled days safe to drop, LRU order
+        self._window_start = self.start                             # days before it were released
+
+    @property
+    def start(self) -> date:
+        return self.fixed_start or date.today()
+
+    @property
+    def end(self) -> date:
+        return self.start + timedelta(days=self.horizon_days)
+
+    # ---- Compilation ----
+    def _template(self, weekday: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Bitmaps for a plain `weekday`, built once."""
+        if weekday not in self._templates:
+            doc = np.zeros((len(self.doctors), TICKS_PER_DAY), dtype=bool)
+            room = np.zeros((len(self.rooms), TICKS_PER_DAY), dtype=bool)
+            for rule in self.rules.weekly:
+                if weekday in rule.weekdays:
+                    window = _ticks(rule.start, rule.end)
+                    doc[self._rows(self._doctor_index, rule.doctors, normalize_doctor), window] = True
+                    room[self._rows(self._room_index, rule.rooms), window] = True
+            self._templates[weekday] = (doc, room)
+        return self._templates[weekday]
+
+    def _compile(self, day: date):
+        doc, room = super()._arrays(day, create=True)
+        if day in self.rules.holidays:
+            return
+        template_doc, template_room = self._template(day.weekday())
+        doc[:] = template_doc
+        room[:] = template_room
+        for exception in self.rules.exceptions.get(day, ()):
+            window = _ticks(exception.start, exception.end)
+            doc[self._rows(self._doctor_index, exception.doctors, normalize_doctor), window] = not exception.closed
+            # a doctor's leave closes only the doctor, unless rooms are named too
+            if exception.rooms is not None or exception.doctors is None:
+                room[self._rows(self._room_index, exception.rooms), window] = not exception.closed
+
+    def _arrays(self, day: date, create: bool = False):
+        if self.start > self._window_start:
+            self._release_past()
+        if day in self._doctor_free:
+            if day in self._unbooked:
+                self._unbooked.move_to_end(day)
+            return super()._arrays(day)
+        if not (self.start <= day < self.end):
+            return super()._arrays(day, create)
+        self._compile(day)
+        self._unbooked[day] = None
+        while len(self._unbooked) > self.cache_days:
+            self._drop(self._unbooked.popitem(last=False)[0])
+        return super()._arrays(day)
+
+    def _drop(self, day: date):
+        del self._doctor_free[day]
+        del self._room_free[day]
+        self._day_keys.remove(day)
+
+    def _release_past(self):
+        """Drop every day the window moved past, pinned or not: it can no longer be booked."""
+        start = self.start
+        for past in self._day_keys[:bisect_left(self._day_keys, start)]:
+            self._unbooked.pop(past, None)
+            self._drop(past)
+        self._window_start = start
+
+    def _pin(self, day: date):
+        """A day changed by hand or by a booking no longer matches its rules, so it is kept until it is past."""
+        self._unbooked.pop(day, None)
+
+    # ---- Mutation ----
+    def open_hours(self, start: datetime, end: datetime, doctors=None, rooms=None):
+        super().open_hours(start, end, doctors, rooms)
+        self._pin(start.date())
+
+    def close_hours(self, start: datetime, end: datetime, doctors=None, rooms=None):
+        super().close_hours(start, end, doctors, rooms)
+        self._pin(start.date())
+
+    def add(self, slot: "Slot | str") -> Optional[Slot]:
+        added = super().add(slot)
+        if added is not None:
+            self._pin(added.day)
+        return added
+
+    def remove(self, slot: "Slot | str") -> bool:
+        slot = parse_slot(slot) if isinstance(slot, str) else slot
+        removed = super().remove(slot)
+        if removed:
+            self._pin(slot.day)
+        return removed
+
+    # ---- Days ----
+    def _days(self) -> List[date]:
+        start = self.start
+        return [start + timedelta(days=i) for i in range(min(self.listing_days, self.horizon_days))]
+
+    def _days_near(self, day: date) -> Iterator[date]:
+        """Walk outward from `day` inside the horizon, never before today; days are compiled only as nearest() reaches them."""
+        first, end = max(self.start, date.today()), self.end
+        reach = max((day - first).days, (end - day).days)
+        for offset in range(reach + 1):
+            for candidate in (day + timedelta(days=offset), day - timedelta(days=offset)) if offset else (day,):
+                if first <= candidate < end:
+                    yield candidate
+
+    def __repr__(self) -> str:
+        return (f"RuleCalendar({len(self.doctors)} doctors × {len(self.rooms)} rooms, {self.start} to {self.end}, "
+                f"{len(self._day_keys)} days compiled)")
@@ -0,0 +1,429 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# ---- Benchmark harness ----
+# Runs the real graph with the LLM endpoints swapped for a deterministic fake, so every
+# path can be timed without Ollama. Checkpoints, review queue, reservations and the
+# event log go to a throwaway directory. Usage:
+#
+#   python benchmark.py                      # full run, writes bench_report.json
+#   python benchmark.py --quick --latency-ms 0 --out /tmp/bench.json
+#
+# Compare two reports with `python benchmark.py --compare old.json new.json`.
+
+_BENCH_DIR = tempfile.mkdtemp(prefix="appointment-bench-")
+for _var, _file in (("CHECKPOINT_DB", "checkpoints.sqlite"), ("REVIEW_QUEUE_DB", "review_queue.sqlite"),
+                    ("RESERVATIONS_DB", "reservations.sqlite"), ("EVENT_LOG_DIR", "event_log")):
+    os.environ.setdefault(_var, os.path.join(_BENCH_DIR, _file))
+
+import agent  # noqa: E402  (the stores above are opened at import time)
+from fast_parser import fast_parse_email, fast_path_stats  # noqa: E402
+from resource_calendar import ResourceCalendar  # noqa: E402
+from slot_calendar import SlotCalendar  # noqa: E402
+
+DEFAULT_SIZES = (10, 100, 1_000, 10_000, 100_000)
+DEFAULT_DOCTORS = (10, 50, 200)   # × 16 half-hour slots × 7 days = bookable units per week
+BENCH_START = date.today() + timedelta(days=7 - date.today().weekday())   # next Monday: slots in the past are never proposed
+_SLOT_IN_TEXT = re.compile(r"(\d{4}-\d{2}-\d{2}) from (\d{1,2}:\d{2})(AM|PM)")
+
+
+# ---- Fake LLM ----
+class FakeStructuredLLM:
+    """Deterministic stand-in for llm.with_structured_output(schema)."""
+
+    def __init__(self, schema, latency_s: float, counter: Dict[str, int]):
+        self.schema = schema
+        self.latency_s = latency_s
+        self.counter = counter
+
+    def _respond(self, prompt):
+        self.counter[self.schema.__name__] = self.counter.get(self.schema.__name__, 0) + 1
+        text = prompt if isinstance(prompt, str) else str(prompt)
+        name = self.schema.__name__
+        if name == "ParseEmail":
+            fields = fast_parse_email(text).fields
+            return self.schema(
+                patient_name=fields.get("patient_name", "Patient"),
+                patient_age=fields.get("patient_age", 40),
+                patient_email=fields.get("patient_email", "patient@gmail.com"),
+                requested_date=fields.get("requested_date", BENCH_START.isoformat()),
+                requested_time=fields.get("requested_time", "10:00 AM"),
+            )
+        if name == "SlotResponse":
+            m = _SLOT_IN_TEXT.search(text)
+            if not m:
+                return self.schema(accepted=False, body="None of these work for me.")
+            return self.schema(accepted=True, body=f"I confirm the appointment for {m.group(1)} at {m.group(2)} {m.group(3)}.")
+        values = {}
+        for field, info in self.schema.model_fields.items():
+            values[field] = 0 if info.annotation is int else False if info.annotation is bool else f"{field} ({name})"
+        return self.schema(**values)
+
+    def invoke(self, prompt, config=None, **kwargs):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return self._respond(prompt)
+
+    async def ainvoke(self, prompt, config=None, **kwargs):
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        return self._respond(prompt)
+
+    def batch(self, prompts, config=None, **kwargs):
+        if self.latency_s:
+            time.sleep(self.latency_s)   # one round-trip, like a batched backend
+        return [self._respond(p) for p in prompts]
+
+    async def abatch(self, prompts, config=None, **kwargs):
+        return [await self.ainvoke(p) for p in prompts]
+
+
+class FakeLLM:
+    """Stands in for the Ollama endpoints. `latency_s` is slept on every structured call."""
+
+    model = "fake-bench"
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.calls: Dict[str, int] = {}
+
+    def with_structured_output(self, schema, **kwargs):
+        return FakeStructuredLLM(schema, self.latency_s, self.calls)
+
+
+# ---- Workload ----
+def make_calendar(n_slots: int, start: date = BENCH_START, per_day: int = 8) -> SlotCalendar:
+    """`n_slots` hourly slots, `per_day` a day from 9AM, over as many days as needed."""
+    labels = []
+    day = start
+    while len(labels) < n_slots:
+        for h in range(9, 9 + per_day):
+            if len(labels) == n_slots:
+                break
+            s = datetime.combine(day, datetime.min.time()) + timedelta(hours=h)
+            e = s + timedelta(hours=1)
+            labels.append(f"{day.isoformat()} from {s:%-I:%M%p} to {e:%-I:%M%p}")
+        day += timedelta(days=1)
+    return SlotCalendar(labels)
+
+
+def make_resource_calendar(n_doctors: int, start: date = BENCH_START, days: int = 7) -> ResourceCalendar:
+    """`n_doctors` over three specialties sharing n_doctors // 2 rooms, 9AM-5PM, 30-minute slots."""
+    specialties = ("general practice", "cardiology", "dermatology")
+    calendar = ResourceCalendar({f"Dr. Doc{i}": specialties[i % 3] for i in range(n_doctors)},
+                                [f"Room {i}" for i in range(max(1, n_doctors // 2))], slot_minutes=30)
+    for offset in range(days):
+        day = datetime.combine(start + timedelta(days=offset), datetime.min.time())
+        calendar.open_hours(day + timedelta(hours=9), day + timedelta(hours=17))
+    return calendar
+
+
+EMAIL = ("From: {email}\nTo: doctor@gmail.com\nSubject: Appointment Request\n\nDear Doctor,\n\n"
+         "My name is {name}, I am {age} years old.\nI would like to book an appointment on {d} at {t}.\n\n"
+         "Best regards,\n{name}")
+
+
+def make_emails(n: int, days: int = 3, seed: int = 7, start: date = BENCH_START) -> List[str]:
+    """Template-shaped requests spread over `days` days; some land outside open hours."""
+    rng = random.Random(seed)
+    emails = []
+    for i in range(n):
+        d = start + timedelta(days=rng.randrange(days))
+        hour = rng.choice([7, 9, 10, 11, 12, 13, 14, 15, 16, 18])
+        t = f"{(hour - 1) % 12 + 1:02d}:00 {'AM' if hour < 12 else 'PM'}"
+        name = f"Patient{i}"
+        emails.append(EMAIL.format(email=f"patient{i}@gmail.com", name=name, age=20 + i % 60, d=d.isoformat(), t=t))
+    return emails
+
+
+# ---- Measurements ----
+def percentiles(samples: List[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        k = (len(ordered) - 1) * p
+        lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+        return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(pct(0.50) * 1000, 3),
+        "p90_ms": round(pct(0.90) * 1000, 3),
+        "p99_ms": round(pct(0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+class NodeTimer(BaseCallbackHandler):
+    """Wall time per graph node, from the callbacks LangGraph emits around each node run."""
+
+    def __init__(self):
+        self._started: Dict[object, tuple] = {}
+        self.samples: Dict[str, List[float]] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, name=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if not node or name != node:
+            return
+        parent = self._started.get(parent_run_id)
+        if parent and parent[0] == node:
+            return   # the RunnableLambda inside the node carries the same name; time the outer run only
+        self._started[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started:
+            node, t0 = started
+            self.samples.setdefault(node, []).append(time.perf_counter() - t0)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        # interrupt() surfaces as an error; the node still ran up to that point
+        self.on_chain_end(None, run_id=run_id)
+
+
+def bench_end_to_end(runs: int, slots: int) -> dict:
+    """run_agent over `runs` emails sharing one calendar; throughput and latency percentiles."""
+    agent.reservations.clear()   # each benchmark starts from an empty calendar
+    calendar = make_calendar(slots)
+    latencies, statuses = [], {}
+    started = time.perf_counter()
+    for raw_email in make_emails(runs):
+        t0 = time.perf_counter()
+        result = agent.run_agent(raw_email, calendar)
+        latencies.append(time.perf_counter() - t0)
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    elapsed = time.perf_counter() - started
+    return {
+        "runs": runs,
+        "calendar_slots": slots,
+        "elapsed_s": round(elapsed, 4),
+        "runs_per_s": round(runs / elapsed, 2) if elapsed else None,
+        "latency": percentiles(latencies),
+        "statuses": statuses,
+    }
+
+
+def bench_batch(runs: int, slots: int) -> dict:
+    """run_agent_many over the same workload, for comparison with the per-email loop."""
+    agent.reservations.clear()   # each benchmark starts from an empty calendar
+    t0 = time.perf_counter()
+    out = agent.run_agent_many(make_emails(runs, seed=11), make_calendar(slots))
+    elapsed = time.perf_counter() - t0
+    return {"runs": runs, "elapsed_s": round(elapsed, 4), "runs_per_s": round(runs / elapsed, 2) if elapsed else None,
+            "stats": out["stats"]}
+
+
+def bench_nodes(runs: int, slots: int) -> dict:
+    """Per-node wall time, driving the compiled graph directly with a timing callback."""
+    agent.reservations.clear()   # each benchmark starts from an empty calendar
+    timer = NodeTimer()
+    calendar = make_calendar(slots)
+    for raw_email in make_emails(runs, seed=13):
+        state = agent.new_conversation_state(raw_email)
+        config = {**agent.thread_config(state["thread_id"], calendar), "callbacks": [timer]}
+        agent.graph.invoke(state, config)
+    return {node: percentiles(samples) for node, samples in sorted(timer.samples.items())}
+
+
+def bench_check_availability(sizes, repeats: int) -> List[dict]:
+    """check_availability alone against calendars of growing size, for a hit and a miss."""
+    rows = []
+    for n in sizes:
+        t0 = time.perf_counter()
+        calendar = make_calendar(n)
+        build_s = time.perf_counter() - t0
+        config = {"configurable": {"calendar": calendar}}
+        first = next(iter(calendar))
+        hit = {"requested_date": first.start.date().isoformat(), "requested_time": f"{first.start:%I:%M %p}", "logs": []}
+        miss = {**hit, "requested_time": "07:00 AM"}   # before opening hours: proposes the nearest slots
+        timings = {"hit": [], "miss": []}
+        for i in range(repeats):
+            for kind, base in (("hit", hit), ("miss", miss)):
+                state = {**base, "thread_id": f"bench-{n}-{kind}-{i}", "logs": []}
+                t0 = time.perf_counter()
+                result = agent.check_availability(state, config)
+                timings[kind].append(time.perf_counter() - t0)
+                if result.get("selected_slot"):
+                    calendar.add(result["selected_slot"])   # put it back for the next repeat
+            agent.reservations.clear()
+        rows.append({"slots": n, "build_ms": round(build_s * 1000, 3),
+                     "hit": percentiles(timings["hit"]), "miss": percentiles(timings["miss"])})
+    return rows
+
+
+def bench_resource_calendar(doctor_counts, repeats: int) -> List[dict]:
+    """ResourceCalendar lookups as the number of doctors (and rooms) grows."""
+    rows = []
+    for n in doctor_counts:
+        calendar = make_resource_calendar(n)
+        when = datetime.combine(BENCH_START + timedelta(days=2), datetime.min.time()).replace(hour=10, minute=15)
+        timings = {"find": [], "find_specialty": [], "nearest": [], "book_release": []}
+        for _ in range(repeats):
+            for kind, call in (("find", lambda: calendar.find(when)),
+                               ("find_specialty", lambda: calendar.find(when, specialty="cardiology")),
+                               ("nearest", lambda: calendar.nearest(when.replace(hour=7), agent.PROPOSED_SLOTS_MAX, "Dr. Doc1"))):
+                t0 = time.perf_counter()
+                call()
+                timings[kind].append(time.perf_counter() - t0)
+            slot = calendar.find(when)
+            t0 = time.perf_counter()
+            calendar.remove(slot)
+            calendar.add(slot)
+            timings["book_release"].append(time.perf_counter() - t0)
+        rows.append({"doctors": n, "units_per_week": n * 16 * 7, **{kind: percentiles(t) for kind, t in timings.items()}})
+    return rows
+
+
+def bench_memory(runs: int, slots: int, samples: int = 10) -> dict:
+    """tracemalloc over a long run: traced memory after every runs/samples emails."""
+    agent.reservations.clear()   # each benchmark starts from an empty calendar
+    calendar = make_calendar(slots)
+    emails = make_emails(runs, seed=17)
+    step = max(1, runs // samples)
+    tracemalloc.start()
+    points = []
+    try:
+        for i, raw_email in enumerate(emails, 1):
+            agent.run_agent(raw_email, calendar)
+            if i % step == 0 or i == runs:
+                current, peak = tracemalloc.get_traced_memory()
+                points.append({"runs": i, "current_kb": round(current / 1024, 1), "peak_kb": round(peak / 1024, 1)})
+    finally:
+        tracemalloc.stop()
+    # Growth after the first sample, so import-time / warm-up allocations do not count
+    growth = None
+    if len(points) > 1 and points[-1]["runs"] > points[0]["runs"]:
+        growth = round((points[-1]["current_kb"] - points[0]["current_kb"]) * 1024 / (points[-1]["runs"] - points[0]["runs"]), 1)
+    return {"runs": runs, "samples": points, "growth_bytes_per_run": growth}
+
+
+# ---- Report ----
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "email_render_mode": agent.EMAIL_RENDER_MODE,
+    }
+
+
+def run(runs: int = 200, latency_ms: float = 5.0, sizes=DEFAULT_SIZES, repeats: int = 20,
+        memory_runs: int = 1000, slots: int = 500, doctors=DEFAULT_DOCTORS) -> dict:
+    fake = FakeLLM(latency_ms / 1000)
+    agent.llm_router.set_models([fake])
+    agent.llm_cache.enabled = False   # every call should pay the fake latency
+    fast_path_stats.reset()
+    report = {"environment": environment(), "config": {"runs": runs, "latency_ms": latency_ms, "sizes": list(sizes),
+                                                      "repeats": repeats, "memory_runs": memory_runs, "slots": slots,
+                                                      "doctors": list(doctors)}}
+    # The nodes print progress; keep that out of the timings and the terminal
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        report["end_to_end"] = bench_end_to_end(runs, slots)
+        report["batch"] = bench_batch(runs, slots)
+        report["nodes"] = bench_nodes(min(runs, 100), slots)
+        report["check_availability"] = bench_check_availability(sizes, repeats)
+        report["resource_calendar"] = bench_resource_calendar(doctors, repeats)
+        report["memory"] = bench_memory(memory_runs, slots)
+    report["llm_calls"] = dict(fake.calls)
+    report["fast_path"] = fast_path_stats.snapshot()
+    return report
+
+
+def compare(old: dict, new: dict) -> List[str]:
+    """Human-readable deltas for the headline numbers of two reports."""
+    lines = []
+
+    def line(label, a, b):
+        if a is None or b is None:
+            return
+        delta = (b - a) / a * 100 if a else 0.0
+        lines.append(f"{label:<40} {a:>12} -> {b:>12}  ({delta:+.1f}%)")
+
+    line("end_to_end runs/s", old["end_to_end"]["runs_per_s"], new["end_to_end"]["runs_per_s"])
+    for p in ("p50_ms", "p90_ms", "p99_ms"):
+        line(f"end_to_end {p}", old["end_to_end"]["latency"].get(p), new["end_to_end"]["latency"].get(p))
+    line("batch runs/s", old["batch"]["runs_per_s"], new["batch"]["runs_per_s"])
+    for node in sorted(set(old["nodes"]) & set(new["nodes"])):
+        line(f"node {node} p50_ms", old["nodes"][node].get("p50_ms"), new["nodes"][node].get("p50_ms"))
+    old_ca = {row["slots"]: row for row in old["check_availability"]}
+    for row in new["check_availability"]:
+        if row["slots"] in old_ca:
+            for kind in ("hit", "miss"):
+                line(f"check_availability {row['slots']} {kind} p50_ms", old_ca[row["slots"]][kind].get("p50_ms"), row[kind].get("p50_ms"))
+    old_rc = {row["doctors"]: row for row in old.get("resource_calendar", [])}
+    for row in new.get("resource_calendar", []):
+        if row["doctors"] in old_rc:
+            for kind in ("find", "nearest"):
+                line(f"resource_calendar {row['doctors']} {kind} p50_ms", old_rc[row["doctors"]][kind].get("p50_ms"), row[kind].get("p50_ms"))
+    line("memory growth bytes/run", old["memory"]["growth_bytes_per_run"], new["memory"]["growth_bytes_per_run"])
+    return lines
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the scheduling graph with a fake LLM.")
+    parser.add_argument("--runs", type=int, default=200, help="emails for the end-to-end and batch runs")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated latency of every LLM call")
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=list(DEFAULT_SIZES),
+                        help="calendar sizes for check_availability, comma separated")
+    parser.add_argument("--repeats", type=int, default=20, help="check_availability calls per size")
+    parser.add_argument("--memory-runs", type=int, default=1000, help="emails for the memory growth run")
+    parser.add_argument("--slots", type=int, default=500, help="calendar size for the end-to-end runs")
+    parser.add_argument("--doctors", type=lambda s: [int(x) for x in s.split(",")], default=list(DEFAULT_DOCTORS),
+                        help="doctor counts for the resource calendar lookups, comma separated")
+    parser.add_argument("--quick", action="store_true", help="small smoke run")
+    parser.add_argument("--out", default="bench_report.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two reports and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            print("\n".join(compare(json.load(f_old), json.load(f_new))))
+        return
+
+    if args.quick:
+        args.runs, args.repeats, args.memory_runs, args.sizes, args.doctors = 20, 3, 50, [10, 1_000, 10_000], [10, 200]
+    report = run(args.runs, args.latency_ms, args.sizes, args.repeats, args.memory_runs, args.slots, args.doctors)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    e2e = report["end_to_end"]
+    print(f"end-to-end : {e2e['runs_per_s']} runs/s · p50 {e2e['latency']['p50_ms']} ms · p99 {e2e['latency']['p99_ms']} ms")
+    print(f"batch      : {report['batch']['runs_per_s']} runs/s")
+    for node, stats in report["nodes"].items():
+        print(f"  {node:<28} p50 {stats['p50_ms']:>9} ms  (n={stats['n']})")
+    for row in report["check_availability"]:
+        print(f"  check_availability {row['slots']:>7} slots: hit p50 {row['hit']['p50_ms']} ms · miss p50 {row['miss']['p50_ms']} ms")
+    for row in report["resource_calendar"]:
+        print(f"  resource_calendar {row['doctors']:>4} doctors ({row['units_per_week']} units/week): "
+              f"find p50 {row['find']['p50_ms']} ms · nearest p50 {row['nearest']['p50_ms']} ms")
+    print(f"memory     : {report['memory']['growth_bytes_per_run']} bytes/run growth")
+    print(f"report     : {args.out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import os
+import sqlite3
+from typing import Any, AsyncIterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+# ---- Durable checkpoints ----
+# One local SQLite file, one thread id per patient conversation. Every super-step
+# is a new row keyed by checkpoint id (append-only), serialized with the default
+# msgpack serde. WAL + synchronous=NORMAL keeps a write to a single fsync-free
+# append, so checkpointing stays well under the cost of the node itself.
+
+CHECKPOINT_DB = os.environ.get("CHECKPOINT_DB", "checkpoints.sqlite")
+
+
+class LocalSqliteSaver(SqliteSaver):
+    """
+    SqliteSaver usable from both graph.invoke and graph.ainvoke.
+
+    The stock saver is sync-only. Local SQLite writes take well under a
+    millisecond, so the async methods simply call the sync ones instead of
+    pulling in a separate aiosqlite connection.
+    """
+
+    @classmethod
+    def open(cls, path: str = CHECKPOINT_DB) -> "LocalSqliteSaver":
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return cls(conn)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return self.delete_thread(thread_id)
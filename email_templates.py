@@ -0,0 +1,128 @@
+from string import Formatter
+from typing import Dict, List, Tuple
+
+# ---- Deterministic email templates ----
+# Confirmation and proposal emails are mostly boilerplate, so by default they are
+# rendered from these templates instead of spending an LLM generation on them.
+# Templates are keyed by (clinic, language, kind); placeholders are parsed once
+# when the template is registered, so rendering is a single join.
+
+
+class EmailTemplate:
+    """Subject/body pair with `{placeholder}` fields compiled at construction."""
+
+    def __init__(self, subject: str, body: str):
+        self._subject = self._compile(subject)
+        self._body = self._compile(body)
+        self.fields = {f for _, f, _ in self._subject + self._body if f}
+
+    @staticmethod
+    def _compile(text: str) -> List[Tuple[str, str, str]]:
+        return [(literal, field or "", spec or "") for literal, field, spec, _ in Formatter().parse(text)]
+
+    @staticmethod
+    def _fill(parts: List[Tuple[str, str, str]], values: dict) -> str:
+        out = []
+        for literal, field, spec in parts:
+            out.append(literal)
+            if field:
+                out.append(format(values[field], spec))
+        return "".join(out)
+
+    def render(self, **values) -> Dict[str, str]:
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Missing template values: {sorted(missing)}")
+        return {"subject": self._fill(self._subject, values), "body": self._fill(self._body, values)}
+
+
+# ---- Clinics ----
+CLINICS: Dict[str, Dict[str, str]] = {
+    "default": {
+        "clinic_name": "Dr. Smith's Office",
+        "team_name": "Dr. Smith's Scheduling Team",
+    },
+}
+
+DEFAULT_CLINIC = "default"
+DEFAULT_LANGUAGE = "en"
+
+# Shown in place of the slot list when there is nothing to propose
+NO_SLOTS_LINE: Dict[str, str] = {
+    "en": "  • No open slots right now — we will contact you as soon as one frees up.",
+    "es": "  • No hay horarios libres por ahora — le avisaremos en cuanto se libere uno.",
+}
+
+TEMPLATES: Dict[Tuple[str, str, str], EmailTemplate] = {}
+
+
+def register_template(clinic: str, language: str, kind: str, subject: str, body: str) -> EmailTemplate:
+    template = EmailTemplate(subject, body)
+    TEMPLATES[(clinic, language, kind)] = template
+    return template
+
+
+register_template(
+    DEFAULT_CLINIC, "en", "confirmation",
+    subject="Appointment Confirmed — {slot}",
+    body=(
+        "Dear {patient_name},\n\n"
+        "We are pleased to confirm your appointment:\n\n"
+        "📅  {slot}\n\n"
+        "Please arrive 10 minutes early and bring any previous medical records.\n"
+        "To reschedule, contact us at least 24 hours in advance.\n\n"
+        "Warm regards,\n{clinic_name}"
+    ),
+)
+register_template(
+    DEFAULT_CLINIC, "en", "proposal",
+    subject="Re: Appointment Request — Alternative Slots",
+    body=(
+        "Dear {patient_name},\n\n"
+        "We're sorry, but your requested slot ({requested_date} at {requested_time}) is unavailable.\n\n"
+        "We have the following alternative slots:\n{slot_list}\n\n"
+        "Please reply with your preferred option.\n\n"
+        "Regards,\n{team_name}"
+    ),
+)
+register_template(
+    DEFAULT_CLINIC, "es", "confirmation",
+    subject="Cita confirmada — {slot}",
+    body=(
+        "Estimado/a {patient_name}:\n\n"
+        "Nos complace confirmar su cita:\n\n"
+        "📅  {slot}\n\n"
+        "Por favor llegue 10 minutos antes y traiga sus informes médicos anteriores.\n"
+        "Para reprogramar, contáctenos con al menos 24 horas de antelación.\n\n"
+        "Saludos cordiales,\n{clinic_name}"
+    ),
+)
+register_template(
+    DEFAULT_CLINIC, "es", "proposal",
+    subject="Re: Solicitud de cita — Horarios alternativos",
+    body=(
+        "Estimado/a {patient_name}:\n\n"
+        "Lamentamos informarle que el horario solicitado ({requested_date} a las {requested_time}) no está disponible.\n\n"
+        "Tenemos los siguientes horarios alternativos:\n{slot_list}\n\n"
+        "Responda indicando la opción que prefiera.\n\n"
+        "Saludos,\n{team_name}"
+    ),
+)
+
+
+def get_template(kind: str, clinic: str = DEFAULT_CLINIC, language: str = DEFAULT_LANGUAGE) -> EmailTemplate:
+    """Most specific template for (clinic, language), falling back to the default clinic and English."""
+    for key in ((clinic, language), (clinic, DEFAULT_LANGUAGE), (DEFAULT_CLINIC, language), (DEFAULT_CLINIC, DEFAULT_LANGUAGE)):
+        template = TEMPLATES.get((*key, kind))
+        if template is not None:
+            return template
+    raise KeyError(f"No '{kind}' template registered")
+
+
+def render_email(kind: str, clinic: str = DEFAULT_CLINIC, language: str = DEFAULT_LANGUAGE, **values) -> Dict[str, str]:
+    """Render a template; clinic details and the formatted slot list are filled in here."""
+    details = CLINICS.get(clinic, CLINICS[DEFAULT_CLINIC])
+    if "proposed_slots" in values:
+        slots = values.pop("proposed_slots")
+        values["slot_list"] = "\n".join(f"  • {s}" for s in slots) if slots else NO_SLOTS_LINE.get(language, NO_SLOTS_LINE["en"])
+    return get_template(kind, clinic, language).render(**{**details, **values})
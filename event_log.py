@@ -0,0 +1,160 @@
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List, Literal, Optional, TypedDict
+
+# ---- Structured event log ----
+# Replaces the free-text `logs` list. Nodes emit small typed events; the graph
+# state only keeps the last STATE_EVENT_LIMIT of them (via the append_events
+# reducer, so a node returns just its delta), while the full history goes to the
+# process-wide EventLog: a bounded in-memory ring plus append-only JSONL segments
+# on disk that rotate by size. Memory and per-step cost stay constant however
+# long a conversation or session runs. Worker processes share EVENT_LOG_DIR, so
+# segment names carry the writer's pid ("events-<ns>-<pid>.jsonl") and rotation
+# only deletes a segment whose writer is this process or no longer running.
+
+EVENT_LOG_DIR = os.environ.get("EVENT_LOG_DIR", "event_log")
+STATE_EVENT_LIMIT = 50            # events kept in AgentState / checkpoints per conversation
+MEMORY_EVENT_LIMIT = 5_000        # events kept in memory for the UI and queries
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+MAX_SEGMENTS = 20                 # oldest segment files are deleted beyond this
+
+EventKind = Literal["parsed", "availability", "draft", "review", "sent", "patient_response", "booked", "error", "ui"]
+
+
+class Event(TypedDict):
+    ts: float
+    kind: EventKind
+    node: str
+    message: str
+    thread_id: Optional[str]
+    patient_email: Optional[str]
+    data: Dict[str, Any]
+
+
+def new_event(kind: EventKind, node: str, message: str, thread_id: Optional[str] = None,
+              patient_email: Optional[str] = None, **data) -> Event:
+    return {"ts": time.time(), "kind": kind, "node": node, "message": message,
+            "thread_id": thread_id, "patient_email": patient_email, "data": data}
+
+
+def append_events(current: Optional[List[Event]], new: Optional[List[Event]]) -> List[Event]:
+    """State reducer for `logs`: nodes return only their new events; the tail is kept bounded."""
+    if not new:
+        return current or []
+    if not current:
+        return list(new[-STATE_EVENT_LIMIT:])
+    return (current + new)[-STATE_EVENT_LIMIT:]
+
+
+def _writer_gone(path: str) -> bool:
+    """True if `path` is our own segment, or its writer process has exited (or it predates pids in names)."""
+    _, _, pid = os.path.basename(path)[:-len(".jsonl")].partition("-")[2].partition("-")
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return True
+    if os.name == "nt":
+        return False   # no cheap liveness check; leave other processes' segments alone
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+class EventLog:
+    """Bounded in-memory ring of recent events, written through to rotating JSONL segments."""
+
+    def __init__(self, directory: Optional[str] = EVENT_LOG_DIR, max_events: int = MEMORY_EVENT_LIMIT,
+                 segment_max_bytes: int = SEGMENT_MAX_BYTES, max_segments: int = MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.max_segments = max_segments
+        self._recent: "deque[Event]" = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # ---- Writing ----
+    def record(self, event: Event) -> Event:
+        line = json.dumps(event, default=str, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._recent.append(event)
+            if self.directory:
+                if self._file is None or self._segment_bytes >= self.segment_max_bytes:
+                    self._rotate()
+                self._file.write(line)
+                self._file.flush()
+                self._segment_bytes += len(line.encode("utf-8"))
+        return event
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.directory, f"events-{time.time_ns()}-{os.getpid()}.jsonl")
+        self._file = open(path, "a", encoding="utf-8")
+        self._segment_bytes = 0
+        for old in self._segments()[:-self.max_segments]:
+            if old != path and _writer_gone(old):
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass   # another process rotated it away first
+
+    def _segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "events-*.jsonl")))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # ---- Queries ----
+    def recent(self, limit: int = 50) -> List[Event]:
+        with self._lock:
+            return list(self._recent)[-limit:]
+
+    def query(self, thread_id: Optional[str] = None, patient_email: Optional[str] = None,
+              kind: Optional[str] = None, limit: Optional[int] = None, include_disk: bool = False) -> List[Event]:
+        """Matching events, oldest first. With `include_disk`, spilled segments are scanned too."""
+        def matches(e: Event) -> bool:
+            return ((thread_id is None or e["thread_id"] == thread_id)
+                    and (patient_email is None or e["patient_email"] == patient_email)
+                    and (kind is None or e["kind"] == kind))
+
+        if include_disk and self.directory:
+            found = [e for e in self._read_disk() if matches(e)]
+        else:
+            with self._lock:
+                found = [e for e in self._recent if matches(e)]
+        return found[-limit:] if limit else found
+
+    def for_thread(self, thread_id: str, limit: Optional[int] = None, include_disk: bool = False) -> List[Event]:
+        return self.query(thread_id=thread_id, limit=limit, include_disk=include_disk)
+
+    def for_patient(self, patient_email: str, limit: Optional[int] = None, include_disk: bool = False) -> List[Event]:
+        return self.query(patient_email=patient_email, limit=limit, include_disk=include_disk)
+
+    def _read_disk(self) -> Iterator[Event]:
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            segments = self._segments()
+        for path in segments:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            yield json.loads(line)
+            except FileNotFoundError:
+                continue   # rotated away while we were reading
+
+
+event_log = EventLog()
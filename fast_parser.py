@@ -0,0 +1,229 @@
+import re
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# ---- Deterministic fast path for scan_and_parse_email ----
+# Handles the common template ("From: ...", "My name is X, I am N years old",
+# "on YYYY-MM-DD at H:MM PM") without an LLM round-trip. Every field gets a
+# confidence in [0, 1]; the caller only trusts the result when all requested
+# fields clear FAST_PATH_MIN_CONFIDENCE, otherwise it falls back to the LLM.
+
+FAST_PATH_MIN_CONFIDENCE = 0.85
+
+PARSE_FIELDS = ("patient_name", "patient_age", "patient_email", "requested_date", "requested_time")
+REPLY_FIELDS = ("requested_date", "requested_time")
+
+_FROM_HEADER = re.compile(r"^From:\s*(?:\"?([^\"<\n]*?)\"?\s*<)?([\w.+-]+@[\w-]+(?:\.[\w-]+)+)>?\s*$", re.IGNORECASE | re.MULTILINE)
+_ANY_EMAIL   = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_MY_NAME     = re.compile(r"\b(?i:my name is) ([A-Z][\w'-]*(?: [A-Z][\w'-]*){0,2})")
+_SIGN_OFF    = re.compile(r"(?:regards|sincerely|thanks|thank you),?\s*\n\s*([A-Z][\w'-]*(?: [A-Z][\w'-]*){0,2})\s*$", re.IGNORECASE)
+_AGE_YEARS   = re.compile(r"\b(\d{1,3})[ -]years?[ -]old\b", re.IGNORECASE)
+_AGE_LABEL   = re.compile(r"\bage\s*(?:is|:)?\s*(\d{1,3})\b", re.IGNORECASE)
+_ON_DATE     = re.compile(r"\b(?:on|for) (\d{4}-\d{2}-\d{2})\b")
+_ISO_DATE    = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+_RELATIVE    = re.compile(r"\b(today|tomorrow)\b", re.IGNORECASE)
+_AT_TIME     = re.compile(r"\bat (\d{1,2})[:.](\d{2})\s*([ap])\.?m\.?(?![a-z])", re.IGNORECASE)
+_ANY_TIME    = re.compile(r"\b(\d{1,2})(?:[:.](\d{2}))?\s*([ap])\.?m\.?(?![a-z])", re.IGNORECASE)
+_SPECIALTY   = re.compile(
+    r"\b(?:(?P<cardiology>cardio\w*|heart)|(?P<dermatology>dermat\w*|skin)|(?P<pediatrics>p(?:a)?ediatric\w*)"
+    r"|(?P<orthopedics>orthop(?:a)?edic\w*)|(?P<neurology>neurolog\w*)|(?P<gynecology>gyn(?:a)?ecolog\w*)"
+    r"|(?P<ophthalmology>ophthalmolog\w*|eye doctor)|(?P<dentistry>dentist\w*|dental)|(?P<psychiatry>psychiatr\w*)"
+    r"|(?P<general_practice>general practi\w*|family doctor|GP\b))",
+    re.IGNORECASE,
+)
+_DOCTOR      = re.compile(r"\b(?i:dr)\.? ?([A-Z][\w-]*(?:'[A-Z][\w-]*)?)")
+_CLOCK       = re.compile(r"^\s*(\d{1,2})(?:\s*[:.h]\s*(\d{2}))?\s*(?:([ap])\.?\s*m\.?)?\s*$", re.IGNORECASE)
+_NUMERIC_DAY = re.compile(r"^\s*(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:[T ].*)?$")
+_ORDINAL     = re.compile(r"(\d)(?:st|nd|rd|th)\b", re.IGNORECASE)
+_DATE_FORMATS = ("%B %d, %Y", "%B %d %Y", "%b %d, %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y", "%A, %B %d, %Y", "%a, %B %d, %Y")
+
+
+class FastParseResult(NamedTuple):
+    fields: Dict[str, object]
+    confidence: Dict[str, float]
+    requested: Tuple[str, ...]
+
+    @property
+    def confident(self) -> bool:
+        """True when every requested field was extracted above the threshold."""
+        return all(self.confidence.get(f, 0.0) >= FAST_PATH_MIN_CONFIDENCE for f in self.requested)
+
+
+class FastPathStats:
+    """Thread-safe hit/miss counters for the fast path."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def snapshot(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hit_rate, 4)}
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+fast_path_stats = FastPathStats()
+
+
+def _format_time(hour: int, minute: int, meridiem: str) -> Optional[str]:
+    if not (1 <= hour <= 12 and 0 <= minute <= 59):
+        return None
+    return f"{hour:02d}:{minute:02d} {meridiem.upper()}M"
+
+
+def _extract_name(text: str) -> Tuple[Optional[str], float]:
+    m = _MY_NAME.search(text)
+    if m:
+        return m.group(1), 1.0
+    header = _FROM_HEADER.search(text)
+    if header and header.group(1) and header.group(1).strip():
+        return header.group(1).strip(), 0.9
+    m = _SIGN_OFF.search(text.strip())
+    if m:
+        return m.group(1), 0.7
+    return None, 0.0
+
+
+def _extract_email(text: str, name: Optional[str]) -> Tuple[Optional[str], float]:
+    header = _FROM_HEADER.search(text)
+    if header:
+        return header.group(2).lower(), 1.0
+    emails = {e.lower() for e in _ANY_EMAIL.findall(text)}
+    if len(emails) == 1:
+        return emails.pop(), 0.8
+    if not emails and name:
+        # The LLM prompt's default (<name_of_patient>@gmail.com) is made up, not read: below the
+        # threshold, so the LLM still looks for an address; speculation may use the guess
+        return f"{name.replace(' ', '').lower()}@gmail.com", 0.5
+    return None, 0.0
+
+
+def _extract_age(text: str) -> Tuple[Optional[int], float]:
+    for pattern, confidence in ((_AGE_YEARS, 1.0), (_AGE_LABEL, 0.9)):
+        ages = {int(a) for a in pattern.findall(text)}
+        if len(ages) == 1:
+            age = ages.pop()
+            if 0 < age < 130:
+                return age, confidence
+    return None, 0.0
+
+
+def _extract_date(text: str, today: date) -> Tuple[Optional[str], float]:
+    candidates = [(_ON_DATE, 1.0), (_ISO_DATE, 0.9)]
+    for pattern, confidence in candidates:
+        found = set(pattern.findall(text))
+        if len(found) == 1:
+            value = found.pop()
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                return None, 0.0
+            return value, confidence
+        if len(found) > 1:
+            return None, 0.0   # ambiguous, let the LLM decide
+    relative = {r.lower() for r in _RELATIVE.findall(text)}
+    if len(relative) == 1:
+        offset = 1 if relative.pop() == "tomorrow" else 0
+        return (today + timedelta(days=offset)).isoformat(), 0.9
+    return None, 0.0
+
+
+def _extract_time(text: str) -> Tuple[Optional[str], float]:
+    m = _AT_TIME.search(text)
+    if m:
+        return _format_time(int(m.group(1)), int(m.group(2)), m.group(3)), 1.0
+    found = {_format_time(int(h), int(mm or 0), ap) for h, mm, ap in _ANY_TIME.findall(text)}
+    found.discard(None)
+    if len(found) == 1:
+        return found.pop(), 0.9
+    return None, 0.0
+
+
+# ---- Normalization ----
+# Canonical forms for values an LLM wrote loosely, so they can be fixed locally
+# instead of asking again. Ambiguous input (a bare "10", "02/03/2026") gives None.
+
+def normalize_time(value) -> Optional[str]:
+    """"10:00AM", "10am", "2.30 p.m.", "14:30" → "HH:MM AM/PM"."""
+    m = _CLOCK.match(str(value or ""))
+    if not m:
+        return None
+    hour, minute, meridiem = int(m.group(1)), int(m.group(2) or 0), m.group(3)
+    if meridiem is None:
+        if m.group(2) is None or hour > 23:
+            return None
+        meridiem = "a" if hour < 12 else "p"
+        hour = hour % 12 or 12
+    return _format_time(hour, minute, meridiem)
+
+
+def normalize_date(value, today: Optional[date] = None) -> Optional[str]:
+    """"2026/3/2", "March 2nd, 2026", "tomorrow", "2026-03-02T00:00:00" → "YYYY-MM-DD"."""
+    text = str(value or "").strip()
+    if text.lower() in ("today", "tomorrow"):
+        today = today or datetime.now().date()
+        return (today + timedelta(days=text.lower() == "tomorrow")).isoformat()
+    m = _NUMERIC_DAY.match(text)
+    if m:
+        try:
+            return date(*map(int, m.groups())).isoformat()
+        except ValueError:
+            return None
+    text = _ORDINAL.sub(r"\1", text)
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            pass
+    return None
+
+
+def extract_doctor(text: str) -> Optional[str]:
+    """The doctor the patient addresses or asks for ("Dear Dr. Smith", "with dr Patel"), if exactly one."""
+    found = set(_DOCTOR.findall(text))
+    return f"Dr. {found.pop()}" if len(found) == 1 else None
+
+
+def extract_specialty(text: str) -> Optional[str]:
+    """The kind of doctor asked for ("a cardiologist", "skin problem" → dermatology), if exactly one."""
+    found = {m.lastgroup.replace("_", " ") for m in _SPECIALTY.finditer(text)}
+    return found.pop() if len(found) == 1 else None
+
+
+def fast_parse_email(raw_email: str, fields: Tuple[str, ...] = PARSE_FIELDS, today: Optional[date] = None) -> FastParseResult:
+    """Rule-based extraction of the ParseEmail fields with per-field confidence."""
+    today = today or datetime.now().date()
+    values: Dict[str, object] = {}
+    confidence: Dict[str, float] = {}
+
+    name, confidence["patient_name"] = _extract_name(raw_email)
+    values["patient_name"] = name
+    if "patient_email" in fields:
+        values["patient_email"], confidence["patient_email"] = _extract_email(raw_email, name)
+    if "patient_age" in fields:
+        values["patient_age"], confidence["patient_age"] = _extract_age(raw_email)
+    values["requested_date"], confidence["requested_date"] = _extract_date(raw_email, today)
+    values["requested_time"], confidence["requested_time"] = _extract_time(raw_email)
+
+    return FastParseResult(
+        fields={k: v for k, v in values.items() if v is not None},
+        confidence=confidence,
+        requested=tuple(fields),
+    )
@@ -0,0 +1,102 @@
+import hashlib
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional, Type
+
+from pydantic import BaseModel, ValidationError
+
+# ---- Content-addressed cache for structured LLM outputs ----
+# Key: (model, schema class, prompt with whitespace collapsed). Values are kept as
+# validated pydantic objects in an in-memory LRU tier and, optionally, as JSON in
+# a SQLite tier that survives restarts. A disk entry that no longer validates
+# against its schema (the model class changed) is treated as a miss.
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def cache_key(model: str, schema: Type[BaseModel], prompt: str) -> str:
+    raw = "\x00".join((model, f"{schema.__module__}.{schema.__qualname__}", normalize_prompt(prompt)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class StructuredLLMCache:
+    def __init__(self, max_entries: int = 1024, db_path: Optional[str] = None, enabled: bool = True):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._memory: "OrderedDict[str, BaseModel]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, schema TEXT NOT NULL, value TEXT NOT NULL)"
+            )
+
+    def get(self, model: str, schema: Type[BaseModel], prompt: str) -> Optional[BaseModel]:
+        if not self.enabled:
+            return None
+        key = cache_key(model, schema, prompt)
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value.model_copy()
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    try:
+                        value = schema.model_validate_json(row[0])
+                    except ValidationError:
+                        value = None
+                    if value is not None:
+                        self._remember(key, value)
+                        self.disk_hits += 1
+                        return value.model_copy()
+            self.misses += 1
+            return None
+
+    def put(self, model: str, schema: Type[BaseModel], prompt: str, value: BaseModel):
+        if not self.enabled or not isinstance(value, schema):
+            return
+        key = cache_key(model, schema, prompt)
+        with self._lock:
+            self._remember(key, value.model_copy())
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, schema, value) VALUES (?, ?, ?)",
+                    (key, schema.__qualname__, value.model_dump_json()),
+                )
+
+    def _remember(self, key: str, value: BaseModel):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "entries": len(self._memory),
+        }
@@ -0,0 +1,175 @@
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+from langchain_ollama import ChatOllama
+
+logger = logging.getLogger(__name__)
+
+# ---- Local LLM clients ----
+# One ChatOllama per Ollama endpoint, each holding a pooled, keep-alive HTTP
+# client (OLLAMA_POOL_SIZE connections). Structured-output runnables are built
+# once per (endpoint, schema) and reused instead of calling with_structured_output
+# on every request. Requests are spread round-robin over OLLAMA_HOSTS, so adding
+# another `ollama serve` box adds parse / draft throughput. Every request carries
+# OLLAMA_KEEP_ALIVE so the model stays loaded between bursts, and warm_up() loads
+# it on every endpoint at startup instead of on the first patient email.
+
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3.1")
+OLLAMA_HOSTS = [h.strip() for h in os.environ.get("OLLAMA_HOSTS", "http://localhost:11434").split(",") if h.strip()]
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", 8))        # HTTP connections per endpoint
+OLLAMA_TIMEOUT_S = float(os.environ.get("OLLAMA_TIMEOUT_S", 120))
+
+# ---- Model routing ----
+# Extraction nodes (email / reply parsing, reply classification) run on a small
+# quantized model; drafting and everything not listed stays on OLLAMA_MODEL.
+# NODE_MODELS="node=model,..." overrides or extends the table. The agent escalates
+# a small-model answer to OLLAMA_MODEL when it fails validation.
+OLLAMA_SMALL_MODEL = os.environ.get("OLLAMA_SMALL_MODEL", "llama3.2:3b")
+NODE_MODELS = {
+    "scan_and_parse_email": OLLAMA_SMALL_MODEL,
+    "receive_patient_response": OLLAMA_SMALL_MODEL,
+}
+NODE_MODELS.update(
+    (node.strip(), model.strip())
+    for node, _, model in (pair.partition("=") for pair in os.environ.get("NODE_MODELS", "").split(","))
+    if node.strip() and model.strip()
+)
+
+
+def chat_model(host: str, model: str = OLLAMA_MODEL, keep_alive: str = OLLAMA_KEEP_ALIVE,
+               pool_size: int = OLLAMA_POOL_SIZE) -> ChatOllama:
+    """ChatOllama for one endpoint with a bounded keep-alive connection pool."""
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=300)
+    return ChatOllama(model=model, base_url=host, keep_alive=keep_alive,
+                      client_kwargs={"limits": limits, "timeout": OLLAMA_TIMEOUT_S})
+
+
+class LLMClients:
+    """Chat models for every endpoint plus their cached structured runnables, picked round-robin."""
+
+    def __init__(self, models: Sequence):
+        self._lock = threading.Lock()
+        self.set_models(models)
+
+    @classmethod
+    def from_env(cls) -> "LLMClients":
+        return cls([chat_model(host) for host in OLLAMA_HOSTS])
+
+    def set_models(self, models: Sequence):
+        """Swap the endpoints (e.g. for a fake model in benchmarks); drops the built runnables."""
+        with self._lock:
+            self.models = list(models)
+            self._structured: Dict[Tuple[int, type], object] = {}
+            self._turn = itertools.count()
+
+    @property
+    def model(self) -> str:
+        """Model name, part of the LLM cache key."""
+        return getattr(self.models[0], "model", "")
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    # ---- Runnables ----
+    def _runnable(self, endpoint: int, schema):
+        key = (endpoint, schema)
+        runnable = self._structured.get(key)
+        if runnable is None:
+            with self._lock:
+                runnable = self._structured.get(key)
+                if runnable is None:
+                    runnable = self._structured[key] = self.models[endpoint].with_structured_output(schema)
+        return runnable
+
+    def structured(self, schema):
+        """Structured-output runnable for `schema` on the next endpoint in turn."""
+        return self._runnable(next(self._turn) % len(self.models), schema)
+
+    def batch(self, schema, prompts: List[str], max_concurrency: int, return_exceptions: bool = False) -> list:
+        """Spread `prompts` over all endpoints, each running up to `max_concurrency` at once; results in order."""
+        if len(self.models) == 1 or len(prompts) < 2:
+            return self.structured(schema).batch(prompts, config={"max_concurrency": max_concurrency},
+                                                 return_exceptions=return_exceptions)
+        shares = [list(range(i, len(prompts), len(self.models))) for i in range(len(self.models))]
+        results: list = [None] * len(prompts)
+
+        def run(endpoint: int):
+            indices = shares[endpoint]
+            if not indices:
+                return
+            responses = self._runnable(endpoint, schema).batch(
+                [prompts[i] for i in indices], config={"max_concurrency": max_concurrency},
+                return_exceptions=return_exceptions)
+            for i, response in zip(indices, responses):
+                results[i] = response
+
+        with ThreadPoolExecutor(max_workers=len(self.models)) as pool:
+            list(pool.map(run, range(len(self.models))))
+        return results
+
+    # ---- Warm-up ----
+    def warm_up(self, background: bool = True) -> Optional[threading.Thread]:
+        """Load the model on every endpoint (an empty generate with keep_alive) so the first email does not pay for it."""
+        def run():
+            for chat in self.models:
+                client = getattr(chat, "_client", None)   # the pooled ollama.Client of that ChatOllama
+                if client is None:
+                    continue
+                try:
+                    client.generate(model=chat.model, prompt="", keep_alive=chat.keep_alive)
+                    logger.info("warmed %s on %s", chat.model, chat.base_url)
+                except Exception as e:
+                    logger.warning("warm-up of %s on %s failed: %s", chat.model, chat.base_url, e)
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name="llm-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+class LLMRouter:
+    """One LLMClients per model name; a node gets the model NODE_MODELS names for it, else the default."""
+
+    def __init__(self, clients: Dict[str, LLMClients], node_models: Dict[str, str], default_model: str = OLLAMA_MODEL):
+        self.clients = dict(clients)
+        self.node_models = dict(node_models)
+        self.default_model = default_model
+
+    @classmethod
+    def from_env(cls) -> "LLMRouter":
+        models = {OLLAMA_MODEL, *NODE_MODELS.values()}
+        return cls({model: LLMClients([chat_model(host, model) for host in OLLAMA_HOSTS]) for model in models},
+                   NODE_MODELS)
+
+    def set_models(self, models: Sequence):
+        """Serve every node from `models` (e.g. a fake model in benchmarks); nothing is escalated then."""
+        self.clients = {self.default_model: LLMClients(models)}
+
+    @property
+    def default(self) -> LLMClients:
+        return self.clients[self.default_model]
+
+    def __len__(self) -> int:
+        """Endpoints per model."""
+        return len(self.default)
+
+    def for_node(self, node: Optional[str]) -> LLMClients:
+        return self.clients.get(self.node_models.get(node), self.default)
+
+    def escalation(self, node: Optional[str]) -> Optional[LLMClients]:
+        """Where to retry an answer of `node` that failed validation: the default model, unless it already ran there."""
+        clients = self.for_node(node)
+        return None if clients is self.default else self.default
+
+    def warm_up(self, background: bool = True) -> List[threading.Thread]:
+        """Load every routed model on every endpoint."""
+        threads = [clients.warm_up(background) for clients in self.clients.values()]
+        return [t for t in threads if t is not None]
@@ -0,0 +1,223 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from slot_calendar import TICK_MINUTES, parse_slot
+
+# ---- Slot reservations shared across sessions and worker processes ----
+# A slot is free unless it has a live claim here. Claims are either a booking
+# (permanent) or a hold (tentative, expires at `expires_at`). Every claim is one
+# upsert whose ON CONFLICT ... WHERE clause is the compare step, so SQLite's
+# write lock is the only serialization point: no Python lock, no read-then-write
+# race. An expired hold is treated as free by every statement, so expiry needs no
+# background sweeper; purge_expired() only keeps the table small.
+#
+# Claims are per resource and time, not per label: "… with Dr. Smith in Room 1"
+# and "… with Dr. Smith in Room 2" at 9:00 are different labels but the same
+# doctor, and 9:00-10:00 and 9:30-10:30 overlap. A slot claims one row for each
+# of its Slot.claim_keys, its doctor and its room for every 5-minute tick it
+# covers ("doctor:Dr. Smith@2026-11-02T09:05", "room:Room 1@…", or "slot@…" for
+# a slot naming no doctor), all of them in one transaction or none.
+
+RESERVATIONS_DB = os.environ.get("RESERVATIONS_DB", "reservations.sqlite")
+HOLD_TTL_S = float(os.environ.get("SLOT_HOLD_TTL_S", 24 * 3600))   # how long proposed slots stay held
+
+BOOKED = "booked"
+HELD = "held"
+CLAIMS_VERSION = 1   # PRAGMA user_version: claims cover every tick of their slot
+
+# Claim `key` for `holder` if it is free, already claimed by the same holder (a hold
+# never downgrades that holder's booking), or held by someone whose hold has expired.
+_CLAIM = """
+    INSERT INTO slot_claims (key, start, label, kind, holder, expires_at)
+    VALUES (:key, :start, :label, :kind, :holder, :expires_at)
+    ON CONFLICT(key) DO UPDATE SET label = excluded.label, kind = excluded.kind, holder = excluded.holder,
+                                   expires_at = excluded.expires_at
+    WHERE (slot_claims.holder = excluded.holder AND (slot_claims.kind = 'held' OR excluded.kind = 'booked'))
+       OR (slot_claims.kind = 'held' AND slot_claims.expires_at <= :now)
+"""
+
+
+def _start(when: datetime) -> str:
+    return when.isoformat(timespec="minutes")
+
+
+def claim_keys(label: str) -> List[Tuple[str, str]]:
+    """(key, tick start) rows booking `label` takes; a label that does not parse only conflicts with itself."""
+    slot = parse_slot(label)
+    if slot is None:
+        return [(f"label:{label}", "")]
+    return [(key, key.rpartition("@")[2]) for key in slot.claim_keys]
+
+
+class ReservationStore:
+    """SQLite-backed compare-and-reserve for the doctors and rooms of slots; one connection per thread."""
+
+    def __init__(self, db_path: str = RESERVATIONS_DB, hold_ttl_s: float = HOLD_TTL_S):
+        self.db_path = db_path
+        self.hold_ttl_s = hold_ttl_s
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS slot_claims (
+                key        TEXT PRIMARY KEY,
+                start      TEXT NOT NULL,
+                label      TEXT NOT NULL,
+                kind       TEXT NOT NULL,
+                holder     TEXT NOT NULL,
+                expires_at REAL
+            ) WITHOUT ROWID"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS slot_claims_start ON slot_claims (start)")
+        conn.execute("CREATE INDEX IF NOT EXISTS slot_claims_holder ON slot_claims (holder, kind)")
+        conn.execute("CREATE INDEX IF NOT EXISTS slot_claims_label ON slot_claims (label)")
+        self._migrate(conn)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """Once: move claims from the old one-row-per-label `reservations` table, and widen
+        claims keyed by start time only (user_version 0) to every tick of their slot."""
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= CLAIMS_VERSION:
+            return
+        with _transaction(conn):
+            old = []
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reservations'").fetchone():
+                old = conn.execute("SELECT label, kind, holder, expires_at FROM reservations").fetchall()
+                conn.execute("DROP TABLE reservations")
+            old += conn.execute("SELECT DISTINCT label, kind, holder, expires_at FROM slot_claims").fetchall()
+            for label, kind, holder, expires_at in old:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO slot_claims (key, start, label, kind, holder, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(key, start, label, kind, holder, expires_at) for key, start in claim_keys(label)],
+                )
+            conn.execute(f"PRAGMA user_version = {CLAIMS_VERSION}")
+
+    @staticmethod
+    def _claim(conn: sqlite3.Connection, label: str, kind: str, holder: str, expires_at: Optional[float], now: float) -> bool:
+        """Claim every resource of `label` inside the caller's transaction; False at the first one taken."""
+        for key, start in claim_keys(label):
+            cur = conn.execute(_CLAIM, {"key": key, "start": start, "label": label, "kind": kind, "holder": holder,
+                                        "expires_at": expires_at, "now": now})
+            if cur.rowcount != 1:
+                return False
+        return True
+
+    # ---- Claims ----
+    def reserve(self, label: str, holder: str) -> bool:
+        """Atomically book `label` for `holder`. False if someone else booked or holds its doctor or room."""
+        conn = self._conn()
+        with _transaction(conn):
+            conn.execute("SAVEPOINT claim")
+            ok = self._claim(conn, label, BOOKED, holder, None, time.time())
+            conn.execute("RELEASE claim" if ok else "ROLLBACK TO claim")
+        return ok
+
+    def hold(self, labels: Iterable[str], holder: str, ttl_s: Optional[float] = None) -> List[str]:
+        """Tentatively hold each free label for `holder`; returns the labels actually held."""
+        now = time.time()
+        expires_at = now + (self.hold_ttl_s if ttl_s is None else ttl_s)
+        held = []
+        conn = self._conn()
+        with _transaction(conn):
+            for label in labels:
+                conn.execute("SAVEPOINT claim")
+                if self._claim(conn, label, HELD, holder, expires_at, now):
+                    conn.execute("RELEASE claim")
+                    held.append(label)
+                else:
+                    conn.execute("ROLLBACK TO claim")
+                    conn.execute("RELEASE claim")
+        return held
+
+    def release(self, holder: str, labels: Optional[Iterable[str]] = None) -> int:
+        """Drop `holder`'s holds (all of them, or just `labels`). Bookings are kept."""
+        if labels is None:
+            cur = self._conn().execute("DELETE FROM slot_claims WHERE holder = ? AND kind = ?", (holder, HELD))
+        else:
+            cur = self._conn().executemany(
+                "DELETE FROM slot_claims WHERE holder = ? AND kind = ? AND label = ?",
+                [(holder, HELD, label) for label in labels],
+            )
+        return cur.rowcount
+
+    def cancel(self, label: str, holder: str) -> bool:
+        """Give a booked slot back."""
+        cur = self._conn().execute("DELETE FROM slot_claims WHERE label = ? AND holder = ?", (label, holder))
+        return cur.rowcount > 0
+
+    def purge_expired(self) -> int:
+        cur = self._conn().execute("DELETE FROM slot_claims WHERE kind = ? AND expires_at <= ?", (HELD, time.time()))
+        return cur.rowcount
+
+    # ---- Queries ----
+    def taken(self, labels: Iterable[str], holder: Optional[str] = None) -> Dict[str, Tuple[str, str]]:
+        """{label: (kind, holder)} for labels whose doctor, room or time is booked or held by anyone other than `holder`."""
+        keys = {label: claim_keys(label) for label in labels}
+        wanted = sorted({key for rows in keys.values() for key, _ in rows})
+        claims: Dict[str, Tuple[str, str]] = {}
+        now = time.time()
+        for i in range(0, len(wanted), 500):   # stay under SQLite's bound-parameter limit
+            chunk = wanted[i:i + 500]
+            rows = self._conn().execute(
+                f"SELECT key, kind, holder FROM slot_claims WHERE key IN ({','.join('?' * len(chunk))})"
+                " AND (kind = ? OR expires_at > ?)",
+                (*chunk, BOOKED, now),
+            )
+            for key, kind, row_holder in rows:
+                if row_holder != holder:
+                    claims[key] = (kind, row_holder)
+        out: Dict[str, Tuple[str, str]] = {}
+        for label, rows in keys.items():
+            found = [claims[key] for key, _ in rows if key in claims]
+            if found:
+                out[label] = min(found, key=lambda claim: claim[0] != BOOKED)   # a booking outranks a hold
+        return out
+
+    def free(self, labels: Iterable[str], holder: Optional[str] = None) -> List[str]:
+        """`labels` that `holder` could still claim, in the given order."""
+        labels = list(labels)
+        taken = self.taken(labels, holder)
+        return [label for label in labels if label not in taken]
+
+    def busy_during(self, start: datetime, end: datetime, holder: Optional[str] = None) -> Set[str]:
+        """Claim keys of the ticks in [start, end) that are booked or held by anyone other than `holder`."""
+        first = start - timedelta(minutes=start.minute % TICK_MINUTES)
+        rows = self._conn().execute(
+            "SELECT key FROM slot_claims WHERE start >= ? AND start < ? AND holder IS NOT ? AND (kind = ? OR expires_at > ?)",
+            (_start(first), _start(end), holder, BOOKED, time.time()),
+        )
+        return {key for (key,) in rows}
+
+    def holds_of(self, holder: str) -> List[str]:
+        rows = self._conn().execute(
+            "SELECT DISTINCT label FROM slot_claims WHERE holder = ? AND kind = ? AND expires_at > ? ORDER BY label",
+            (holder, HELD, time.time()),
+        )
+        return [label for (label,) in rows]
+
+    def clear(self):
+        self._conn().execute("DELETE FROM slot_claims")
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
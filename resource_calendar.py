@@ -0,0 +1,323 @@
+import copy
+import heapq
+from bisect import insort
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from slot_calendar import (
+    MINUTES_PER_DAY,
+    RANK_DAY_WEIGHT,
+    RANK_DOCTOR_PENALTY,
+    RANK_HOUR_WEIGHT,
+    RANK_WEEKDAY_PENALTY,
+    TICK_MINUTES,
+    Slot,
+    SlotCalendar,
+    claim_key,
+    claim_ticks,
+    day_number,
+    normalize_doctor,
+    parse_slot,
+)
+
+# ---- Doctors × rooms × time ----
+# Each resource gets one boolean row per day at TICK_MINUTES granularity: True
+# means the doctor is working and not booked, or the room is open and unused. A
+# bookable slot is a `slot_minutes` window on a fixed grid where the doctor's row
+# and at least one room's row are all True, so "is this free" is a vectorized AND
+# across the resources it needs instead of a scan over slot strings. Slots are
+# derived from the bitmaps on demand as Slot records with a doctor and a room;
+# their "with Dr. X in Room" labels are only formatted when an email, the UI or
+# the reservation store asks for them.
+
+TICKS_PER_DAY = 24 * 60 // TICK_MINUTES
+
+
+def _tick(when: datetime) -> int:
+    return (when.hour * 60 + when.minute) // TICK_MINUTES
+
+
+class ResourceCalendar(SlotCalendar):
+    """
+    Bitmap calendar for many doctors and rooms, usable wherever the agent takes a
+    SlotCalendar. `doctors` maps each doctor's name to their specialty.
+    """
+
+    def __init__(self, doctors: Dict[str, str], rooms: Sequence[str], slot_minutes: int = 30):
+        slot_ticks, rest = divmod(slot_minutes, TICK_MINUTES)
+        if rest or slot_ticks == 0 or TICKS_PER_DAY % slot_ticks:
+            raise ValueError(f"slot_minutes must be a multiple of {TICK_MINUTES} that divides a day, got {slot_minutes}")
+        self.doctors = [normalize_doctor(name) for name in doctors]
+        self.specialties = [specialty.lower() for specialty in doctors.values()]
+        self.rooms = list(rooms)
+        self.slot_minutes = slot_minutes
+        self.slot_ticks = slot_ticks
+        self._doctor_index = {name: i for i, name in enumerate(self.doctors)}
+        self._room_index = {room: i for i, room in enumerate(self.rooms)}
+        self._doctor_free: Dict[date, np.ndarray] = {}   # (n_doctors, TICKS_PER_DAY) bool
+        self._room_free: Dict[date, np.ndarray] = {}     # (n_rooms, TICKS_PER_DAY) bool
+        self._day_keys: List[date] = []
+
+    # ---- Opening hours ----
+    def open_hours(self, start: datetime, end: datetime,
+                   doctors: Optional[Iterable[str]] = None, rooms: Optional[Iterable[str]] = None):
+        """Mark `doctors` (default all) working and `rooms` (default all) open from `start` to `end` on one day."""
+        doc, room = self._arrays(start.date(), create=True)
+        t0, t1 = _tick(start), _tick(end) if end.date() == start.date() else TICKS_PER_DAY
+        doc[self._rows(self._doctor_index, doctors, normalize_doctor), t0:t1] = True
+        room[self._rows(self._room_index, rooms), t0:t1] = True
+
+    def close_hours(self, start: datetime, end: datetime,
+                    doctors: Optional[Iterable[str]] = None, rooms: Optional[Iterable[str]] = None):
+        """Take `doctors` / `rooms` out of service (leave, maintenance). Pass [] to leave one side untouched."""
+        arrays = self._arrays(start.date())
+        if arrays is None:
+            return
+        doc, room = arrays
+        t0, t1 = _tick(start), _tick(end) if end.date() == start.date() else TICKS_PER_DAY
+        doc[self._rows(self._doctor_index, doctors, normalize_doctor), t0:t1] = False
+        room[self._rows(self._room_index, rooms), t0:t1] = False
+
+    @staticmethod
+    def _rows(index: Dict[str, int], names: Optional[Iterable[str]], normalize=None) -> List[int]:
+        if names is None:
+            return list(index.values())
+        return [index[normalize(name) if normalize else name] for name in names]
+
+    def _arrays(self, day: date, create: bool = False) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        if day not in self._doctor_free:
+            if not create:
+                return None
+            self._doctor_free[day] = np.zeros((len(self.doctors), TICKS_PER_DAY), dtype=bool)
+            self._room_free[day] = np.zeros((len(self.rooms), TICKS_PER_DAY), dtype=bool)
+            insort(self._day_keys, day)
+        return self._doctor_free[day], self._room_free[day]
+
+    # ---- Vectorized availability ----
+    def _grid(self, day: date) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(doctor_ok, room_ok): whether each doctor / room is free for every slot window of `day`."""
+        arrays = self._arrays(day)
+        if arrays is None:
+            return None
+        doc, room = arrays
+        n_grid = TICKS_PER_DAY // self.slot_ticks
+        doctor_ok = doc.reshape(len(self.doctors), n_grid, self.slot_ticks).all(axis=2)
+        room_ok = room.reshape(len(self.rooms), n_grid, self.slot_ticks).all(axis=2)
+        return doctor_ok, room_ok
+
+    def _doctor_mask(self, doctor: Optional[str] = None, specialty: Optional[str] = None) -> np.ndarray:
+        """Doctors eligible for a request. An unknown doctor or specialty filters nothing."""
+        mask = np.ones(len(self.doctors), dtype=bool)
+        if specialty and specialty.lower() in self.specialties:
+            mask &= np.array([s == specialty.lower() for s in self.specialties])
+        doctor = normalize_doctor(doctor)
+        if doctor in self._doctor_index:
+            mask &= np.arange(len(self.doctors)) == self._doctor_index[doctor]
+        return mask
+
+    def _available(self, day: date, mask: Optional[np.ndarray] = None, room: Optional[str] = None,
+                   prefer: Optional[str] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (bookable, room_of): doctor × grid matrices of the windows that can be booked
+        and the room each would get. At one time the n-th eligible free doctor gets
+        the n-th free room, so doctors beyond the free-room count are not offered;
+        the `prefer`red doctor is counted first.
+        """
+        grid = self._grid(day)
+        if grid is None:
+            return None
+        doctor_ok, room_ok = grid
+        if room is not None:
+            only = np.arange(len(self.rooms)) == self._room_index.get(room, -1)
+            room_ok = room_ok & only[:, None]
+        bookable = doctor_ok if mask is None else doctor_ok & mask[:, None]
+        order = np.arange(len(self.doctors))
+        if prefer in self._doctor_index:
+            first = self._doctor_index[prefer]
+            order = np.concatenate(([first], order[order != first]))
+        rank = np.empty_like(bookable, dtype=np.int64)
+        rank[order] = np.cumsum(bookable[order], axis=0) - 1
+        bookable = bookable & (rank < room_ok.sum(axis=0))
+        free_rooms_first = np.argsort(~room_ok, axis=0, kind="stable")
+        room_of = np.take_along_axis(free_rooms_first, np.clip(rank, 0, len(self.rooms) - 1), axis=0)
+        return bookable, room_of
+
+    def _slot(self, day: date, doctor: int, g: int, room: int) -> Slot:
+        start = day_number(day) * MINUTES_PER_DAY + g * self.slot_minutes
+        return Slot(start, start + self.slot_minutes, self.doctors[doctor], self.rooms[room])
+
+    def _span(self, slot: Slot) -> Optional[Tuple[date, int, int, int, int]]:
+        """(day, doctor row, room row, first tick, end tick) of a labelled slot."""
+        if slot.doctor not in self._doctor_index or slot.room not in self._room_index:
+            return None
+        day_start = slot.day_number * MINUTES_PER_DAY
+        end = min(slot.end_min - day_start, MINUTES_PER_DAY)
+        return (slot.day, self._doctor_index[slot.doctor], self._room_index[slot.room],
+                (slot.start_min - day_start) // TICK_MINUTES, end // TICK_MINUTES)
+
+    # ---- Mutation ----
+    def add(self, slot: "Slot | str") -> Optional[Slot]:
+        """Give a doctor + room window back (a cancelled booking). Unlabelled slots are skipped."""
+        if isinstance(slot, str):
+            slot = parse_slot(slot)
+        span = self._span(slot) if slot else None
+        if span is None:
+            return None
+        day, d, r, t0, t1 = span
+        doc, room = self._arrays(day, create=True)
+        doc[d, t0:t1] = True
+        room[r, t0:t1] = True
+        return slot
+
+    def remove(self, slot: "Slot | str") -> bool:
+        """Book a slot: clears its doctor's and room's ticks. False if either is not free."""
+        if isinstance(slot, str):
+            slot = parse_slot(slot)
+        span = self._span(slot) if slot else None
+        if span is None or slot not in self:
+            return False
+        day, d, r, t0, t1 = span
+        doc, room = self._arrays(day)
+        doc[d, t0:t1] = False
+        room[r, t0:t1] = False
+        return True
+
+    # ---- Queries ----
+    def find(self, when: datetime, doctor: Optional[str] = None, specialty: Optional[str] = None,
+             busy: Optional[Set[str]] = None) -> Optional[Slot]:
+        """
+        The grid slot containing `when` with the first eligible free doctor and
+        room, leaving out doctors and rooms with a claim key in `busy` for any of its ticks.
+        """
+        arrays = self._arrays(when.date())
+        if arrays is None:
+            return None
+        doc, room = arrays
+        g = _tick(when) // self.slot_ticks
+        window = slice(g * self.slot_ticks, (g + 1) * self.slot_ticks)
+        doctor_ok = doc[:, window].all(axis=1) & self._doctor_mask(doctor, specialty)
+        room_ok = room[:, window].all(axis=1)
+        if busy:
+            start = day_number(when.date()) * MINUTES_PER_DAY + g * self.slot_minutes
+            ticks = claim_ticks(start, start + self.slot_minutes)
+            doctor_ok &= np.array([not any(claim_key(f"doctor:{name}", t) in busy for t in ticks) for name in self.doctors])
+            room_ok &= np.array([not any(claim_key(f"room:{name}", t) in busy for t in ticks) for name in self.rooms])
+        doctors = np.flatnonzero(doctor_ok)
+        rooms = np.flatnonzero(room_ok)
+        if not len(doctors) or not len(rooms):
+            return None
+        return self._slot(when.date(), int(doctors[0]), g, int(rooms[0]))
+
+    def nearest(self, when: datetime, k: int, doctor: Optional[str] = None, specialty: Optional[str] = None,
+                not_before: Optional[datetime] = None) -> List[Slot]:
+        """
+        The `k` bookable slots closest to `when`, scored like SlotCalendar.nearest.
+        `specialty` is a hard filter, `doctor` a preference; nothing starts before
+        `not_before` (default now).
+        """
+        if k <= 0:
+            return []
+        mask = self._doctor_mask(specialty=specialty)
+        doctor = normalize_doctor(doctor)
+        doctor_penalty = np.array([RANK_DOCTOR_PENALTY if doctor and name != doctor else 0.0 for name in self.doctors])
+        n_grid = TICKS_PER_DAY // self.slot_ticks
+        grid_minutes = np.arange(n_grid) * self.slot_minutes
+        hour_penalty = np.abs(grid_minutes - (when.hour * 60 + when.minute)) / 60 * RANK_HOUR_WEIGHT
+        day = when.date()
+        floor = not_before or datetime.now()
+        started = grid_minutes < floor.hour * 60 + floor.minute   # windows already begun on the floor's day
+        best: List[Tuple[float, int, Slot]] = []
+        seq = 0
+
+        for current in self._days_near(day):
+            if current < floor.date():
+                continue
+            day_penalty = abs((current - day).days) * RANK_DAY_WEIGHT
+            if len(best) == k and day_penalty >= -best[0][0]:
+                break
+            if current.weekday() != day.weekday():
+                day_penalty += RANK_WEEKDAY_PENALTY
+            available = self._available(current, mask, prefer=doctor)
+            if available is None:
+                continue
+            bookable, room_of = available
+            if current == floor.date():
+                bookable = bookable & ~started[None, :]
+            scores = np.where(bookable, day_penalty + hour_penalty[None, :] + doctor_penalty[:, None], np.inf)
+            flat = scores.ravel()
+            m = min(k, int(bookable.sum()))
+            if m == 0:
+                continue
+            top = np.argpartition(flat, m - 1)[:m] if m < flat.size else np.arange(flat.size)
+            for i in top[np.lexsort((top, flat[top]))]:
+                d, g = divmod(int(i), n_grid)
+                score = float(flat[i])
+                seq += 1
+                if len(best) < k:
+                    heapq.heappush(best, (-score, -seq, self._slot(current, d, g, int(room_of[d, g]))))
+                elif score < -best[0][0]:
+                    heapq.heapreplace(best, (-score, -seq, self._slot(current, d, g, int(room_of[d, g]))))
+        return [slot for _, _, slot in sorted(best, key=lambda item: (-item[0], -item[1]))]
+
+    def select(self, doctor: Optional[str] = None, specialty: Optional[str] = None, room: Optional[str] = None,
+               day: Optional[date] = None) -> List[Slot]:
+        """Bookable slots filtered by resource (and `day`), in chronological order."""
+        mask = self._doctor_mask(doctor, specialty)
+        out = []
+        for day in ([day] if day else self._days()):
+            out.extend(self.on_date(day, mask, room))
+        return out
+
+    def on_date(self, day: date, mask: Optional[np.ndarray] = None, room: Optional[str] = None) -> List[Slot]:
+        """Bookable slots on `day`, by start time then doctor."""
+        available = self._available(day, mask, room)
+        if available is None:
+            return []
+        bookable, room_of = available
+        return [self._slot(day, int(d), int(g), int(room_of[d, g])) for g, d in zip(*np.nonzero(bookable.T))]
+
+    def specialty_of(self, doctor: str) -> Optional[str]:
+        i = self._doctor_index.get(normalize_doctor(doctor))
+        return None if i is None else self.specialties[i]
+
+    def _days(self) -> List[date]:
+        """Days listed by iteration, len() and select(), in order."""
+        return self._day_keys
+
+    def _days_near(self, day: date) -> Iterator[date]:
+        """Days nearest() may search, closest to `day` first."""
+        return iter(sorted(self._day_keys, key=lambda d: (abs((d - day).days), d < day)))
+
+    def copy(self) -> "ResourceCalendar":
+        return copy.deepcopy(self)
+
+    def __iter__(self) -> Iterator[Slot]:
+        for day in self._days():
+            yield from self.on_date(day)
+
+    def __len__(self) -> int:
+        total = 0
+        for day in self._days():
+            bookable, _ = self._available(day)
+            total += int(bookable.sum())
+        return total
+
+    def __bool__(self) -> bool:
+        return any(self._available(day)[0].any() for day in self._days())
+
+    def __contains__(self, slot) -> bool:
+        """True for a slot this calendar offers: on the grid, `slot_minutes` long, doctor and room free."""
+        if isinstance(slot, str):
+            slot = parse_slot(slot)
+        span = self._span(slot) if slot else None
+        if span is None or slot.start_min % self.slot_minutes or slot.end_min - slot.start_min != self.slot_minutes:
+            return False
+        day, d, r, t0, t1 = span
+        arrays = self._arrays(day)
+        return arrays is not None and bool(arrays[0][d, t0:t1].all() and arrays[1][r, t0:t1].all())
+
+    def __repr__(self) -> str:
+        return (f"ResourceCalendar({len(self.doctors)} doctors × {len(self.rooms)} rooms over "
+                f"{len(self._day_keys)} days, {self.slot_minutes}-minute slots)")
@@ -0,0 +1,115 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+# ---- Persistent human review queue ----
+# One row per conversation paused at human_review (keyed by thread_id). The graph
+# itself holds the paused run in its checkpoint; this table is just the reviewer's
+# work list, so it survives restarts and can be listed / decided in bulk without
+# loading every checkpoint.
+
+REVIEW_QUEUE_DB = os.environ.get("REVIEW_QUEUE_DB", "review_queue.sqlite")
+
+PENDING = "pending"
+APPROVED = "approved"
+REJECTED = "rejected"
+
+
+class ReviewNotPending(ValueError):
+    """The conversation has no draft waiting for review (never queued, or already decided)."""
+
+
+class ReviewQueue:
+    def __init__(self, db_path: str = REVIEW_QUEUE_DB):
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS review_queue (
+                thread_id      TEXT PRIMARY KEY,
+                patient_name   TEXT,
+                patient_email  TEXT,
+                requested      TEXT,
+                draft_email    TEXT NOT NULL,
+                proposed_slots TEXT NOT NULL,
+                status         TEXT NOT NULL,
+                feedback       TEXT,
+                created_at     REAL NOT NULL,
+                decided_at     REAL
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS review_queue_status ON review_queue (status, created_at)")
+
+    def add(self, draft: dict):
+        """Queue a paused draft. Re-adding the same thread refreshes its draft and re-opens it."""
+        with self._lock:
+            self._db.execute(
+                """INSERT INTO review_queue
+                       (thread_id, patient_name, patient_email, requested, draft_email, proposed_slots, status, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(thread_id) DO UPDATE SET
+                       draft_email = excluded.draft_email,
+                       proposed_slots = excluded.proposed_slots,
+                       status = excluded.status,
+                       feedback = NULL,
+                       decided_at = NULL""",
+                (
+                    draft["thread_id"],
+                    draft.get("patient_name"),
+                    draft.get("patient_email"),
+                    f"{draft.get('requested_date')} {draft.get('requested_time')}",
+                    draft.get("draft_email") or "",
+                    json.dumps(draft.get("proposed_slots") or []),
+                    PENDING,
+                    time.time(),
+                ),
+            )
+
+    def pending(self, limit: Optional[int] = None) -> List[dict]:
+        """Oldest first."""
+        sql = "SELECT * FROM review_queue WHERE status = ? ORDER BY created_at"
+        params: tuple = (PENDING,)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        with self._lock:
+            return [self._row(r) for r in self._db.execute(sql, params).fetchall()]
+
+    def get(self, thread_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM review_queue WHERE thread_id = ?", (thread_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def decide(self, thread_id: str, approved: bool, draft_email: Optional[str] = None, feedback: Optional[str] = None) -> bool:
+        """Record the decision on a pending draft. False if it is not pending, so only one decision wins."""
+        with self._lock:
+            cur = self._db.execute(
+                """UPDATE review_queue
+                   SET status = ?, draft_email = COALESCE(?, draft_email), feedback = ?, decided_at = ?
+                   WHERE thread_id = ? AND status = ?""",
+                (APPROVED if approved else REJECTED, draft_email, feedback, time.time(), thread_id, PENDING),
+            )
+        return cur.rowcount == 1
+
+    def reopen(self, thread_id: str):
+        """Put a decided draft back to pending, e.g. when resuming its thread failed."""
+        with self._lock:
+            self._db.execute("UPDATE review_queue SET status = ?, decided_at = NULL WHERE thread_id = ?", (PENDING, thread_id))
+
+    def count(self, status: str = PENDING) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM review_queue WHERE status = ?", (status,)).fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM review_queue")
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        item = dict(row)
+        item["proposed_slots"] = json.loads(item["proposed_slots"])
+        return item
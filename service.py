@@ -0,0 +1,350 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import agent
+from availability_rules import RuleCalendar, load_rules
+from slot_calendar import parse_slot
+from review_queue import PENDING
+from worker_pool import DONE, FAILED, RESUME, REVIEW, RUN, WORKERS, WorkerPool, job_queue
+
+logger = logging.getLogger(__name__)
+
+# ---- Headless service ----
+# The same agent as the Streamlit app, behind an ASGI app, so intake systems can
+# push emails without anyone clicking. Agent runs are jobs for the worker pool
+# (worker_pool.py), so a POST returns as soon as the job is queued and request
+# rate is not bounded by LLM latency. Handlers only touch the shared SQLite files
+# (jobs, checkpoints, review queue, reservations), run off the event loop. Status
+# can be polled or followed as server-sent events, and /metrics serves Prometheus
+# text. Run with `python service.py` or `uvicorn service:app`.
+
+SERVICE_HOST = os.environ.get("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("SERVICE_PORT", 8000))
+STREAM_POLL_S = 0.5          # how often an event stream looks at its job
+STREAM_MAX_S = 15 * 60       # an event stream ends after this even if the job has not
+SUBMIT_MAX_EMAILS = 500      # emails per POST /emails
+
+# Opening hours for GET /slots and POST /slots/reserve; who holds or booked a slot comes from reservations.py
+rules = load_rules()
+
+
+def request_calendar() -> RuleCalendar:
+    """A calendar of its own for one request: handlers run on several threads at once, and
+    bookings are read from the reservation store, so nothing is lost by not sharing one."""
+    return RuleCalendar(rules)
+
+
+# ---- Request metrics ----
+class RequestStats:
+    """Request counts and latency per (method, endpoint, status)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.seconds: Dict[Tuple[str, str], float] = defaultdict(float)
+
+    def record(self, method: str, endpoint: str, status: int, seconds: float):
+        with self._lock:
+            self.requests[(method, endpoint, status)] += 1
+            self.seconds[(method, endpoint)] += seconds
+
+    def snapshot(self) -> Tuple[dict, dict]:
+        with self._lock:
+            return dict(self.requests), dict(self.seconds)
+
+
+request_stats = RequestStats()
+
+
+class RecordRequests:
+    """ASGI middleware feeding request_stats."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")   # set by the router on a match
+            request_stats.record(scope["method"], endpoint, status[0], time.perf_counter() - started)
+
+
+# ---- Helpers ----
+async def json_body(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(400, "body is not JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(400, "body must be a JSON object")
+    return body
+
+
+def job_view(job: dict) -> dict:
+    """A job as the API shows it: the result without the state's event history."""
+    view = {k: job[k] for k in ("job_id", "kind", "status", "error", "attempts", "created_at", "started_at", "finished_at")}
+    view["thread_id"] = job["payload"].get("thread_id")
+    if job["progress"] is not None and job["result"] is None:
+        view["progress"] = job["progress"]   # a streaming run: nodes finished, the draft so far
+    if job["result"] is not None:
+        view["result"] = {k: v for k, v in job["result"].items() if k not in ("logs", "raw_email")}
+    return view
+
+
+def conversation_view(thread_id: str) -> Optional[dict]:
+    state = agent.conversation_state(thread_id)
+    if not state.get("status"):
+        return None
+    return json.loads(json.dumps({k: v for k, v in state.items() if k not in ("logs", "raw_email")}, default=str))
+
+
+# ---- Endpoints ----
+async def submit_email(request: Request) -> JSONResponse:
+    """POST /emails — {"raw_email": ...} or {"emails": [...]}, or a text/plain email. Queues agent runs."""
+    if request.headers.get("content-type", "").startswith("text/plain"):
+        emails = [(await request.body()).decode("utf-8", errors="replace")]
+    else:
+        body = await json_body(request)
+        emails = body["emails"] if "emails" in body else [body["raw_email"]] if body.get("raw_email") else []
+    if not isinstance(emails, list) or not emails or not all(isinstance(e, str) and e.strip() for e in emails):
+        raise HTTPException(400, "give raw_email or a non-empty emails list of strings")
+    if len(emails) > SUBMIT_MAX_EMAILS:
+        raise HTTPException(413, f"at most {SUBMIT_MAX_EMAILS} emails per request")
+    payloads = [{"raw_email": e, "thread_id": uuid.uuid4().hex} for e in emails]
+    job_ids = await run_in_threadpool(job_queue.submit_many, RUN, payloads)
+    jobs = [{"job_id": j, "thread_id": p["thread_id"], "status_url": f"/jobs/{j}"} for j, p in zip(job_ids, payloads)]
+    return JSONResponse({"jobs": jobs} if len(jobs) > 1 else jobs[0], status_code=202)
+
+
+async def get_job(request: Request) -> JSONResponse:
+    """GET /jobs/{job_id}"""
+    job = await run_in_threadpool(job_queue.get, request.path_params["job_id"])
+    if job is None:
+        raise HTTPException(404, "no such job")
+    return JSONResponse(job_view(job))
+
+
+async def job_events(request: Request) -> StreamingResponse:
+    """GET /jobs/{job_id}/events — server-sent events: `status` on every change (with the
+    progress a streaming run reports), then `done`."""
+    job_id = request.path_params["job_id"]
+    if await run_in_threadpool(job_queue.get, job_id) is None:
+        raise HTTPException(404, "no such job")
+
+    async def events():
+        last, deadline = None, time.monotonic() + STREAM_MAX_S
+        while time.monotonic() < deadline and not await request.is_disconnected():
+            job = await run_in_threadpool(job_queue.get, job_id)
+            if job["status"] in (DONE, FAILED):
+                yield f"event: done\ndata: {json.dumps(job_view(job), default=str)}\n\n"
+                return
+            thread_id = job["payload"].get("thread_id")
+            state = await run_in_threadpool(agent.conversation_state, thread_id) if thread_id else {}
+            current = {"job": job["status"], "status": state.get("status"), "next": state.get("next", []),
+                       "progress": job["progress"]}
+            if current != last:
+                yield f"event: status\ndata: {json.dumps(current)}\n\n"
+                last = current
+            await asyncio.sleep(STREAM_POLL_S)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def get_conversation(request: Request) -> JSONResponse:
+    """GET /conversations/{thread_id} — checkpointed state and the nodes it is paused before."""
+    view = await run_in_threadpool(conversation_view, request.path_params["thread_id"])
+    if view is None:
+        raise HTTPException(404, "no such conversation")
+    return JSONResponse(view)
+
+
+async def review(request: Request) -> JSONResponse:
+    """POST /conversations/{thread_id}/review — {"approved": bool, "draft_email"?, "feedback"?}; queues the decision."""
+    thread_id = request.path_params["thread_id"]
+    body = await json_body(request)
+    if not isinstance(body.get("approved"), bool):
+        raise HTTPException(400, "approved must be true or false")
+    draft = await run_in_threadpool(agent.review_queue.get, thread_id)
+    if draft is None or draft["status"] != PENDING:   # the worker's review_draft decides atomically
+        raise HTTPException(409, "no draft waiting for review in this conversation")
+    job_id = await run_in_threadpool(job_queue.submit, REVIEW, {
+        "thread_id": thread_id, "approved": body["approved"],
+        "draft_email": body.get("draft_email"), "feedback": body.get("feedback")})
+    return JSONResponse({"job_id": job_id, "thread_id": thread_id, "status_url": f"/jobs/{job_id}"}, status_code=202)
+
+
+async def reply(request: Request) -> JSONResponse:
+    """POST /conversations/{thread_id}/reply — {"patient_response": ...}; queues the resumed run."""
+    thread_id = request.path_params["thread_id"]
+    body = await json_body(request)
+    if not isinstance(body.get("patient_response"), str) or not body["patient_response"].strip():
+        raise HTTPException(400, "patient_response must be a non-empty string")
+    state = await run_in_threadpool(agent.conversation_state, thread_id)
+    if "receive_patient_response" not in state.get("next", []):
+        raise HTTPException(409, "conversation is not waiting for the patient")
+    job_id = await run_in_threadpool(job_queue.submit, RESUME,
+                                     {"thread_id": thread_id, "updates": {"patient_response": body["patient_response"]}})
+    return JSONResponse({"job_id": job_id, "thread_id": thread_id, "status_url": f"/jobs/{job_id}"}, status_code=202)
+
+
+def _list_slots(day: Optional[date], doctor: Optional[str], specialty: Optional[str], room: Optional[str],
+                free: bool, limit: int) -> list:
+    slots = request_calendar().select(doctor, specialty, room, day)
+    taken = agent.reservations.taken([s.label for s in slots])
+    if free:
+        slots = [s for s in slots if s.label not in taken]
+    return [{"slot": s.label, "doctor": s.doctor, "room": s.room, "taken": taken.get(s.label, (None,))[0]}
+            for s in slots[:limit]]
+
+
+async def list_slots(request: Request) -> JSONResponse:
+    """GET /slots?date=&doctor=&specialty=&room=&free=1&limit= — bookable slots and whether they are held / booked."""
+    q = request.query_params
+    try:
+        day = date.fromisoformat(q["date"]) if q.get("date") else None
+        limit = int(q.get("limit", 200))
+    except ValueError:
+        raise HTTPException(400, "date must be YYYY-MM-DD and limit a number")
+    slots = await run_in_threadpool(_list_slots, day, q.get("doctor"), q.get("specialty"), q.get("room"),
+                                    q.get("free") in ("1", "true"), limit)
+    return JSONResponse({"slots": slots})
+
+
+async def reserve_slot(request: Request) -> JSONResponse:
+    """POST /slots/reserve — {"slot", "holder", "hold_s"?}: book the slot, or hold it for hold_s seconds."""
+    body = await json_body(request)
+    slot, holder = body.get("slot"), body.get("holder")
+    if not isinstance(slot, str) or parse_slot(slot) is None or not isinstance(holder, str) or not holder:
+        raise HTTPException(400, "give a slot label and a holder")
+    hold_s = body.get("hold_s")
+    if hold_s is not None:
+        try:
+            hold_s = float(hold_s)
+        except (TypeError, ValueError):
+            hold_s = 0.0
+        if not hold_s > 0:   # also NaN
+            raise HTTPException(400, "hold_s must be a positive number of seconds")
+    if not await run_in_threadpool(lambda: slot in request_calendar()):   # on the grid, in the opening hours
+        raise HTTPException(404, "no such slot: give a label as GET /slots lists it")
+    if hold_s is not None:
+        ok = bool(await run_in_threadpool(agent.reservations.hold, [slot], holder, hold_s))
+    else:
+        ok = await run_in_threadpool(agent.reservations.reserve, slot, holder)
+    if not ok:
+        raise HTTPException(409, "slot is already held or booked")
+    return JSONResponse({"slot": slot, "holder": holder, "kind": "held" if hold_s is not None else "booked"})
+
+
+async def metrics(request: Request) -> PlainTextResponse:
+    """GET /metrics — Prometheus text format."""
+    counts, run_seconds, oldest, reviews = await run_in_threadpool(
+        lambda: (job_queue.counts(), job_queue.run_seconds(), job_queue.oldest_queued_s(), agent.review_queue.count()))
+    lines = ["# TYPE agent_jobs gauge"]
+    lines += [f'agent_jobs{{status="{status}"}} {n}' for status, n in counts.items()]
+    lines += ["# TYPE agent_job_run_seconds summary"]
+    for kind, (n, seconds) in run_seconds.items():
+        lines += [f'agent_job_run_seconds_count{{kind="{kind}"}} {n}', f'agent_job_run_seconds_sum{{kind="{kind}"}} {seconds:.3f}']
+    lines += ["# TYPE agent_job_queue_oldest_seconds gauge", f"agent_job_queue_oldest_seconds {oldest:.3f}",
+              "# TYPE agent_reviews_pending gauge", f"agent_reviews_pending {reviews}",
+              "# TYPE agent_workers_alive gauge", f"agent_workers_alive {pool.alive if pool is not None else 0}",
+              "# TYPE agent_http_requests_total counter"]
+    requests, seconds = request_stats.snapshot()
+    lines += [f'agent_http_requests_total{{method="{m}",endpoint="{e}",code="{c}"}} {n}' for (m, e, c), n in sorted(requests.items())]
+    lines += ["# TYPE agent_http_request_seconds_sum counter"]
+    lines += [f'agent_http_request_seconds_sum{{method="{m}",endpoint="{e}"}} {s:.6f}' for (m, e), s in sorted(seconds.items())]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+async def http_error(request: Request, exc: HTTPException) -> JSONResponse:
+    return JSONResponse({"error": exc.detail}, status_code=exc.status_code)
+
+
+async def health(request: Request) -> JSONResponse:
+    return JSONResponse({"ok": True, "workers": pool.alive if pool is not None else 0})
+
+
+# ---- App ----
+pool: Optional[WorkerPool] = None
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Start WORKERS worker processes with the service (none with WORKERS=0: run worker_pool.py yourself)."""
+    global pool
+    pool = WorkerPool(WORKERS).start() if WORKERS else None
+    maintain = asyncio.create_task(_maintain_pool())
+    try:
+        yield
+    finally:
+        maintain.cancel()
+        if pool is not None:
+            await run_in_threadpool(pool.stop)
+
+
+async def _maintain_pool():
+    while True:
+        await asyncio.sleep(10)
+        if pool is not None:
+            pool.maintain()
+
+
+app = Starlette(
+    routes=[
+        Route("/emails", submit_email, methods=["POST"]),
+        Route("/jobs/{job_id}", get_job),
+        Route("/jobs/{job_id}/events", job_events),
+        Route("/conversations/{thread_id}", get_conversation),
+        Route("/conversations/{thread_id}/review", review, methods=["POST"]),
+        Route("/conversations/{thread_id}/reply", reply, methods=["POST"]),
+        Route("/slots", list_slots),
+        Route("/slots/reserve", reserve_slot, methods=["POST"]),
+        Route("/metrics", metrics),
+        Route("/healthz", health),
+    ],
+    exception_handlers={HTTPException: http_error},
+    lifespan=lifespan,
+)
+app.add_middleware(RecordRequests)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP service for the scheduling agent.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    main()
@@ -0,0 +1,354 @@
+import functools
+import heapq
+import operator
+import re
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+# ---- Ranking weights for SlotCalendar.nearest ----
+# A candidate's score is a penalty in "days": the calendar distance from the
+# requested day, plus how far its time of day is from the requested one, plus a
+# fixed penalty for a different weekday or a different doctor than asked for.
+RANK_DAY_WEIGHT = 1.0          # per day away from the requested date
+RANK_HOUR_WEIGHT = 0.25        # per hour away from the requested time of day
+RANK_WEEKDAY_PENALTY = 0.5     # not the requested weekday
+RANK_DOCTOR_PENALTY = 3.0      # a doctor was asked for and this slot is with someone else
+
+_DOCTOR = re.compile(r"\bwith ((?i:dr)\.? ?[A-Z][\w'-]*(?: [A-Z][\w'-]*)?)")
+_ROOM = re.compile(r"\bin ([A-Z][\w-]*(?: [\w-]+)?)\s*$")
+# "2026-02-21 from 10:00AM to 11.00 AM"; a time without AM / PM is taken as PM ("12:00")
+_SLOT = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2}) from (\d{1,2})[:.](\d{2})\s*(AM|PM)? to (\d{1,2})[:.](\d{2})\s*(AM|PM)?",
+    re.IGNORECASE,
+)
+
+# ---- Slot records ----
+# A slot is parsed once, when it enters the system, into epoch minutes (minutes
+# since 1970-01-01, local clock). Calendars compare and bisect those ints; the
+# datetimes and the "YYYY-MM-DD from ..." label are only built at the edges
+# (emails, UI, reservation keys).
+
+MINUTES_PER_DAY = 24 * 60
+TICK_MINUTES = 5   # time grid of resource bitmaps and of reservation claims
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_EPOCH_WEEKDAY = 3   # 1970-01-01 was a Thursday
+
+
+def day_number(day: date) -> int:
+    """Days since 1970-01-01."""
+    return day.toordinal() - _EPOCH_ORDINAL
+
+
+def to_minutes(when: datetime) -> int:
+    """Epoch minutes of a naive datetime (seconds dropped)."""
+    return day_number(when) * MINUTES_PER_DAY + when.hour * 60 + when.minute
+
+
+def from_minutes(minutes: int) -> datetime:
+    days, minute = divmod(minutes, MINUTES_PER_DAY)
+    return datetime.combine(date.fromordinal(_EPOCH_ORDINAL + days), datetime.min.time()) + timedelta(minutes=minute)
+
+
+def claim_key(resource: str, tick_min: int) -> str:
+    """Reservation key of one resource for one tick, e.g. "doctor:Dr. Smith@2026-11-02T09:05"."""
+    return f"{resource}@{from_minutes(tick_min).isoformat(timespec='minutes')}"
+
+
+def claim_ticks(start_min: int, end_min: int) -> range:
+    """Epoch minutes of the TICK_MINUTES ticks that [start_min, end_min) touches."""
+    return range(start_min - start_min % TICK_MINUTES, end_min, TICK_MINUTES)
+
+
+def _clock(minute_of_day: int) -> str:
+    hour, minute = divmod(minute_of_day % MINUTES_PER_DAY, 60)
+    return f"{hour % 12 or 12}:{minute:02d}{'AM' if hour < 12 else 'PM'}"
+
+
+class Slot:
+    """
+    An immutable bookable slot: epoch-minute start and end, plus the doctor and
+    room when the calendar tracks them. `label` is the original string, or is
+    formatted the first time something asks for it.
+    """
+
+    __slots__ = ("start_min", "end_min", "doctor", "room", "_label")
+
+    def __init__(self, start_min: int, end_min: int, doctor: Optional[str] = None, room: Optional[str] = None,
+                 label: Optional[str] = None):
+        set_ = object.__setattr__
+        set_(self, "start_min", start_min)
+        set_(self, "end_min", end_min)
+        set_(self, "doctor", doctor)
+        set_(self, "room", room)
+        set_(self, "_label", label)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Slot is immutable")
+
+    def __reduce__(self):
+        return Slot, (self.start_min, self.end_min, self.doctor, self.room, self._label)
+
+    @property
+    def day_number(self) -> int:
+        return self.start_min // MINUTES_PER_DAY
+
+    @property
+    def day(self) -> date:
+        return date.fromordinal(_EPOCH_ORDINAL + self.day_number)
+
+    @property
+    def start(self) -> datetime:
+        return from_minutes(self.start_min)
+
+    @property
+    def end(self) -> datetime:
+        return from_minutes(self.end_min)
+
+    @property
+    def label(self) -> str:
+        """"YYYY-MM-DD from H:MMAM to H:MMPM [with Dr. X [in Room]]"."""
+        if self._label is None:
+            label = f"{self.day.isoformat()} from {_clock(self.start_min)} to {_clock(self.end_min)}"
+            if self.doctor:
+                label += f" with {self.doctor}" + (f" in {self.room}" if self.room else "")
+            object.__setattr__(self, "_label", label)
+        return self._label
+
+    @property
+    def claim_keys(self) -> Tuple[str, ...]:
+        """What booking this slot ties up: its doctor and its room for every tick it covers, or
+        the time itself for a slot that names no doctor (a single-practitioner calendar).
+        Overlapping slots share ticks, whatever minute they start at."""
+        ticks = claim_ticks(self.start_min, self.end_min)
+        if not self.doctor:
+            return tuple(claim_key("slot", t) for t in ticks)
+        resources = [f"doctor:{self.doctor}"] + ([f"room:{self.room}"] if self.room else [])
+        return tuple(claim_key(resource, t) for resource in resources for t in ticks)
+
+    def _key(self):
+        return self.start_min, self.end_min, self.doctor, self.room
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Slot) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __repr__(self) -> str:
+        return f"Slot({self.label!r})"
+
+
+@functools.lru_cache(maxsize=4096)
+def _day_start(year: str, month: str, day: str) -> Optional[int]:
+    try:
+        return day_number(date(int(year), int(month), int(day))) * MINUTES_PER_DAY
+    except ValueError:
+        return None
+
+
+def _minute_of_day(hour: str, minute: str, meridiem: Optional[str]) -> Optional[int]:
+    hour, minute = int(hour), int(minute)
+    if not (1 <= hour <= 12 and minute <= 59):
+        return None
+    return (hour % 12 + (0 if meridiem and meridiem.upper() == "AM" else 12)) * 60 + minute
+
+
+def parse_slot(slot_str: str) -> Optional[Slot]:
+    """Parse a slot string ("2026-02-21 from 10:00AM to 11.00 AM [with Dr. X [in Room]]") into a Slot."""
+    match = _SLOT.search(slot_str)
+    if not match:
+        return None
+    year, month, day, h0, m0, ap0, h1, m1, ap1 = match.groups()
+    day_start = _day_start(year, month, day)
+    start, end = _minute_of_day(h0, m0, ap0), _minute_of_day(h1, m1, ap1)
+    if day_start is None or start is None or end is None:
+        return None
+    if end <= start:
+        end += MINUTES_PER_DAY   # "11:30PM to 12:00AM" ends at midnight
+    doctor = _DOCTOR.search(slot_str, match.end())
+    room = _ROOM.search(slot_str, doctor.end()) if doctor else None
+    return Slot(day_start + start, day_start + end, normalize_doctor(doctor.group(1)) if doctor else None,
+                room.group(1) if room else None, slot_str)
+
+
+def normalize_doctor(name: Optional[str]) -> Optional[str]:
+    """Canonical doctor name: "dr smith", "Dr. Smith" and "Smith" all become "Dr. Smith"."""
+    if not name or not name.strip():
+        return None
+    name = re.sub(r"^dr\.?\s*", "", name.strip(), flags=re.IGNORECASE)
+    return f"Dr. {name.title()}" if name else None
+
+
+_start = operator.attrgetter("start_min")
+
+
+class SlotCalendar:
+    """
+    Open slots indexed per day number, each day kept sorted by start minute.
+
+    Lookup, insert and remove are a dict hit plus a bisect over ints, so booking
+    cost no longer grows with the number of open slots. Accepts the plain slot
+    strings used throughout the app as well as already parsed `Slot`s.
+    """
+
+    def __init__(self, slots: Iterable["Slot | str"] = ()):
+        self._days: dict[int, List[Slot]] = {}
+        self._day_keys: List[int] = []        # sorted day numbers, for walking outward from a date
+        self._longest: dict[int, int] = {}    # longest slot per day in minutes, bounds the overlap scan
+        self._size = 0
+        for slot in slots:
+            self.add(slot)
+
+    @classmethod
+    def coerce(cls, slots) -> "SlotCalendar":
+        """Return `slots` unchanged if it already is a calendar, else index it."""
+        if isinstance(slots, cls):
+            return slots
+        return cls(slots or [])
+
+    # ---- Mutation ----
+    def add(self, slot: "Slot | str") -> Optional[Slot]:
+        """Index a slot. Unparseable strings are skipped and return None."""
+        if isinstance(slot, str):
+            slot = parse_slot(slot)
+            if slot is None:
+                return None
+        day = slot.day_number
+        if day not in self._days:
+            insort(self._day_keys, day)
+        insort(self._days.setdefault(day, []), slot, key=_start)
+        length = slot.end_min - slot.start_min
+        if length > self._longest.get(day, 0):
+            self._longest[day] = length
+        self._size += 1
+        return slot
+
+    def remove(self, slot: "Slot | str") -> bool:
+        """Remove one occurrence of `slot`; returns False if it was not open."""
+        found = self._locate(slot)
+        if found is None:
+            return False
+        day, i = found
+        del self._days[day][i]
+        self._size -= 1
+        if not self._days[day]:
+            del self._days[day]
+            del self._longest[day]
+            del self._day_keys[bisect_left(self._day_keys, day)]
+        return True
+
+    def _locate(self, slot: "Slot | str"):
+        """(day, index) of `slot` in the index, or None."""
+        if isinstance(slot, str):
+            slot = parse_slot(slot)
+            if slot is None:
+                return None
+        day = slot.day_number
+        day_slots = self._days.get(day, ())
+        i = bisect_left(day_slots, slot.start_min, key=_start)
+        while i < len(day_slots) and day_slots[i].start_min == slot.start_min:
+            if day_slots[i] == slot:
+                return day, i
+            i += 1
+        return None
+
+    # ---- Queries ----
+    def find(self, when: datetime, doctor: Optional[str] = None, specialty: Optional[str] = None,
+             busy: Optional[Set[str]] = None) -> Optional[Slot]:
+        """
+        Earliest-starting open slot whose window contains `when`. With `doctor`,
+        slots labelled with another doctor are skipped. Plain labels carry no
+        specialty, so `specialty` only matters for a ResourceCalendar. Slots
+        needing any of the `busy` claim keys (taken elsewhere) are skipped.
+        """
+        doctor = normalize_doctor(doctor)
+        minute = to_minutes(when)
+        day = minute // MINUTES_PER_DAY
+        day_slots = self._days.get(day)
+        if not day_slots:
+            return None
+        lo = bisect_left(day_slots, minute - self._longest[day], key=_start)
+        hi = bisect_right(day_slots, minute, key=_start)
+        for slot in day_slots[lo:hi]:
+            if minute < slot.end_min and (doctor is None or slot.doctor in (None, doctor)) \
+                    and not (busy and busy.intersection(slot.claim_keys)):
+                return slot
+        return None
+
+    def nearest(self, when: datetime, k: int, doctor: Optional[str] = None, specialty: Optional[str] = None,
+                not_before: Optional[datetime] = None) -> List[Slot]:
+        """
+        The `k` open slots closest to `when`, best first, none starting before
+        `not_before` (default now): slots in the past are never proposed.
+
+        Days are visited outward from the requested one; since every slot on a day
+        `n` days away scores at least n * RANK_DAY_WEIGHT, the walk stops as soon
+        as no remaining day can beat the current k-th best.
+        """
+        if k <= 0:
+            return []
+        doctor = normalize_doctor(doctor)
+        day = day_number(when)
+        minute_of_day = when.hour * 60 + when.minute
+        weekday = when.weekday()
+        floor = to_minutes(not_before or datetime.now())
+        best: List[Tuple[float, int, Slot]] = []   # max-heap of the k best via negated scores
+        seq = 0
+
+        lowest = bisect_left(self._day_keys, floor // MINUTES_PER_DAY)   # days before that are never visited
+        right = max(bisect_left(self._day_keys, day), lowest)
+        left = right - 1
+        while left >= lowest or right < len(self._day_keys):
+            # next day to visit: whichever side is closer to the requested date
+            if right < len(self._day_keys) and (left < lowest or self._day_keys[right] - day <= day - self._day_keys[left]):
+                current = self._day_keys[right]
+                right += 1
+            else:
+                current = self._day_keys[left]
+                left -= 1
+            day_penalty = abs(current - day) * RANK_DAY_WEIGHT
+            if len(best) == k and day_penalty >= -best[0][0]:
+                break
+            if (current + _EPOCH_WEEKDAY) % 7 != weekday:
+                day_penalty += RANK_WEEKDAY_PENALTY
+            day_start = current * MINUTES_PER_DAY
+            for slot in self._days[current]:
+                if slot.start_min < floor:
+                    continue
+                score = day_penalty + abs(slot.start_min - day_start - minute_of_day) / 60 * RANK_HOUR_WEIGHT
+                if doctor and slot.doctor != doctor:
+                    score += RANK_DOCTOR_PENALTY
+                seq += 1
+                if len(best) < k:
+                    heapq.heappush(best, (-score, -seq, slot))
+                elif score < -best[0][0]:
+                    heapq.heapreplace(best, (-score, -seq, slot))
+        return [slot for _, _, slot in sorted(best, key=lambda item: (-item[0], -item[1]))]
+
+    def on_date(self, day: date) -> List[Slot]:
+        """Open slots on `day`, in start order."""
+        return list(self._days.get(day_number(day), ()))
+
+    def labels(self) -> List[str]:
+        """All open slots as their original strings, in chronological order."""
+        return [slot.label for slot in self]
+
+    def copy(self) -> "SlotCalendar":
+        return SlotCalendar(self)
+
+    def __iter__(self) -> Iterator[Slot]:
+        for day in self._day_keys:
+            yield from self._days[day]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def __contains__(self, slot) -> bool:
+        return self._locate(slot) is not None
+
+    def __repr__(self) -> str:
+        return f"SlotCalendar({len(self)} slots over {len(self._days)} days)"
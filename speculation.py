@@ -0,0 +1,115 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Hashable, Optional, Tuple, Union
+
+# ---- Speculative prefetch ----
+# Starts an LLM call the graph will most likely need next before the step that
+# needs it is reached, e.g. the confirmation email while the slot is still being
+# committed. Each result is registered under a key (what, thread_id) together
+# with the input it was computed from, and the node that later needs it claims
+# it only if its real input is the same; otherwise that branch lost and is
+# cancelled. Sync runs prefetch on a small thread pool, async runs as tasks on
+# their own event loop. Both start in an empty context, so speculative calls
+# never show up in the span or the stream of the node that started them.
+
+SPECULATIVE_PREFETCH = os.environ.get("SPECULATIVE_PREFETCH", "0") == "1"
+SPECULATION_WORKERS = int(os.environ.get("SPECULATION_WORKERS", 4))   # prefetches in flight per process (sync runs)
+SPECULATION_TTL_S = 300       # an unclaimed prefetch is dropped after this
+
+Pending = Union[Future, asyncio.Future]
+
+
+class Speculator:
+    """In-flight prefetches keyed by (what, thread_id), each valid only for the input it was started from."""
+
+    def __init__(self, enabled: bool = SPECULATIVE_PREFETCH, workers: int = SPECULATION_WORKERS,
+                 ttl_s: float = SPECULATION_TTL_S):
+        self.enabled = enabled
+        self.ttl_s = ttl_s
+        self._workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pending: Dict[Hashable, Tuple[Hashable, Pending, float]] = {}   # key -> (input, future, started)
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.wasted = 0
+
+    def _register(self, key: Hashable, guess: Hashable, make) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            for stale in [k for k, (_, _, started) in self._pending.items() if now - started > self.ttl_s]:
+                self._drop(stale)
+            current = self._pending.get(key)
+            if current is not None and current[0] == guess:
+                return False   # already running for this input
+            if current is not None:
+                self._drop(key)
+            self._pending[key] = (guess, make(), now)
+            self.started += 1
+            return True
+
+    def _drop(self, key: Hashable):
+        """Cancel a losing branch: a queued call never runs, a task stops at its next await,
+        a call already running in a thread finishes and is ignored."""
+        _, pending, _ = self._pending.pop(key)
+        pending.cancel()
+        self.wasted += 1
+
+    # ---- Starting ----
+    def start(self, key: Hashable, guess: Hashable, fn, *args, **kwargs) -> bool:
+        """Run fn(*args, **kwargs) on the prefetch pool as the result for `key` if its input turns out to be `guess`."""
+        if not self.enabled:
+            return False
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="speculate")
+        return self._register(key, guess, lambda: self._pool.submit(fn, *args, **kwargs))
+
+    def astart(self, key: Hashable, guess: Hashable, coro_fn, *args, **kwargs) -> bool:
+        """Async start: coro_fn(*args, **kwargs) as a task on the running loop."""
+        if not self.enabled:
+            return False
+        loop = asyncio.get_running_loop()
+        return self._register(key, guess, lambda: loop.create_task(coro_fn(*args, **kwargs), context=contextvars.Context()))
+
+    # ---- Claiming ----
+    def claim(self, key: Hashable, guess: Hashable) -> Optional[Pending]:
+        """The prefetch for `key` if it was started from `guess`, else None (a mismatched one is cancelled)."""
+        with self._lock:
+            current = self._pending.get(key)
+            if current is None:
+                return None
+            if current[0] != guess:
+                self._drop(key)
+                return None
+            del self._pending[key]
+            self.hits += 1
+            return current[1]
+
+    def cancel(self, key: Hashable):
+        """Nothing will claim `key` any more."""
+        with self._lock:
+            if key in self._pending:
+                self._drop(key)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"started": self.started, "hits": self.hits, "wasted": self.wasted, "pending": len(self._pending)}
+
+    def reset(self):
+        with self._lock:
+            for key in list(self._pending):
+                self._drop(key)
+            self.started = self.hits = self.wasted = 0
+
+
+async def aresult(pending: Pending):
+    """Await a claimed prefetch, whether it runs as a task or on the thread pool."""
+    if isinstance(pending, asyncio.Future):
+        return await pending
+    return await asyncio.wrap_future(pending)
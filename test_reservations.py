@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from reservations import ReservationStore
+
+
+def store(tmp_path) -> ReservationStore:
+    return ReservationStore(str(tmp_path / "reservations.sqlite"))
+
+
+def test_overlapping_slots_with_different_start_minutes_conflict(tmp_path):
+    reservations = store(tmp_path)
+    assert reservations.reserve("2026-11-02 from 9:00AM to 10:00AM with Dr. Smith in Room 1", "p1")
+    assert not reservations.reserve("2026-11-02 from 9:30AM to 10:30AM with Dr. Smith in Room 1", "p2")
+    assert not reservations.reserve("2026-11-02 from 9:55AM to 10:55AM with Dr. Smith in Room 2", "p2")
+    assert not reservations.reserve("2026-11-02 from 9:30AM to 10:30AM with Dr. Lee in Room 1", "p2")
+    assert reservations.reserve("2026-11-02 from 10:00AM to 11:00AM with Dr. Smith in Room 1", "p2")
+
+
+def test_overlap_is_seen_by_taken_and_busy_during(tmp_path):
+    reservations = store(tmp_path)
+    reservations.hold(["2026-11-02 from 9:00AM to 10:00AM with Dr. Smith in Room 1"], "p1")
+    label = "2026-11-02 from 9:30AM to 10:30AM with Dr. Smith in Room 2"
+    assert reservations.taken([label], "p2") == {label: ("held", "p1")}
+    busy = reservations.busy_during(datetime(2026, 11, 2, 9, 30), datetime(2026, 11, 2, 10, 30), "p2")
+    assert "doctor:Dr. Smith@2026-11-02T09:55" in busy
+    assert "doctor:Dr. Smith@2026-11-02T10:00" not in busy
+    assert not reservations.busy_during(datetime(2026, 11, 2, 9, 30), datetime(2026, 11, 2, 10, 30), "p1")
+
+
+def test_slots_without_a_doctor_conflict_when_they_overlap(tmp_path):
+    reservations = store(tmp_path)
+    assert reservations.reserve("2026-11-02 from 9:00AM to 10:00AM", "p1")
+    assert not reservations.reserve("2026-11-02 from 9:15AM to 9:45AM", "p2")
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+# ---- Conversation threading index ----
+# Maps every Message-ID of a conversation (the patient's emails, the ones we
+# sent, the ids they reference) to its checkpointed thread_id, so a patient's
+# reply finds its conversation from its In-Reply-To / References headers with
+# one primary-key lookup per id. Message ids never move between conversations,
+# so recent ones are also kept in an in-process LRU and most replies resolve
+# without touching SQLite. For mail clients that drop those headers, each
+# conversation also records the patient's address and whether it is waiting on
+# the patient; a reply from that address goes to their most recent waiting
+# conversation.
+
+THREAD_INDEX_DB = os.environ.get("THREAD_INDEX_DB", "threads.sqlite")
+THREAD_INDEX_CACHE = 4096    # message ids kept in memory
+
+
+def _address(email: Optional[str]) -> str:
+    return (email or "").strip().lower()
+
+
+class ThreadIndex:
+    """Message-ID and patient address → thread_id, in SQLite; one connection per thread."""
+
+    def __init__(self, db_path: str = THREAD_INDEX_DB, cache_size: int = THREAD_INDEX_CACHE):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS thread_messages (
+                message_id TEXT PRIMARY KEY,
+                thread_id  TEXT NOT NULL
+            ) WITHOUT ROWID"""
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS conversations (
+                thread_id     TEXT PRIMARY KEY,
+                patient_email TEXT,
+                waiting       INTEGER NOT NULL DEFAULT 0,
+                updated_at    REAL NOT NULL
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS conversations_waiting ON conversations (patient_email, waiting, updated_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, message_id: str, thread_id: str):
+        with self._cache_lock:
+            self._cache[message_id] = thread_id
+            self._cache.move_to_end(message_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ---- Indexing ----
+    def add_messages(self, thread_id: str, message_ids: Iterable[str]):
+        """Attach message ids to `thread_id`. An id already attached elsewhere keeps its conversation."""
+        message_ids = [m for m in message_ids if m]
+        if not message_ids:
+            return
+        self._conn().executemany("INSERT OR IGNORE INTO thread_messages (message_id, thread_id) VALUES (?, ?)",
+                                 [(m, thread_id) for m in message_ids])
+
+    def set_patient(self, thread_id: str, patient_email: Optional[str]):
+        """Record the patient's address of a conversation, unless it already has one."""
+        self._conn().execute(
+            """INSERT INTO conversations (thread_id, patient_email, updated_at) VALUES (?, ?, ?)
+               ON CONFLICT(thread_id) DO UPDATE SET
+                   patient_email = COALESCE(conversations.patient_email, excluded.patient_email)""",
+            (thread_id, _address(patient_email) or None, time.time()),
+        )
+
+    def set_waiting(self, thread_id: str, waiting: bool, patient_email: Optional[str] = None):
+        """Mark a conversation as waiting (or no longer waiting) on the patient's reply."""
+        self._conn().execute(
+            """INSERT INTO conversations (thread_id, patient_email, waiting, updated_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(thread_id) DO UPDATE SET
+                   patient_email = COALESCE(conversations.patient_email, excluded.patient_email),
+                   waiting = excluded.waiting,
+                   updated_at = excluded.updated_at""",
+            (thread_id, _address(patient_email) or None, int(waiting), time.time()),
+        )
+
+    # ---- Lookup ----
+    def by_message(self, message_ids: Iterable[str]) -> Optional[str]:
+        """Conversation of the first of `message_ids` we know, e.g. a reply's In-Reply-To then References."""
+        conn = None
+        for message_id in message_ids:
+            with self._cache_lock:
+                thread_id = self._cache.get(message_id)
+            if thread_id is None:
+                conn = conn or self._conn()
+                row = conn.execute("SELECT thread_id FROM thread_messages WHERE message_id = ?", (message_id,)).fetchone()
+                if row is None:
+                    continue
+                thread_id = row[0]
+            self._remember(message_id, thread_id)
+            return thread_id
+        return None
+
+    def waiting_for(self, patient_email: Optional[str]) -> Optional[str]:
+        """Most recent conversation of `patient_email` that waits on the patient."""
+        address = _address(patient_email)
+        if not address:
+            return None
+        row = self._conn().execute(
+            "SELECT thread_id FROM conversations WHERE patient_email = ? AND waiting = 1"
+            " ORDER BY updated_at DESC LIMIT 1",
+            (address,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def resolve(self, message_ids: Iterable[str], patient_email: Optional[str] = None) -> Optional[str]:
+        """Conversation a reply belongs to: by its headers, else the sender's waiting conversation."""
+        return self.by_message(message_ids) or self.waiting_for(patient_email)
@@ -0,0 +1,234 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+# ---- Per-node spans ----
+# One span per graph node run: wall time, time spent inside LLM calls, number of
+# calls and cache hits, prompt / completion tokens, retries, field repairs,
+# escalations to the large model and outcome. Nodes are wrapped with
+# Tracer.traced(); LLM helpers report into whatever span is current (a context
+# var, so it follows asyncio tasks). Finished spans go to every exporter: a
+# bounded in-memory collector the UI reads, and optionally a JSON lines file
+# (TRACE_JSONL).
+
+TRACE_JSONL = os.environ.get("TRACE_JSONL")
+
+_current: "contextvars.ContextVar[Optional[dict]]" = contextvars.ContextVar("current_span", default=None)
+
+
+def new_span(name: str, trace_id: Optional[str]) -> dict:
+    return {
+        "trace_id": trace_id,
+        "span": name,
+        "start_ts": time.time(),
+        "wall_ms": 0.0,
+        "llm_ms": 0.0,
+        "llm_calls": 0,
+        "cache_hits": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "retries": 0,
+        "repairs": 0,
+        "escalations": 0,
+        "status": "ok",
+        "error": None,
+    }
+
+
+# ---- Exporters ----
+class SpanCollector:
+    """Keeps the most recent `max_spans` spans in memory, queryable by trace or node."""
+
+    def __init__(self, max_spans: int = 10_000):
+        self._spans: "deque[dict]" = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, span: dict):
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self, trace_id: Optional[str] = None, node: Optional[str] = None) -> List[dict]:
+        with self._lock:
+            spans = list(self._spans)
+        return [s for s in spans if (trace_id is None or s["trace_id"] == trace_id) and (node is None or s["span"] == node)]
+
+    def timings(self, trace_id: str) -> Dict[str, float]:
+        """Total wall ms per node for one conversation."""
+        out: Dict[str, float] = {}
+        for span in self.spans(trace_id):
+            out[span["span"]] = round(out.get(span["span"], 0.0) + span["wall_ms"], 3)
+        return out
+
+    def summary(self) -> Dict[str, dict]:
+        """Per-node aggregates over everything collected."""
+        by_node: Dict[str, List[dict]] = {}
+        for span in self.spans():
+            by_node.setdefault(span["span"], []).append(span)
+        out = {}
+        for node, spans in sorted(by_node.items()):
+            walls = [s["wall_ms"] for s in spans]
+            out[node] = {
+                "n": len(spans),
+                "wall_p50_ms": round(statistics.median(walls), 3),
+                "wall_mean_ms": round(statistics.fmean(walls), 3),
+                "llm_mean_ms": round(statistics.fmean(s["llm_ms"] for s in spans), 3),
+                "prompt_tokens": sum(s["prompt_tokens"] for s in spans),
+                "completion_tokens": sum(s["completion_tokens"] for s in spans),
+                "retries": sum(s["retries"] for s in spans),
+                "repairs": sum(s.get("repairs", 0) for s in spans),
+                "escalations": sum(s.get("escalations", 0) for s in spans),
+                "errors": sum(s["status"] == "error" for s in spans),
+            }
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+class JsonlExporter:
+    """Appends one JSON object per span to `path`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: dict):
+        line = json.dumps(span, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+# ---- Token usage ----
+class TokenUsageHandler(BaseCallbackHandler):
+    """Adds token counts and retries reported by the chat model to the current span."""
+
+    run_inline = True   # async callbacks run in the caller's context, so the span context var is visible
+
+    def __init__(self, tracer: "Tracer"):
+        self.tracer = tracer
+
+    def on_llm_end(self, response, **kwargs):
+        prompt = completion = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt += usage.get("input_tokens", 0)
+                    completion += usage.get("output_tokens", 0)
+        if not (prompt or completion):
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        self.tracer.add_tokens(prompt, completion)
+
+    def on_retry(self, retry_state, **kwargs):
+        self.tracer.retry()
+
+
+# ---- Tracer ----
+class Tracer:
+    def __init__(self, exporters=()):
+        self.exporters = list(exporters)
+        self.token_handler = TokenUsageHandler(self)
+
+    def _finish(self, span: dict, started: float):
+        span["wall_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        span["llm_ms"] = round(span["llm_ms"], 3)
+        for exporter in self.exporters:
+            exporter.export(span)
+
+    @contextmanager
+    def span(self, name: str, trace_id: Optional[str] = None):
+        span = new_span(name, trace_id)
+        token = _current.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            # interrupt() pauses the graph by raising; that is not a failure
+            span["status"] = "interrupted" if type(e).__name__ == "GraphInterrupt" else "error"
+            span["error"] = None if span["status"] == "interrupted" else f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(span, started)
+
+    def traced(self, name: str) -> Callable:
+        """Decorator for a graph node (sync or async) taking the state first."""
+        def decorate(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_node(state, *args, **kwargs):
+                    with self.span(name, state.get("thread_id")):
+                        return await func(state, *args, **kwargs)
+                return async_node
+
+            @functools.wraps(func)
+            def node(state, *args, **kwargs):
+                with self.span(name, state.get("thread_id")):
+                    return func(state, *args, **kwargs)
+            return node
+        return decorate
+
+    @contextmanager
+    def llm_call(self, calls: int = 1):
+        """Time an LLM round-trip (or a batch of `calls`) into the current span."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            span = _current.get()
+            if span is not None:
+                span["llm_ms"] += (time.perf_counter() - started) * 1000
+                span["llm_calls"] += calls
+
+    def cache_hit(self):
+        span = _current.get()
+        if span is not None:
+            span["cache_hits"] += 1
+
+    def retry(self):
+        span = _current.get()
+        if span is not None:
+            span["retries"] += 1
+
+    def repair(self):
+        """A structured answer's invalid fields were asked for again."""
+        span = _current.get()
+        if span is not None:
+            span["repairs"] += 1
+
+    def escalation(self):
+        """A small-model answer was redone on the large model."""
+        span = _current.get()
+        if span is not None:
+            span["escalations"] += 1
+
+    def add_tokens(self, prompt: int, completion: int):
+        span = _current.get()
+        if span is not None:
+            span["prompt_tokens"] += prompt
+            span["completion_tokens"] += completion
+
+
+span_collector = SpanCollector()
+tracer = Tracer([span_collector] + ([JsonlExporter(TRACE_JSONL)] if TRACE_JSONL else []))
+
+# Attach the token handler to every callback manager LangChain configures, so LLM
+# calls keep their parent run's callbacks (graph streaming, LangSmith) and still
+# report usage here.
+_token_handler_var: "contextvars.ContextVar[Optional[TokenUsageHandler]]" = contextvars.ContextVar(
+    "token_usage_handler", default=tracer.token_handler
+)
+register_configure_hook(_token_handler_var, inheritable=True)
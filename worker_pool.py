@@ -0,0 +1,370 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from tracing import span_collector
+
+logger = logging.getLogger(__name__)
+
+# ---- Background worker pool ----
+# Agent runs happen in worker processes, not in the Streamlit script. The UI
+# puts a job into JOBS_DB and polls it; a worker claims it with one UPDATE ...
+# RETURNING (SQLite's write lock is the only coordination), runs run_agent /
+# resume_agent / run_agent_many and writes the result back. A browser that
+# disconnects does not stop the run, and throughput grows with WORKERS, not with
+# open tabs. Checkpoints, reservations and the review queue are already shared
+# SQLite files, so a thread a worker paused can be reviewed or resumed by any
+# process, and its progress read from its checkpoint while it runs. Bookings live
+# only in the reservation store: each job gets a fresh calendar of opening hours,
+# so no worker keeps a private view of what is booked. RUN jobs go through
+# stream_agent and keep their progress (nodes finished, the email an LLM is
+# still writing) on the job row, for the pipeline panel and /jobs/{id}/events. A running job holds
+# a lease that its worker renews; if the worker dies, the job is handed out again
+# once the lease runs out, up to JOB_MAX_ATTEMPTS times.
+
+JOBS_DB = os.environ.get("JOBS_DB", "jobs.sqlite")
+WORKERS = int(os.environ.get("WORKERS", 2))            # processes the UI starts; 0 = run `python worker_pool.py` yourself
+JOB_LEASE_S = float(os.environ.get("JOB_LEASE_S", 60))  # a running job whose worker stopped renewing is retried after this
+JOB_MAX_ATTEMPTS = 3
+WORKER_POLL_S = 0.25                                    # pause of an idle worker between claims
+PROGRESS_EVERY_S = 0.25                                 # at most one progress write per this while an LLM streams
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Job kinds
+RUN = "run"          # {"raw_email", "thread_id"?}, streamed: its progress is kept on the job row
+RESUME = "resume"    # {"thread_id", "updates"?}
+BATCH = "batch"      # {"emails": [raw_email, ...], "thread_ids": [...]}, one run_agent_many pass
+REVIEW = "review"    # {"thread_id", "approved", "draft_email"?, "feedback"?}
+
+# Oldest queued job, or a running one whose lease ran out, becomes `worker`'s
+_CLAIM = """
+    UPDATE jobs SET status = 'running', worker = :worker, attempts = attempts + 1,
+                    started_at = :now, lease_expires = :lease
+    WHERE job_id = (
+        SELECT job_id FROM jobs
+        WHERE status = 'queued' OR (status = 'running' AND lease_expires <= :now)
+        ORDER BY created_at LIMIT 1
+    )
+    RETURNING job_id, kind, payload, attempts
+"""
+
+
+class JobQueue:
+    """SQLite job table shared by the UI and the workers; one connection per thread."""
+
+    def __init__(self, db_path: str = JOBS_DB, lease_s: float = JOB_LEASE_S, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._conn().execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                job_id        TEXT PRIMARY KEY,
+                kind          TEXT NOT NULL,
+                payload       TEXT NOT NULL,
+                status        TEXT NOT NULL,
+                result        TEXT,
+                progress      TEXT,
+                error         TEXT,
+                worker        TEXT,
+                attempts      INTEGER NOT NULL DEFAULT 0,
+                created_at    REAL NOT NULL,
+                started_at    REAL,
+                finished_at   REAL,
+                lease_expires REAL
+            )"""
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        if "progress" not in {row["name"] for row in self._conn().execute("PRAGMA table_info(jobs)")}:
+            self._conn().execute("ALTER TABLE jobs ADD COLUMN progress TEXT")   # tables from before streaming
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- Producer side ----
+    def submit(self, kind: str, payload: dict) -> str:
+        """Queue a job; returns its id."""
+        job_id = uuid.uuid4().hex
+        self._conn().execute(
+            "INSERT INTO jobs (job_id, kind, payload, status, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), QUEUED, time.time()),
+        )
+        return job_id
+
+    def submit_many(self, kind: str, payloads: List[dict]) -> List[str]:
+        """Queue several jobs in one transaction; returns their ids in order."""
+        now = time.time()
+        rows = [(uuid.uuid4().hex, kind, json.dumps(payload), QUEUED, now) for payload in payloads]
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT INTO jobs (job_id, kind, payload, status, created_at) VALUES (?, ?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [row[0] for row in rows]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def finished(self, job_ids: Iterable[str]) -> Dict[str, dict]:
+        """The done or failed jobs among `job_ids`, by id."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return {}
+        rows = self._conn().execute(
+            f"SELECT * FROM jobs WHERE status IN (?, ?) AND job_id IN ({','.join('?' * len(job_ids))})",
+            (DONE, FAILED, *job_ids),
+        ).fetchall()
+        return {row["job_id"]: self._row(row) for row in rows}
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys((QUEUED, RUNNING, DONE, FAILED), 0)
+        counts.update(self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return counts
+
+    def run_seconds(self) -> Dict[str, Tuple[int, float]]:
+        """Per job kind: how many finished and their total run time in seconds."""
+        rows = self._conn().execute(
+            "SELECT kind, COUNT(*), TOTAL(finished_at - started_at) FROM jobs"
+            " WHERE status IN (?, ?) AND started_at IS NOT NULL GROUP BY kind",
+            (DONE, FAILED),
+        ).fetchall()
+        return {kind: (n, seconds) for kind, n, seconds in rows}
+
+    def oldest_queued_s(self) -> float:
+        """How long the oldest queued job has been waiting (0 when none is)."""
+        row = self._conn().execute("SELECT MIN(created_at) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()
+        return time.time() - row[0] if row[0] is not None else 0.0
+
+    def purge(self, older_than_s: float = 7 * 24 * 3600) -> int:
+        """Drop finished jobs older than `older_than_s`."""
+        cur = self._conn().execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                                   (DONE, FAILED, time.time() - older_than_s))
+        return cur.rowcount
+
+    # ---- Worker side ----
+    def claim(self, worker: str) -> Optional[dict]:
+        """Take the next job for `worker`, or None. Jobs out of attempts are failed on the way."""
+        while True:
+            now = time.time()
+            rows = self._conn().execute(_CLAIM, {"worker": worker, "now": now, "lease": now + self.lease_s}).fetchall()
+            if not rows:
+                return None
+            row = rows[0]   # fetchall() steps the statement to its end, which commits the claim
+            if row["attempts"] > self.max_attempts:
+                self.fail(row["job_id"], f"gave up after {self.max_attempts} attempts")
+                continue
+            return {"job_id": row["job_id"], "kind": row["kind"], "payload": json.loads(row["payload"]),
+                    "attempts": row["attempts"]}
+
+    def renew(self, job_id: str, worker: str) -> bool:
+        """Extend the lease of a job `worker` is still running; False if it was handed to someone else."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND worker = ? AND status = ?",
+            (time.time() + self.lease_s, job_id, worker, RUNNING),
+        )
+        return cur.rowcount == 1
+
+    def report(self, job_id: str, progress: dict, worker: str):
+        """Store how far a running job got (see _run), while it is still `worker`'s."""
+        self._conn().execute(
+            "UPDATE jobs SET progress = ? WHERE job_id = ? AND worker = ? AND status = ?",
+            (json.dumps(progress), job_id, worker, RUNNING),
+        )
+
+    def finish(self, job_id: str, result: dict, worker: Optional[str] = None):
+        """Store the result. With `worker`, only if the job is still that worker's."""
+        self._conn().execute(
+            """UPDATE jobs SET status = ?, result = ?, finished_at = ?, lease_expires = NULL
+               WHERE job_id = ? AND (? IS NULL OR worker = ?)""",
+            (DONE, json.dumps(result, default=str), time.time(), job_id, worker, worker),
+        )
+
+    def fail(self, job_id: str, error: str, worker: Optional[str] = None):
+        self._conn().execute(
+            """UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_expires = NULL
+               WHERE job_id = ? AND (? IS NULL OR worker = ?)""",
+            (FAILED, error, time.time(), job_id, worker, worker),
+        )
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["progress"] = json.loads(job["progress"]) if job["progress"] else None
+        return job
+
+
+job_queue = JobQueue()
+
+
+# ---- Workers ----
+def _run(agent, payload: dict, calendar, report: Callable[[dict], None]) -> dict:
+    """
+    run_agent through stream_agent: after every node, and while an LLM writes the
+    email, `report` gets {"done": [nodes finished], "node": <node writing>, "draft": <text so far>}.
+    """
+    progress = {"done": [], "node": None, "draft": ""}
+    tokens, reported = "", 0.0
+    for event in agent.stream_agent(payload["raw_email"], calendar, payload.get("thread_id")):
+        if event["type"] == "node":
+            progress["done"].append(event["node"])
+            progress["node"], tokens = None, ""
+            report(progress)
+            reported = time.monotonic()
+        elif event["type"] == "token" and event["node"] in agent.EMAIL_NODES.values():
+            tokens += event["text"]
+            progress["node"], progress["draft"] = event["node"], agent.partial_json_field(tokens, "body")
+            if time.monotonic() - reported >= PROGRESS_EVERY_S:
+                report(progress)
+                reported = time.monotonic()
+        elif event["type"] == "done":
+            return event["result"]
+    raise RuntimeError("stream_agent ended without a result")
+
+
+def _resume(agent, payload: dict, calendar, report) -> dict:
+    return agent.resume_agent(payload["thread_id"], calendar, payload.get("updates"))
+
+
+def _batch(agent, payload: dict, calendar, report) -> dict:
+    # the thread_ids come with the job, so a retry after a worker died redoes the same conversations
+    return agent.run_agent_many(payload["emails"], calendar, payload.get("thread_ids"))
+
+
+def _review(agent, payload: dict, calendar, report) -> dict:
+    return agent.review_draft(payload["thread_id"], calendar, payload["approved"], payload.get("draft_email"),
+                              payload.get("feedback"))
+
+
+JOB_KINDS: Dict[str, Callable] = {RUN: _run, RESUME: _resume, BATCH: _batch, REVIEW: _review}
+
+
+def run_job(agent, job: dict, calendar, report: Optional[Callable[[dict], None]] = None) -> dict:
+    """Run one claimed job; the result is what the UI gets back (JSON-safe, plus per-node wall ms).
+    `report` receives the progress of jobs that stream it."""
+    payload = job["payload"]
+    if payload.get("slots") is not None:
+        from slot_calendar import SlotCalendar
+        calendar = SlotCalendar.coerce(payload["slots"])
+    result = JOB_KINDS[job["kind"]](agent, payload, calendar, report or (lambda progress: None))
+    result = {k: v for k, v in result.items() if not k.startswith("__")}   # the pending interrupt stays in the checkpoint
+    if result.get("thread_id"):
+        result["step_ms"] = span_collector.timings(result["thread_id"])
+    return result
+
+
+def _renew_while(jobs: JobQueue, job_id: str, worker: str, done: threading.Event):
+    while not done.wait(jobs.lease_s / 3):
+        if not jobs.renew(job_id, worker):
+            logger.warning("lost the lease of job %s", job_id)
+            return
+
+
+def work(worker: str, db_path: str = JOBS_DB, stop=None, poll_s: float = WORKER_POLL_S):
+    """Worker loop: claim a job, run it on the agent, store its result; until `stop` is set."""
+    import agent   # in the worker process, so the UI process never loads a model for it
+    from availability_rules import RuleCalendar, load_rules
+
+    jobs = JobQueue(db_path)
+    rules = load_rules()
+    agent.llm_router.warm_up()
+    while stop is None or not stop.is_set():
+        job = jobs.claim(worker)
+        if job is None:
+            time.sleep(poll_s)
+            continue
+        done = threading.Event()
+        threading.Thread(target=_renew_while, args=(jobs, job["job_id"], worker, done), daemon=True).start()
+        try:
+            # a fresh calendar knows opening hours only; what is booked is read from reservations.py
+            report = lambda progress, job_id=job["job_id"]: jobs.report(job_id, progress, worker)
+            jobs.finish(job["job_id"], run_job(agent, job, RuleCalendar(rules), report), worker)
+        except Exception as e:
+            logger.exception("job %s failed", job["job_id"])
+            jobs.fail(job["job_id"], f"{type(e).__name__}: {e}", worker)
+        finally:
+            done.set()
+
+
+def _worker_main(name: str, db_path: str, stop):
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"))
+    work(f"{name}:{os.getpid()}", db_path, stop)
+
+
+class WorkerPool:
+    """`workers` spawned processes running work(); maintain() replaces any that died."""
+
+    def __init__(self, workers: int = WORKERS, db_path: str = JOBS_DB):
+        self.workers = workers
+        self.db_path = db_path
+        self._ctx = multiprocessing.get_context("spawn")   # never fork a process that runs threads
+        self._stop = self._ctx.Event()
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+
+    def start(self) -> "WorkerPool":
+        self.maintain()
+        return self
+
+    def maintain(self):
+        for i, process in enumerate(self.processes):
+            if process is None or not process.is_alive():
+                if process is not None:
+                    logger.warning("worker-%d exited with %s, restarting", i, process.exitcode)
+                process = self._ctx.Process(target=_worker_main, args=(f"worker-{i}", self.db_path, self._stop),
+                                            name=f"worker-{i}", daemon=True)
+                process.start()
+                self.processes[i] = process
+
+    @property
+    def alive(self) -> int:
+        return sum(1 for p in self.processes if p is not None and p.is_alive())
+
+    def stop(self, timeout: float = 30):
+        """Let every worker finish its current job, then exit."""
+        self._stop.set()
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run agent jobs queued by the UI.")
+    parser.add_argument("--workers", type=int, default=max(WORKERS, 1), help="worker processes")
+    args = parser.parse_args(argv)
+
+    pool = WorkerPool(args.workers).start()
+    try:
+        while True:
+            time.sleep(10)
+            pool.maintain()
+            logger.info("workers: %d alive, jobs: %s", pool.alive, job_queue.counts())
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()